@@ -0,0 +1,31 @@
+"""Measure content-defined chunking throughput and how well chunks survive an edit.
+
+Run from the repository root:
+    python -m benchmarks.bench_chunking
+"""
+import os
+import time
+from file_layer.sharding import gear_hashes, split_content_defined, split_data
+from file_layer.config import CDC_AVG_SIZE
+
+def main(file_size: int = 32 * 1024 * 1024, repeats: int = 3) -> None:
+    data = os.urandom(file_size)
+    edited = data[:1000] + b"\0" + data[1000:]
+
+    print(f"{'stage':<22}{'MB/s':>10}")
+    for name, func in (("gear hash", gear_hashes), ("cdc split", split_content_defined)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            func(data)
+        elapsed = (time.perf_counter() - start) / repeats
+        print(f"{name:<22}{file_size / elapsed / 1e6:>10.2f}")
+
+    print(f"\n{'strategy':<22}{'chunks':>10}{'reused':>10}")
+    for name, split in (("fixed", lambda d: split_data(d, CDC_AVG_SIZE)), ("cdc", split_content_defined)):
+        before = set(split(data))
+        after = split(edited)
+        reused = sum(chunk in before for chunk in after)
+        print(f"{name:<22}{len(after):>10}{reused / len(after):>10.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Compare shard encryption throughput of per-shard RSA-OAEP and envelope (AES-GCM) mode.
+
+Run from the repository root:
+    python -m benchmarks.bench_encryption
+"""
+import os
+import time
+from Crypto.PublicKey import RSA
+from file_layer.encryption import encrypt_data, decrypt_data, generate_data_key, wrap_data_key
+
+# Largest plaintext PKCS1_OAEP (SHA-1) accepts with a 2048-bit key
+RSA_BLOCK_SIZE = 2048 // 8 - 2 * 20 - 2
+
+def _throughput(func, blocks, plaintext_size: int) -> float:
+    """Run func over every block and return MB/s of plaintext processed."""
+    start = time.perf_counter()
+    for block in blocks:
+        func(block)
+    elapsed = time.perf_counter() - start
+    return plaintext_size / elapsed / 1e6
+
+def main(total_size: int = 1 << 20, shard_size: int = 64 * 1024) -> None:
+    private_key = RSA.generate(2048).export_key()
+    data_key = generate_data_key()
+    wrap_data_key(data_key, private_key)
+
+    # RSA can only take key-size-minus-padding bytes at a time; benchmark a smaller slice
+    rsa_blocks = [os.urandom(RSA_BLOCK_SIZE) for _ in range(max(1, (total_size // 16) // RSA_BLOCK_SIZE))]
+    rsa_ciphertexts = [encrypt_data(block, private_key) for block in rsa_blocks]
+    aes_blocks = [os.urandom(shard_size) for _ in range(total_size // shard_size)]
+    aes_ciphertexts = [encrypt_data(block, private_key, data_key) for block in aes_blocks]
+    rsa_size = len(rsa_blocks) * RSA_BLOCK_SIZE
+    aes_size = len(aes_blocks) * shard_size
+
+    print(f"{'mode':<10}{'op':<10}{'MB/s':>12}")
+    print(f"{'rsa':<10}{'encrypt':<10}{_throughput(lambda b: encrypt_data(b, private_key), rsa_blocks, rsa_size):>12.3f}")
+    print(f"{'rsa':<10}{'decrypt':<10}{_throughput(lambda b: decrypt_data(b, private_key), rsa_ciphertexts, rsa_size):>12.3f}")
+    print(f"{'envelope':<10}{'encrypt':<10}{_throughput(lambda b: encrypt_data(b, private_key, data_key), aes_blocks, aes_size):>12.3f}")
+    print(f"{'envelope':<10}{'decrypt':<10}{_throughput(lambda b: decrypt_data(b, private_key, data_key), aes_ciphertexts, aes_size):>12.3f}")
+
+if __name__ == "__main__":
+    main()
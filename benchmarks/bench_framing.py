@@ -0,0 +1,53 @@
+"""Compare shard transfer as hex inside legacy JSON messages and as binary frames.
+
+Shards are sent over a local socket pair in the #STORE_SHARD message shape and
+decoded back to bytes on the other end, once per wire format. Bytes on the
+wire include headers and metadata.
+
+Run from the repository root:
+    python -m benchmarks.bench_framing
+"""
+import os
+import socket
+import threading
+import time
+from network_layer.framing import MESSAGE, pack_legacy, read_message, write_frame
+
+def _legacy_send(conn: socket.socket, index: int, shard: bytes) -> int:
+    message = pack_legacy({"title": "#STORE_SHARD", "message": {"file_id": "bench", "shard_index": index, "shard_data": shard.hex()}})
+    conn.sendall(message)
+    return len(message)
+
+def _framed_send(conn: socket.socket, index: int, shard: bytes) -> int:
+    return write_frame(conn, MESSAGE, index + 1, {"title": "#STORE_SHARD", "message": {"file_id": "bench", "shard_index": index}}, shard)
+
+def _received_shard(reader) -> bytes:
+    frame = read_message(reader)
+    return frame.payload if frame.version else bytes.fromhex(frame.metadata["message"]["shard_data"])
+
+def _transfer(send, shards) -> tuple:
+    sender, receiver = socket.socketpair()
+    wire = []
+    thread = threading.Thread(target=lambda: wire.extend(send(sender, index, shard) for index, shard in enumerate(shards)))
+    start = time.perf_counter()
+    thread.start()
+    with receiver.makefile("rb") as reader:
+        for shard in shards:
+            assert _received_shard(reader) == shard
+    elapsed = time.perf_counter() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    return sum(wire), elapsed
+
+def main(shard_size: int = 1024 * 1024, shard_count: int = 64) -> None:
+    shards = [os.urandom(shard_size) for _ in range(shard_count)]
+    data_size = shard_size * shard_count
+    print(f"{shard_count} shards of {shard_size} bytes")
+    print(f"{'format':<10}{'wire bytes':>14}{'overhead':>10}{'MB/s':>10}")
+    for name, send in (("json-hex", _legacy_send), ("frames", _framed_send)):
+        wire, elapsed = _transfer(send, shards)
+        print(f"{name:<10}{wire:>14}{wire / data_size:>9.3f}x{data_size / elapsed / 1e6:>10.1f}")
+
+if __name__ == "__main__":
+    main()
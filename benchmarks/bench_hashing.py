@@ -0,0 +1,44 @@
+"""Compare the hash algorithms of file_layer.hashing for file IDs, shard keys and proofs.
+
+File IDs hash one large buffer; shard keys and proofs hash many shards, once on
+one thread and once on a thread per core to show how much the GIL is released.
+Algorithms whose package is missing (blake3) are skipped.
+
+Run from the repository root:
+    python -m benchmarks.bench_hashing
+"""
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import time
+from file_layer.hashing import HASH_ALGOS, hash_file, keyed_digest, new_hash, shard_key
+
+def _throughput(func, size: int, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return size * repeats / (time.perf_counter() - start) / 1e6
+
+def main(file_size: int = 64 * 1024 * 1024, shard_size: int = 1024 * 1024, repeats: int = 3) -> None:
+    data = os.urandom(file_size)
+    shards = [data[i:i + shard_size] for i in range(0, file_size, shard_size)]
+    salt = os.urandom(16)
+    threads = os.cpu_count() or 1
+
+    print(f"{'algorithm':<12}{'file ID MB/s':>14}{'keys MB/s':>12}{f'x{threads} thr':>10}{'proofs MB/s':>13}{f'x{threads} thr':>10}")
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for algo in HASH_ALGOS:
+            try:
+                new_hash(algo)
+            except ValueError:
+                print(f"{algo:<12}{'not installed':>14}")
+                continue
+            file_id = _throughput(lambda: hash_file(io.BytesIO(data), algo), file_size, repeats)
+            keys = _throughput(lambda: [shard_key(shard, algo) for shard in shards], file_size, repeats)
+            keys_threaded = _throughput(lambda: list(pool.map(lambda shard: shard_key(shard, algo), shards)), file_size, repeats)
+            proofs = _throughput(lambda: [keyed_digest(salt, shard, salt, algo) for shard in shards], file_size, repeats)
+            proofs_threaded = _throughput(lambda: list(pool.map(lambda shard: keyed_digest(salt, shard, salt, algo), shards)), file_size, repeats)
+            print(f"{algo:<12}{file_id:>14.1f}{keys:>12.1f}{keys_threaded:>10.1f}{proofs:>13.1f}{proofs_threaded:>10.1f}")
+
+if __name__ == "__main__":
+    main()
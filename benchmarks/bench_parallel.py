@@ -0,0 +1,34 @@
+"""Measure Distribute and Assimilate throughput as the number of shard workers grows.
+
+Run from the repository root:
+    python -m benchmarks.bench_parallel
+"""
+import io
+import os
+import time
+from Crypto.PublicKey import RSA
+from file_layer import DistributeStream, AssimilateStream
+from file_layer.file_retrieval import TIMING_STAGES
+
+def main(file_size: int = 16 * 1024 * 1024, num_shards: int = 64) -> None:
+    private_key = RSA.generate(2048).export_key()
+    data = os.urandom(file_size)
+    worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+
+    print(f"{'backend':<10}{'workers':>8}{'up MB/s':>10}{'down MB/s':>11}" + "".join(f"{stage:>14}" for stage in TIMING_STAGES))
+    for backend in ("process", "thread"):
+        for workers in worker_counts:
+            stream = DistributeStream(io.BytesIO(data), private_key, num_shards=num_shards, max_memory=None, workers=workers, backend=backend)
+            start = time.perf_counter()
+            shards = list(stream)
+            upload = time.perf_counter() - start
+
+            timings = {}
+            start = time.perf_counter()
+            for _ in AssimilateStream(shards, stream.shard_mapping, private_key, workers=workers, backend=backend, timings=timings):
+                pass
+            download = time.perf_counter() - start
+            print(f"{backend:<10}{workers:>8}{file_size / upload / 1e6:>10.2f}{file_size / download / 1e6:>11.2f}" + "".join(f"{timings[stage]:>13.3f}s" for stage in TIMING_STAGES))
+
+if __name__ == "__main__":
+    main()
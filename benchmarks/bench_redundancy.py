@@ -0,0 +1,31 @@
+"""Compare Reed-Solomon throughput of the reedsolo and NumPy codecs.
+
+Run from the repository root:
+    python -m benchmarks.bench_redundancy
+"""
+import os
+import time
+from file_layer.config import DEFAULT_ERROR_CORRECTION
+from file_layer.redundancy import create_codec
+
+SIZES = [1024, 64 * 1024, 1024 * 1024]
+
+def _throughput(func, data: bytes, size: int) -> float:
+    """Run func on data and return MB/s relative to size bytes of payload."""
+    start = time.perf_counter()
+    func(data)
+    return size / (time.perf_counter() - start) / 1e6
+
+def main() -> None:
+    print(f"{'codec':<10}{'size':>10}{'encode MB/s':>14}{'decode MB/s':>14}")
+    for size in SIZES:
+        data = os.urandom(size)
+        for name in ("reedsolo", "numpy"):
+            codec = create_codec(DEFAULT_ERROR_CORRECTION, name)
+            encoded = codec.encode(data)
+            encode_rate = _throughput(codec.encode, data, size)
+            decode_rate = _throughput(codec.decode, encoded, size)
+            print(f"{name:<10}{size:>10}{encode_rate:>14.2f}{decode_rate:>14.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Benchmark suite for the file_layer pipeline, with machine-readable results.
+
+Each case runs in a fresh process so its peak RSS is its own. A case is timed
+`repeats` times for throughput, then run once more under tracemalloc to record
+its peak allocated bytes and the blocks it leaves allocated. Results are
+printed as a table and written as JSON; pass an earlier results file with
+--compare to see the change.
+
+Run from the repository root:
+    python -m benchmarks.bench_suite
+    python -m benchmarks.bench_suite --sizes 1K,1M,64M,1G --output results.json
+    python -m benchmarks.bench_suite --stages distribute,assimilate --compare results.json
+
+Distribute and Assimilate use the configured Reed-Solomon level; the
+--ecc levels apply to the encode_file and decode_shard stages, and the
+--hash-algos to generate_proof.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+STAGES = ("distribute", "assimilate", "encode_file", "decode_shard", "encrypt_data", "split_data", "generate_proof")
+SIZE_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+def parse_size(text: str) -> int:
+    """Parse sizes such as 1K, 64M or 1G."""
+    text = text.strip().upper()
+    if text[-1] in SIZE_UNITS:
+        return int(text[:-1]) * SIZE_UNITS[text[-1]]
+    return int(text)
+
+def _prepare(case: Dict[str, Any]) -> Callable[[], Any]:
+    """Build the inputs of a case and return the call to measure; runs in the case's process."""
+    from Crypto.PublicKey import RSA
+    from file_layer import Assimilate, Distribute, generate_proof, proofs
+    from file_layer.encryption import encrypt_data, generate_data_key
+    from file_layer.redundancy import create_codec
+    from file_layer.sharding import split_data
+
+    stage = case["stage"]
+    data = os.urandom(case["size"])
+    if stage in ("distribute", "assimilate"):
+        private_key = RSA.generate(2048).export_key()
+        if stage == "distribute":
+            return lambda: Distribute(io.BytesIO(data), private_key, num_shards=case["shards"], parity_shards=case["parity"], workers=case["workers"])
+        shards, mapping = Distribute(io.BytesIO(data), private_key, num_shards=case["shards"], parity_shards=case["parity"], workers=case["workers"])
+        return lambda: Assimilate(shards, mapping, private_key, workers=case["workers"])
+    if stage in ("encode_file", "decode_shard"):
+        codec = create_codec(case["ecc"])
+        if stage == "encode_file":
+            return lambda: codec.encode(data)
+        encoded = codec.encode(data)
+        return lambda: codec.decode(encoded)
+    if stage == "encrypt_data":
+        private_key = RSA.generate(2048).export_key()
+        data_key = generate_data_key()
+        return lambda: encrypt_data(data, private_key, data_key)
+    if stage == "split_data":
+        shard_size = max(1, -(-len(data) // case["shards"]))
+        return lambda: split_data(data, shard_size)
+    if stage == "generate_proof":
+        # generate_proof reads the configured algorithm at call time
+        proofs.DEFAULT_PROOF_HASH_ALGO = case["hash_algo"]
+        salt = os.urandom(proofs.SALT_SIZE)
+        return lambda: generate_proof(data, salt, salt)
+    raise ValueError(f"Unknown stage: {stage}")
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Measure one case; runs in a fresh process."""
+    call = _prepare(case)
+    times = []
+    for _ in range(case["repeats"]):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+
+    # Allocations are counted in a separate run, since tracing slows every allocation down
+    tracemalloc.start()
+    call()
+    snapshot = tracemalloc.take_snapshot()
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(times)
+    return dict(case,
+        seconds=best,
+        mean_seconds=sum(times) / len(times),
+        throughput_mb_s=case["size"] / best / 1e6 if best else None,
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        peak_alloc_mb=peak_traced / 1e6,
+        live_blocks=sum(stat.count for stat in snapshot.statistics("filename")),
+    )
+
+def build_cases(stages: List[str], sizes: List[int], shard_counts: List[int], ecc_levels: List[int], hash_algos: List[str], parity: int, workers: Optional[int], repeats: int) -> List[Dict[str, Any]]:
+    """Expand the benchmark matrix; each stage only varies the parameters it takes."""
+    cases = []
+    for stage in stages:
+        for size in sizes:
+            variants: List[Dict[str, Any]] = [{}]
+            if stage in ("distribute", "assimilate", "split_data"):
+                variants = [{"shards": shards} for shards in shard_counts]
+            elif stage in ("encode_file", "decode_shard"):
+                variants = [{"ecc": ecc} for ecc in ecc_levels]
+            elif stage == "generate_proof":
+                variants = [{"hash_algo": algo} for algo in hash_algos]
+            for variant in variants:
+                cases.append(dict({"stage": stage, "size": size, "shards": None, "ecc": None, "hash_algo": None, "parity": parity, "workers": workers, "repeats": repeats}, **variant))
+    return cases
+
+def case_key(result: Dict[str, Any]) -> Tuple:
+    return tuple(result.get(field) for field in ("stage", "size", "shards", "ecc", "hash_algo", "parity", "workers"))
+
+def environment() -> Dict[str, Any]:
+    """What the results were measured on, so runs can be compared."""
+    from file_layer import config
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {name: value for name, value in vars(config).items() if name.isupper() and name != "CONFIG_PATH"},
+    }
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated stages to run")
+    parser.add_argument("--sizes", default="1K,1M,16M", help="comma-separated input sizes, e.g. 1K,1M,64M,1G")
+    parser.add_argument("--shards", default="4,16", help="shard counts for distribute, assimilate and split_data")
+    parser.add_argument("--ecc", default="10,32", help="Reed-Solomon parity symbols for encode_file and decode_shard")
+    parser.add_argument("--hash-algos", default="sha256,blake2b", help="hash algorithms for generate_proof")
+    parser.add_argument("--parity", type=int, default=0, help="erasure parity shards for distribute and assimilate")
+    parser.add_argument("--workers", type=int, default=None, help="shard workers (default PARALLEL_WORKERS)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    stages = args.stages.split(",")
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    cases = build_cases(
+        stages,
+        [parse_size(size) for size in args.sizes.split(",")],
+        [int(shards) for shards in args.shards.split(",")],
+        [int(ecc) for ecc in args.ecc.split(",")],
+        args.hash_algos.split(","),
+        args.parity, args.workers, args.repeats,
+    )
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = {case_key(result): result for result in json.load(baseline_file)["results"]}
+
+    print(f"{'stage':<16}{'size':>12}{'param':>10}{'MB/s':>10}{'RSS MB':>9}{'alloc MB':>10}{'blocks':>9}" + (f"{'vs base':>9}" if baseline else ""))
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(run_case, case).result()
+        results.append(result)
+        param = result["shards"] or result["ecc"] or result["hash_algo"] or ""
+        line = f"{result['stage']:<16}{result['size']:>12}{param:>10}{result['throughput_mb_s']:>10.2f}{result['peak_rss_mb']:>9.1f}{result['peak_alloc_mb']:>10.2f}{result['live_blocks']:>9}"
+        previous = baseline.get(case_key(result))
+        if previous:
+            line += f"{previous['seconds'] / result['seconds']:>8.2f}x"
+        print(line)
+
+    report = {"environment": environment(), "results": results}
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"\nResults written to {args.output}")
+    return report
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
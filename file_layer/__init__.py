@@ -1,5 +1,5 @@
-from .file_upload import Distribute
-from .file_retrieval import Assimilate
+from .file_upload import Distribute, DistributeStream
+from .file_retrieval import Assimilate, AssimilateRange, AssimilateStream
 from .proofs import generate_proof, verify_proof
 
 def generate_shardid():
@@ -0,0 +1,211 @@
+"""Optional compression of the file stream before Reed-Solomon and erasure coding.
+
+The file is cut into frame_size-byte frames (the last may be shorter), each
+compressed on its own and written as
+
+    codec (B) | stored length (I) | payload
+
+so retrieval decompresses frame by frame as the decoded stream arrives, and a
+byte range only needs the frames covering it. Uploads that need their compressed
+size up front, to plan shards, spool the frames to a temporary file first.
+
+A frame whose sampled byte entropy says it will not compress (media, archives,
+ciphertext), or which does not shrink, is stored as-is under the STORED codec.
+
+zlib is always available; zstd (zstandard package) and lz4 (lz4 package) are
+used when installed.
+"""
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import math
+import struct
+import tempfile
+import zlib
+import numpy as np
+
+FRAME_SIZE = 262144  # Raw bytes per independently compressed frame
+FRAME_HEADER = struct.Struct("<BI")  # codec id, stored length
+ENTROPY_SAMPLE_SIZE = 4096  # Bytes of each frame sampled for its entropy
+ENTROPY_LIMIT = 7.5  # Bits per byte above which a frame is stored without trying to compress it
+ZLIB_LEVEL = 1  # Fastest zlib level; text still shrinks several times
+ZSTD_LEVEL = 3
+
+STORED = 0
+CODEC_IDS = {"zlib": 1, "zstd": 2, "lz4": 3}
+AUTO_ORDER = ("zstd", "lz4", "zlib")  # Preference of COMPRESSION = "auto" among installed codecs
+
+def _load_codec(name: str) -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    """Return (compress, decompress) for a codec, importing its package if it needs one."""
+    if name == "zlib":
+        return (lambda data: zlib.compress(data, ZLIB_LEVEL)), zlib.decompress
+    try:
+        if name == "zstd":
+            import zstandard
+            return (lambda data: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)), (lambda data: zstandard.ZstdDecompressor().decompress(data))
+        if name == "lz4":
+            import lz4.frame
+            return lz4.frame.compress, lz4.frame.decompress
+    except ImportError:
+        raise ValueError(f"The {name} compression codec needs the {'zstandard' if name == 'zstd' else name} package") from None
+    raise ValueError(f"Unknown compression codec: {name}")
+
+_codecs: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {}
+
+def _codec(name: str) -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    if name not in _codecs:
+        _codecs[name] = _load_codec(name)
+    return _codecs[name]
+
+def resolve_codec(name: str) -> Optional[str]:
+    """Return the codec to compress with for a COMPRESSION setting, or None for "none"."""
+    if name == "none":
+        return None
+    if name == "auto":
+        for candidate in AUTO_ORDER:
+            try:
+                _codec(candidate)
+                return candidate
+            except ValueError:
+                continue
+    _codec(name)
+    return name
+
+def sample_entropy(data: bytes, sample_size: int = ENTROPY_SAMPLE_SIZE) -> float:
+    """Order-0 Shannon entropy, in bits per byte, of evenly spaced bytes of data."""
+    values = np.frombuffer(data, dtype=np.uint8)
+    if not len(values):
+        return 0.0
+    sample = values[::max(1, len(values) // sample_size)]
+    counts = np.bincount(sample, minlength=256)
+    probabilities = counts[counts > 0] / len(sample)
+    return float(-(probabilities * np.log2(probabilities)).sum())
+
+def encode_frame(raw: bytes, codec: str) -> bytes:
+    """Compress one frame, or store it as-is if it looks or turns out incompressible."""
+    if sample_entropy(raw) < ENTROPY_LIMIT:
+        compressed = _codec(codec)[0](raw)
+        if len(compressed) < len(raw):
+            return FRAME_HEADER.pack(CODEC_IDS[codec], len(compressed)) + compressed
+    return FRAME_HEADER.pack(STORED, len(raw)) + bytes(raw)
+
+def _decode_frame(codec_id: int, payload: bytes) -> bytes:
+    if codec_id == STORED:
+        return bytes(payload)
+    for name, known_id in CODEC_IDS.items():
+        if known_id == codec_id:
+            return _codec(name)[1](payload)
+    raise ValueError(f"Unknown compression codec id {codec_id}")
+
+def decompress_frames(stream: Iterable[bytes]) -> Iterator[bytes]:
+    """Decompress a stream of frames, given in arbitrary pieces, one frame at a time."""
+    pending = bytearray()
+    for piece in stream:
+        pending += piece
+        offset = 0
+        while len(pending) - offset >= FRAME_HEADER.size:
+            codec_id, length = FRAME_HEADER.unpack_from(pending, offset)
+            end = offset + FRAME_HEADER.size + length
+            if end > len(pending):
+                break
+            yield _decode_frame(codec_id, bytes(pending[offset + FRAME_HEADER.size:end]))
+            offset = end
+        del pending[:offset]
+    if pending:
+        raise ValueError("Compressed stream ends inside a frame")
+
+class CompressingReader:
+    """Read-only file object over the compressed frames of file_obj.
+
+    Afterwards, size is the number of raw bytes read and frame_offsets the offset
+    of every frame in the compressed stream, for mapping byte ranges to frames.
+    After spool(), these are final before the first read and the reader can seek;
+    close it, or use it as a context manager, to remove the temporary file.
+    """
+
+    def __init__(self, file_obj: Any, codec: str, frame_size: int = FRAME_SIZE) -> None:
+        self.file_obj = file_obj
+        self.codec = codec
+        self.frame_size = frame_size
+        self.size = 0
+        self.stored_size = 0
+        self.frame_offsets: List[int] = []
+        self._buffer = bytearray()
+        self._eof = False
+        self._spooled: Optional[BinaryIO] = None
+        self.closed = False
+
+    def _read_frame(self) -> bytes:
+        """Read a whole frame; only the last frame of the file may be short."""
+        raw = self.file_obj.read(self.frame_size)
+        while raw and len(raw) < self.frame_size:
+            more = self.file_obj.read(self.frame_size - len(raw))
+            if not more:
+                break
+            raw += more
+        return raw
+
+    def spool(self) -> "CompressingReader":
+        """Compress the rest of the file into a temporary file now and read from that instead."""
+        spooled = tempfile.TemporaryFile()
+        frame = self.read(self.frame_size)
+        while frame:
+            spooled.write(frame)
+            frame = self.read(self.frame_size)
+        spooled.seek(0)
+        self._spooled = spooled
+        return self
+
+    def seekable(self) -> bool:
+        return self._spooled is not None
+
+    def tell(self) -> int:
+        return self._spooled.tell()
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._spooled.seek(offset, whence)
+
+    def close(self) -> None:
+        """Close and so delete the spooled temporary file, if there is one; file_obj is left open."""
+        if self._spooled is not None:
+            self._spooled.close()
+        self.closed = True
+
+    def __enter__(self) -> "CompressingReader":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def read(self, size: int = -1) -> bytes:
+        if self._spooled is not None:
+            return self._spooled.read(size)
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            raw = self._read_frame()
+            if not raw:
+                self._eof = True
+                break
+            frame = encode_frame(raw, self.codec)
+            self.frame_offsets.append(self.stored_size)
+            self.size += len(raw)
+            self.stored_size += len(frame)
+            self._buffer += frame
+        size = len(self._buffer) if size < 0 else size
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def metadata(self) -> Dict[str, Any]:
+        """What retrieval needs to decompress the stream and seek in it."""
+        return {"codec": self.codec, "frame_size": self.frame_size, "size": self.size, "stored_size": self.stored_size, "frames": self.frame_offsets}
+
+def stored_range(compression: Dict[str, Any], start: int, end: int) -> Tuple[int, int, int]:
+    """Map raw bytes [start, end) to the compressed bytes of the frames covering them.
+
+    Returns the compressed (start, end) and the raw offset of the first frame.
+    """
+    frames = compression["frames"]
+    frame_size = compression["frame_size"]
+    first = min(start // frame_size, len(frames))
+    last = min(math.ceil(end / frame_size), len(frames))
+    stored_start = frames[first] if first < len(frames) else compression["stored_size"]
+    stored_end = frames[last] if last < len(frames) else compression["stored_size"]
+    return stored_start, stored_end, first * frame_size
@@ -7,8 +7,33 @@ CONFIG_PATH = os.path.join(os.path.dirname(__file__), "../config.yaml")
 # Default values if config file or setting is missing
 DEFAULT_CONFIG = {
     "DEFAULT_SHARD_SIZE": 1024,  # Fallback shard size in bytes
+    "MIN_SHARD_SIZE": 65536, # Smallest shard the upload planner makes, so small files do not become many tiny deals
+    "MAX_SHARD_SIZE": 16777216, # Largest shard the upload planner makes; big files spread several shards per peer
+    "PEER_CAPACITY": 0, # Most bytes of one file the planner places on a single peer; 0 = no limit
     "DEFAULT_ERROR_CORRECTION": 10,  # Default error correction level
-    "DEFAULT_PROOF_HASH_ALGO": "sha256" # Default proof hash algorithm
+    "DEFAULT_PROOF_HASH_ALGO": "sha256", # Default proof hash algorithm: "sha256", "blake2b" or "blake3"
+    "HASH_ALGO": "sha256", # Hash for file IDs, shard mapping keys and chunk fingerprints: "sha256", "blake2b" or "blake3"
+    "ENCRYPTION_MODE": "envelope", # Shard encryption mode: "envelope" (AES-GCM + RSA-wrapped key) or "rsa"
+    "STREAM_MEMORY_LIMIT": 67108864, # Memory ceiling for streaming uploads in bytes
+    "RS_CODEC": "numpy", # Reed-Solomon implementation: "numpy" (vectorized) or "reedsolo"
+    "DEFAULT_PARITY_SHARDS": 2, # Cross-shard erasure parity shards per upload
+    "PARALLEL_WORKERS": 0, # Workers for per-shard encode/encrypt/hash and decrypt/decode; 0 = one per CPU core, 1 = serial
+    "PARALLEL_BACKEND": "thread", # Worker pool type: "process" or "thread"
+    "PARALLEL_MIN_SIZE": 4194304, # Files smaller than this (bytes) are processed serially
+    "CHUNKING": "fixed", # Shard splitting strategy: "fixed" (equal-size shards) or "cdc" (content-defined chunks)
+    "CDC_MIN_SIZE": 2048, # Smallest content-defined chunk in bytes
+    "CDC_AVG_SIZE": 8192, # Target content-defined chunk size in bytes
+    "CDC_MAX_SIZE": 65536, # Largest content-defined chunk in bytes
+    "COMPRESSION": "none", # Compression of fixed-size uploads before encoding: "none", "auto", "zlib", "zstd" or "lz4"
+    "SHARD_LAYOUT": "packed", # Fixed-size shard layout: "packed" or "striped" (block-aligned shards that support byte-range reads)
+    "SHARD_STORE_PATH": "shard_store", # Directory holding a storage node's shard segment files
+    "SEGMENT_SIZE": 67108864, # Bytes written to a shard segment before starting the next one
+    "COMPACTION_THRESHOLD": 0.5, # Dead fraction of a segment (or the store) that triggers compaction
+    "INDEX_SNAPSHOT_INTERVAL": 1000, # Shard store writes between index snapshots; 0 = only on close and compaction
+    "SHARD_CACHE_BYTES": 33554432, # Memory budget for recently read shards on storage nodes; 0 disables the cache
+    "OBJECT_CACHE_PATH": "object_cache", # Directory caching files a client has downloaded
+    "OBJECT_CACHE_BYTES": 1073741824, # Disk budget for downloaded files kept for repeat downloads
+    "FILE_CATALOG_PATH": "file_catalog" # Directory holding a client's persistent catalog of uploaded files
 }
 
 # Load configuration from the YAML file
@@ -21,7 +46,45 @@ except FileNotFoundError:
 
 # Extract the shard size, falling back to default if missing
 DEFAULT_SHARD_SIZE = config_data.get("DEFAULT_SHARD_SIZE", DEFAULT_CONFIG["DEFAULT_SHARD_SIZE"])
+# Extract the upload planner's shard size bounds and peer capacity, falling back to defaults if missing
+MIN_SHARD_SIZE = config_data.get("MIN_SHARD_SIZE", DEFAULT_CONFIG["MIN_SHARD_SIZE"])
+MAX_SHARD_SIZE = config_data.get("MAX_SHARD_SIZE", DEFAULT_CONFIG["MAX_SHARD_SIZE"])
+PEER_CAPACITY = config_data.get("PEER_CAPACITY", DEFAULT_CONFIG["PEER_CAPACITY"])
 # Extract the error correction level, falling back to default if missing
 DEFAULT_ERROR_CORRECTION = config_data.get("DEFAULT_ERROR_CORRECTION", DEFAULT_CONFIG["DEFAULT_ERROR_CORRECTION"])
 # Extract the proof hash algorithm, falling back to default if missing
-DEFAULT_PROOF_HASH_ALGO = config_data.get("DEFAULT_PROOF_HASH_ALGO", DEFAULT_CONFIG["DEFAULT_PROOF_HASH_ALGO"])
\ No newline at end of file
+DEFAULT_PROOF_HASH_ALGO = config_data.get("DEFAULT_PROOF_HASH_ALGO", DEFAULT_CONFIG["DEFAULT_PROOF_HASH_ALGO"])
+# Extract the upload compression codec, falling back to default if missing
+COMPRESSION = config_data.get("COMPRESSION", DEFAULT_CONFIG["COMPRESSION"])
+# Extract the content hash algorithm, falling back to default if missing
+HASH_ALGO = config_data.get("HASH_ALGO", DEFAULT_CONFIG["HASH_ALGO"])
+# Extract the shard encryption mode, falling back to default if missing
+ENCRYPTION_MODE = config_data.get("ENCRYPTION_MODE", DEFAULT_CONFIG["ENCRYPTION_MODE"])
+# Extract the streaming upload memory ceiling, falling back to default if missing
+STREAM_MEMORY_LIMIT = config_data.get("STREAM_MEMORY_LIMIT", DEFAULT_CONFIG["STREAM_MEMORY_LIMIT"])
+# Extract the Reed-Solomon codec implementation, falling back to default if missing
+RS_CODEC = config_data.get("RS_CODEC", DEFAULT_CONFIG["RS_CODEC"])
+# Extract the number of cross-shard parity shards, falling back to default if missing
+DEFAULT_PARITY_SHARDS = config_data.get("DEFAULT_PARITY_SHARDS", DEFAULT_CONFIG["DEFAULT_PARITY_SHARDS"])
+# Extract the per-shard worker pool settings, falling back to defaults if missing
+PARALLEL_WORKERS = config_data.get("PARALLEL_WORKERS", DEFAULT_CONFIG["PARALLEL_WORKERS"])
+PARALLEL_BACKEND = config_data.get("PARALLEL_BACKEND", DEFAULT_CONFIG["PARALLEL_BACKEND"])
+PARALLEL_MIN_SIZE = config_data.get("PARALLEL_MIN_SIZE", DEFAULT_CONFIG["PARALLEL_MIN_SIZE"])
+# Extract the chunking strategy and content-defined chunk sizes, falling back to defaults if missing
+CHUNKING = config_data.get("CHUNKING", DEFAULT_CONFIG["CHUNKING"])
+CDC_MIN_SIZE = config_data.get("CDC_MIN_SIZE", DEFAULT_CONFIG["CDC_MIN_SIZE"])
+CDC_AVG_SIZE = config_data.get("CDC_AVG_SIZE", DEFAULT_CONFIG["CDC_AVG_SIZE"])
+CDC_MAX_SIZE = config_data.get("CDC_MAX_SIZE", DEFAULT_CONFIG["CDC_MAX_SIZE"])
+# Extract the fixed-size shard layout, falling back to default if missing
+SHARD_LAYOUT = config_data.get("SHARD_LAYOUT", DEFAULT_CONFIG["SHARD_LAYOUT"])
+# Extract the storage node shard store settings, falling back to defaults if missing
+SHARD_STORE_PATH = config_data.get("SHARD_STORE_PATH", DEFAULT_CONFIG["SHARD_STORE_PATH"])
+SEGMENT_SIZE = config_data.get("SEGMENT_SIZE", DEFAULT_CONFIG["SEGMENT_SIZE"])
+COMPACTION_THRESHOLD = config_data.get("COMPACTION_THRESHOLD", DEFAULT_CONFIG["COMPACTION_THRESHOLD"])
+INDEX_SNAPSHOT_INTERVAL = config_data.get("INDEX_SNAPSHOT_INTERVAL", DEFAULT_CONFIG["INDEX_SNAPSHOT_INTERVAL"])
+SHARD_CACHE_BYTES = config_data.get("SHARD_CACHE_BYTES", DEFAULT_CONFIG["SHARD_CACHE_BYTES"])
+# Extract the client object cache settings, falling back to defaults if missing
+OBJECT_CACHE_PATH = config_data.get("OBJECT_CACHE_PATH", DEFAULT_CONFIG["OBJECT_CACHE_PATH"])
+OBJECT_CACHE_BYTES = config_data.get("OBJECT_CACHE_BYTES", DEFAULT_CONFIG["OBJECT_CACHE_BYTES"])
+# Extract the file catalog directory, falling back to default if missing
+FILE_CATALOG_PATH = config_data.get("FILE_CATALOG_PATH", DEFAULT_CONFIG["FILE_CATALOG_PATH"])
\ No newline at end of file
@@ -1,14 +1,55 @@
+from typing import Optional
 from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_OAEP
+from Crypto.Cipher import AES, PKCS1_OAEP
+from Crypto.Random import get_random_bytes
 
-def encrypt_data(data: bytes, private_key: bytes) -> bytes:
-    """Encrypt data using RSA private key."""
+DATA_KEY_SIZE = 32  # AES-256 data key length in bytes
+NONCE_SIZE = 12  # AES-GCM nonce length in bytes
+TAG_SIZE = 16  # AES-GCM authentication tag length in bytes
+
+def generate_data_key() -> bytes:
+    """Generate a fresh symmetric data key for one file."""
+    return get_random_bytes(DATA_KEY_SIZE)
+
+def wrap_data_key(data_key: bytes, private_key: bytes) -> bytes:
+    """Wrap a symmetric data key with the RSA key."""
+    key = RSA.import_key(private_key)
+    cipher = PKCS1_OAEP.new(key)
+    return cipher.encrypt(data_key)
+
+def unwrap_data_key(wrapped_key: bytes, private_key: bytes) -> bytes:
+    """Recover a symmetric data key wrapped with the RSA key."""
+    key = RSA.import_key(private_key)
+    cipher = PKCS1_OAEP.new(key)
+    return cipher.decrypt(wrapped_key)
+
+def encrypt_data(data: bytes, private_key: bytes, data_key: Optional[bytes] = None) -> bytes:
+    """Encrypt data using RSA private key, or AES-GCM when a data key is given.
+
+    The AES-GCM output is laid out as nonce || tag || ciphertext, with the
+    ciphertext written straight into its place in the output buffer.
+    """
+    if data_key is not None:
+        nonce = get_random_bytes(NONCE_SIZE)
+        cipher = AES.new(data_key, AES.MODE_GCM, nonce=nonce, mac_len=TAG_SIZE)
+        sealed = bytearray(NONCE_SIZE + TAG_SIZE + len(data))
+        with memoryview(sealed) as view:
+            cipher.encrypt(data, output=view[NONCE_SIZE + TAG_SIZE:])
+        sealed[:NONCE_SIZE] = nonce
+        sealed[NONCE_SIZE:NONCE_SIZE + TAG_SIZE] = cipher.digest()
+        return sealed
     key = RSA.import_key(private_key)
     cipher = PKCS1_OAEP.new(key)
     return cipher.encrypt(data)
 
-def decrypt_data(data: bytes, private_key: bytes) -> bytes:
-    """Decrypt data using RSA private key."""
+def decrypt_data(data: bytes, private_key: bytes, data_key: Optional[bytes] = None) -> bytes:
+    """Decrypt data using RSA private key, or AES-GCM when a data key is given."""
+    if data_key is not None:
+        view = memoryview(data)
+        nonce = bytes(view[:NONCE_SIZE])
+        tag = bytes(view[NONCE_SIZE:NONCE_SIZE + TAG_SIZE])
+        cipher = AES.new(data_key, AES.MODE_GCM, nonce=nonce, mac_len=TAG_SIZE)
+        return cipher.decrypt_and_verify(view[NONCE_SIZE + TAG_SIZE:], tag)
     key = RSA.import_key(private_key)
     cipher = PKCS1_OAEP.new(key)
     return cipher.decrypt(data)
@@ -0,0 +1,108 @@
+"""Systematic k-of-n erasure coding across shards.
+
+Data shards are stored as-is and parity shard j is sum_i C[j][i] * data_i over
+GF(256), with the Cauchy matrix C[j][i] = 1 / (x_j + y_i), x_j = 255 - j and
+y_i = i. Every square submatrix of a Cauchy matrix is invertible, so any k of
+the k + m shards are enough to rebuild the k data shards.
+
+GF(256) only has coefficients for MAX_SHARDS shards, so files with more data
+shards are coded in stripes of at most stripe_width data shards each, every
+stripe with its own m parity shards (see stripe_shards).
+"""
+from typing import Dict, List
+import numpy as np
+from .rs_codec import GF_MUL, gf_div, gf_mul
+
+MAX_SHARDS = 256  # Data plus parity shards addressable with GF(256) coefficients
+
+def _coefficient(parity_index: int, data_index: int) -> int:
+    """Cauchy matrix entry for parity shard parity_index and data shard data_index."""
+    return gf_div(1, (255 - parity_index) ^ data_index)
+
+def _invert(matrix: List[List[int]]) -> List[List[int]]:
+    """Invert a square matrix over GF(256) with Gauss-Jordan elimination."""
+    size = len(matrix)
+    rows = [row[:] + [1 if i == j else 0 for j in range(size)] for i, row in enumerate(matrix)]
+    for col in range(size):
+        pivot = next((r for r in range(col, size) if rows[r][col]), None)
+        if pivot is None:
+            raise ValueError("Shard matrix is singular")
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = gf_div(1, rows[col][col])
+        rows[col] = [gf_mul(value, scale) for value in rows[col]]
+        for r in range(size):
+            factor = rows[r][col]
+            if r != col and factor:
+                rows[r] = [value ^ gf_mul(factor, pivot_value) for value, pivot_value in zip(rows[r], rows[col])]
+    return [row[size:] for row in rows]
+
+class ParityEncoder:
+    """Accumulate parity shards one data shard at a time, so data shards can be streamed."""
+
+    def __init__(self, parity_shards: int, shard_size: int) -> None:
+        self.parity = np.zeros((parity_shards, shard_size), dtype=np.uint8)
+        self.length = 0  # Longest data shard folded in so far
+
+    def update(self, data_index: int, shard: bytes) -> None:
+        """Fold data shard data_index into every parity shard.
+
+        Shards shorter than shard_size count as zero-padded, without being copied,
+        and parity shards are only as long as the longest data shard.
+        """
+        if data_index + len(self.parity) >= MAX_SHARDS:
+            raise ValueError(f"Erasure coding supports at most {MAX_SHARDS} shards in total")
+        data = np.frombuffer(shard, dtype=np.uint8)
+        self.length = max(self.length, len(data))
+        for parity_index, row in enumerate(self.parity):
+            row[:len(data)] ^= GF_MUL[_coefficient(parity_index, data_index)][data]
+
+    def finalize(self) -> List[bytes]:
+        return [row[:self.length].tobytes() for row in self.parity]
+
+def encode_parity(data_shards: List[bytes], parity_shards: int) -> List[bytes]:
+    """Compute parity shards for equally sized data shards."""
+    encoder = ParityEncoder(parity_shards, len(data_shards[0]) if data_shards else 0)
+    for data_index, shard in enumerate(data_shards):
+        encoder.update(data_index, shard)
+    return encoder.finalize()
+
+def reconstruct_data_shards(shards: Dict[int, bytes], data_shards: int) -> List[bytes]:
+    """Rebuild the data shards from any data_shards of the shards, keyed by shard index."""
+    if all(index in shards for index in range(data_shards)):
+        return [shards[index] for index in range(data_shards)]
+    if len(shards) < data_shards:
+        raise ValueError(f"Need {data_shards} shards to reconstruct, got {len(shards)}")
+
+    # Rows of the systematic generator matrix for the shards we have, data shards first
+    chosen = sorted(shards)[:data_shards]
+    matrix = [
+        [1 if col == index else 0 for col in range(data_shards)] if index < data_shards
+        else [_coefficient(index - data_shards, col) for col in range(data_shards)]
+        for index in chosen
+    ]
+    inverse = _invert(matrix)
+    stacked = [np.frombuffer(shards[index], dtype=np.uint8) for index in chosen]
+
+    recovered = []
+    for data_index in range(data_shards):
+        if data_index in shards:
+            recovered.append(shards[data_index])
+            continue
+        data = np.zeros_like(stacked[0])
+        for coef, shard in zip(inverse[data_index], stacked):
+            if coef:
+                data ^= GF_MUL[coef][shard]
+        recovered.append(data.tobytes())
+    return recovered
+
+def stripe_shards(data_shards: int, parity_shards: int, stripe_width: int) -> List[List[int]]:
+    """Shard indexes of each stripe, its data shards first.
+
+    Stripe s holds data shards s * stripe_width onwards; parity shards follow all
+    data shards, stripe by stripe, so stripe s's start at data_shards + s * parity_shards.
+    """
+    stripes = []
+    for stripe, first in enumerate(range(0, data_shards, stripe_width)):
+        parity_start = data_shards + stripe * parity_shards
+        stripes.append(list(range(first, min(first + stripe_width, data_shards))) + list(range(parity_start, parity_start + parity_shards)))
+    return stripes
@@ -0,0 +1,413 @@
+"""Persistent catalog of the files a client has uploaded, keyed by file ID.
+
+Entries (filename, size, shard mapping, shard locations, proof schedule, ...) are
+appended to a log as compact binary records:
+
+    magic (4s) | kind (B) | file ID length (H) | payload length (I) | crc32 (I)
+
+Only the offset of each file's latest record is kept in memory, and entries are
+decoded from disk on lookup, so the catalog can list millions of files without
+holding their mappings as Python objects. The offsets are snapshotted, so a
+restart only replays the records written since; deletes append a tombstone and
+the log is rewritten once most of it is dead. One FileCatalog at a time may
+open a directory; it holds an exclusive lock on it until closed.
+"""
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+import os
+import struct
+import threading
+import zlib
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; the catalog is then left unlocked
+    fcntl = None
+from .config import FILE_CATALOG_PATH, COMPACTION_THRESHOLD, INDEX_SNAPSHOT_INTERVAL
+
+LOG_NAME = "catalog.log"
+SNAPSHOT_NAME = "catalog.snapshot"
+LOCK_NAME = "catalog.lock"
+LOG_MAGIC = b"BCLG"
+LOG_HEADER = struct.Struct("<4sQ")  # magic, generation (bumped by every compaction)
+RECORD_MAGIC = b"BCT1"
+RECORD_HEADER = struct.Struct("<4sBHII")
+SNAPSHOT_MAGIC = b"BCSN"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sBQQQI")  # magic, version, log generation, log size, live bytes, entry count
+SNAPSHOT_ENTRY = struct.Struct("<HQ")  # file ID length, record offset
+PUT, DELETE = 0, 1  # Record kinds
+SUMMARY_FIELDS = ("filename", "size", "extension", "shard_count", "previous_version")  # What file listings show of an entry
+
+# Value tags of the entry encoding
+NONE, FALSE, TRUE, INT, FLOAT, STR, HEX, BYTES, LIST, TUPLE, DICT = range(11)
+FLOAT_VALUE = struct.Struct("<d")
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def _is_hex(text: str) -> bool:
+    """True if text is lowercase hex that survives a round trip through bytes."""
+    if len(text) % 2 or not text:
+        return False
+    try:
+        return bytes.fromhex(text).hex() == text
+    except ValueError:
+        return False
+
+def _encode(value: Any, out: bytearray) -> None:
+    if value is None:
+        out.append(NONE)
+    elif value is True or value is False:
+        out.append(TRUE if value else FALSE)
+    elif isinstance(value, int):
+        out.append(INT)
+        _write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += FLOAT_VALUE.pack(value)
+    elif isinstance(value, str):
+        # Hashes, keys and proofs are hex, so store them at half the size
+        raw = bytes.fromhex(value) if _is_hex(value) else value.encode()
+        out.append(HEX if _is_hex(value) else STR)
+        _write_varint(out, len(raw))
+        out += raw
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(BYTES)
+        _write_varint(out, len(value))
+        out += value
+    elif isinstance(value, (list, tuple)):
+        out.append(TUPLE if isinstance(value, tuple) else LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, dict):
+        out.append(DICT)
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            _encode(key, out)
+            _encode(item, out)
+    else:
+        raise TypeError(f"Cannot store {type(value).__name__} in the file catalog")
+
+def _decode(data: bytes, offset: int) -> Tuple[Any, int]:
+    tag = data[offset]
+    offset += 1
+    if tag <= TRUE:
+        return (None, False, True)[tag], offset
+    if tag == FLOAT:
+        return FLOAT_VALUE.unpack_from(data, offset)[0], offset + FLOAT_VALUE.size
+    length, offset = _read_varint(data, offset)
+    if tag == INT:
+        return (length >> 1) if not length & 1 else -((length + 1) >> 1), offset
+    if tag in (STR, HEX, BYTES):
+        raw = bytes(data[offset:offset + length])
+        return (raw.decode() if tag == STR else raw.hex() if tag == HEX else raw), offset + length
+    if tag in (LIST, TUPLE):
+        items = []
+        for _ in range(length):
+            item, offset = _decode(data, offset)
+            items.append(item)
+        return (tuple(items) if tag == TUPLE else items), offset
+    if tag == DICT:
+        mapping = {}
+        for _ in range(length):
+            key, offset = _decode(data, offset)
+            mapping[key], offset = _decode(data, offset)
+        return mapping, offset
+    raise ValueError(f"Unknown file catalog value tag {tag}")
+
+def _skip(data: bytes, offset: int) -> int:
+    """Offset just past the value at offset, without building it."""
+    tag = data[offset]
+    offset += 1
+    if tag <= TRUE:
+        return offset
+    if tag == FLOAT:
+        return offset + FLOAT_VALUE.size
+    length, offset = _read_varint(data, offset)
+    if tag == INT:
+        return offset
+    if tag in (STR, HEX, BYTES):
+        return offset + length
+    for _ in range(length * 2 if tag == DICT else length):
+        offset = _skip(data, offset)
+    return offset
+
+def pack_entry(entry: Dict[str, Any]) -> bytes:
+    """Encode a catalog entry; ints, floats, strings, bytes, None, bools, lists, tuples and dicts round-trip."""
+    out = bytearray()
+    _encode(entry, out)
+    return bytes(out)
+
+def unpack_entry(data: bytes) -> Dict[str, Any]:
+    return _decode(data, 0)[0]
+
+def unpack_fields(data: bytes, fields: Iterable[str]) -> Dict[str, Any]:
+    """Decode only the given top-level fields of an entry, skipping over the others."""
+    fields = set(fields)
+    length, offset = _read_varint(data, 1)
+    entry = {}
+    for _ in range(length):
+        key, offset = _decode(data, offset)
+        if key in fields:
+            entry[key], offset = _decode(data, offset)
+        else:
+            offset = _skip(data, offset)
+    return entry
+
+class FileCatalog:
+    """Durable file_id -> entry mapping with a dict-like interface.
+
+    Entries returned are decoded copies; store a changed entry again to persist it.
+    Safe to share between threads.
+    """
+
+    def __init__(self, root: str = FILE_CATALOG_PATH, compaction_threshold: float = COMPACTION_THRESHOLD, snapshot_interval: int = INDEX_SNAPSHOT_INTERVAL) -> None:
+        self.root = root
+        self.compaction_threshold = compaction_threshold
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.RLock()
+        self._offsets: Dict[str, int] = {}
+        self._unsaved = 0
+        os.makedirs(root, exist_ok=True)
+
+        # Compaction replaces the log, so the lock is taken on a file of its own
+        self._lock_file: BinaryIO = open(os.path.join(root, LOCK_NAME), "ab")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._lock_file.close()
+                raise RuntimeError(f"File catalog {root} is already open in another FileCatalog") from None
+
+        path = os.path.join(root, LOG_NAME)
+        if not os.path.exists(path) or os.path.getsize(path) < LOG_HEADER.size:
+            with open(path, "wb") as log_file:
+                log_file.write(LOG_HEADER.pack(LOG_MAGIC, 0))
+        with open(path, "rb") as log_file:
+            magic, self.generation = LOG_HEADER.unpack(log_file.read(LOG_HEADER.size))
+        if magic != LOG_MAGIC:
+            raise ValueError(f"{path} is not a file catalog log")
+
+        # Replay only what was appended after the snapshot, or the whole log without one
+        self.size = self.live_bytes = LOG_HEADER.size
+        self._reader: BinaryIO = open(path, "rb")
+        self._load_snapshot()
+        self._replay(path)
+        self._writer: BinaryIO = open(path, "ab")
+
+    def _load_snapshot(self) -> None:
+        try:
+            with open(os.path.join(self.root, SNAPSHOT_NAME), "rb") as snapshot_file:
+                data = snapshot_file.read()
+        except FileNotFoundError:
+            return
+        body = data[:-4]
+        if len(data) < SNAPSHOT_HEADER.size + 4 or struct.unpack("<I", data[-4:])[0] != zlib.crc32(body):
+            return
+        magic, version, generation, size, live_bytes, count = SNAPSHOT_HEADER.unpack_from(body)
+        # A snapshot of an older generation points into a log that compaction replaced
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or generation != self.generation:
+            return
+        if size > os.path.getsize(os.path.join(self.root, LOG_NAME)):
+            return
+        offset = SNAPSHOT_HEADER.size
+        for _ in range(count):
+            id_length, record_offset = SNAPSHOT_ENTRY.unpack_from(body, offset)
+            offset += SNAPSHOT_ENTRY.size
+            self._offsets[body[offset:offset + id_length].decode()] = record_offset
+            offset += id_length
+        self.size, self.live_bytes = size, live_bytes
+
+    def _replay(self, path: str) -> None:
+        """Apply records from self.size on, truncating a torn record at the end."""
+        offset = self.size
+        with open(path, "rb") as log_file:
+            log_file.seek(offset)
+            while True:
+                header = log_file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                magic, kind, id_length, length, checksum = RECORD_HEADER.unpack(header)
+                body = log_file.read(id_length + length)
+                if magic != RECORD_MAGIC or len(body) < id_length + length or zlib.crc32(body) != checksum:
+                    break
+                self._apply(body[:id_length].decode(), kind, offset, RECORD_HEADER.size + len(body))
+                offset += RECORD_HEADER.size + len(body)
+        if offset < os.path.getsize(path):
+            with open(path, "r+b") as log_file:
+                log_file.truncate(offset)
+        self.size = offset
+
+    def _apply(self, file_id: str, kind: int, offset: int, record_length: int) -> None:
+        previous = self._offsets.pop(file_id, None)
+        if previous is not None:
+            self.live_bytes -= self._record_length(previous)
+        if kind == PUT:
+            self._offsets[file_id] = offset
+            self.live_bytes += record_length
+
+    def _record_length(self, offset: int) -> int:
+        self._reader.seek(offset)
+        _, _, id_length, length, _ = RECORD_HEADER.unpack(self._reader.read(RECORD_HEADER.size))
+        return RECORD_HEADER.size + id_length + length
+
+    def _read(self, offset: int) -> Tuple[str, bytes]:
+        self._reader.seek(offset)
+        _, _, id_length, length, _ = RECORD_HEADER.unpack(self._reader.read(RECORD_HEADER.size))
+        body = self._reader.read(id_length + length)
+        return body[:id_length].decode(), body[id_length:]
+
+    def _append(self, file_id: str, kind: int, payload: bytes = b"") -> None:
+        encoded_id = file_id.encode()
+        body = encoded_id + payload
+        record = RECORD_HEADER.pack(RECORD_MAGIC, kind, len(encoded_id), len(payload), zlib.crc32(body)) + body
+        self._writer.write(record)
+        self._writer.flush()
+        offset = self.size
+        self.size += len(record)
+        self._apply(file_id, kind, offset, len(record))
+
+        self._unsaved += 1
+        if self.snapshot_interval and self._unsaved >= self.snapshot_interval:
+            self.save_index()
+
+    def __setitem__(self, file_id: str, entry: Dict[str, Any]) -> None:
+        payload = pack_entry(entry)
+        with self._lock:
+            self._append(file_id, PUT, payload)
+            # Replacing entries leaves dead records just as deleting them does
+            if self.garbage_ratio >= self.compaction_threshold:
+                self.compact()
+
+    def __getitem__(self, file_id: str) -> Dict[str, Any]:
+        entry = self.get(file_id)
+        if entry is None:
+            raise KeyError(file_id)
+        return entry
+
+    def get(self, file_id: str, default: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            offset = self._offsets.get(file_id)
+            if offset is None:
+                return default
+            return unpack_entry(self._read(offset)[1])
+
+    def __delitem__(self, file_id: str) -> None:
+        with self._lock:
+            if file_id not in self._offsets:
+                raise KeyError(file_id)
+            self._append(file_id, DELETE)
+            if self.garbage_ratio >= self.compaction_threshold:
+                self.compact()
+
+    def __contains__(self, file_id: object) -> bool:
+        return file_id in self._offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+    def keys(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._offsets))
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Decode the entries one at a time, in log order."""
+        with self._lock:
+            offsets = sorted(self._offsets.values())
+        for offset in offsets:
+            with self._lock:
+                file_id, payload = self._read(offset)
+                if self._offsets.get(file_id) != offset:
+                    continue
+            yield file_id, unpack_entry(payload)
+
+    def summaries(self, fields: Iterable[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Like items(), but decode only the given fields of each entry."""
+        fields = list(fields)
+        with self._lock:
+            offsets = sorted(self._offsets.values())
+        for offset in offsets:
+            with self._lock:
+                file_id, payload = self._read(offset)
+                if self._offsets.get(file_id) != offset:
+                    continue
+            yield file_id, unpack_fields(payload, fields)
+
+    @property
+    def garbage_ratio(self) -> float:
+        """Fraction of the log taken by replaced and deleted records."""
+        return 1 - self.live_bytes / self.size if self.size > LOG_HEADER.size else 0.0
+
+    def compact(self) -> None:
+        """Rewrite the log with only the live records and bump its generation."""
+        with self._lock:
+            path = os.path.join(self.root, LOG_NAME)
+            temp_path = path + ".tmp"
+            offsets: Dict[str, int] = {}
+            with open(temp_path, "wb") as log_file:
+                log_file.write(LOG_HEADER.pack(LOG_MAGIC, self.generation + 1))
+                for offset in sorted(self._offsets.values()):
+                    self._reader.seek(offset)
+                    header = self._reader.read(RECORD_HEADER.size)
+                    _, _, id_length, length, _ = RECORD_HEADER.unpack(header)
+                    body = self._reader.read(id_length + length)
+                    offsets[body[:id_length].decode()] = log_file.tell()
+                    log_file.write(header + body)
+                size = log_file.tell()
+                log_file.flush()
+                os.fsync(log_file.fileno())
+            self._writer.close()
+            self._reader.close()
+            os.replace(temp_path, path)
+            self._offsets = offsets
+            self.generation += 1
+            self.size = self.live_bytes = size
+            self._writer = open(path, "ab")
+            self._reader = open(path, "rb")
+            self.save_index()
+
+    def save_index(self) -> None:
+        """Snapshot the offsets so the next start only replays newer records."""
+        with self._lock:
+            self.sync()
+            parts: List[bytes] = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.generation, self.size, self.live_bytes, len(self._offsets))]
+            for file_id, offset in self._offsets.items():
+                encoded_id = file_id.encode()
+                parts.append(SNAPSHOT_ENTRY.pack(len(encoded_id), offset) + encoded_id)
+            body = b"".join(parts)
+
+            path = os.path.join(self.root, SNAPSHOT_NAME)
+            with open(path + ".tmp", "wb") as snapshot_file:
+                snapshot_file.write(body + struct.pack("<I", zlib.crc32(body)))
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(path + ".tmp", path)
+            self._unsaved = 0
+
+    def sync(self) -> None:
+        with self._lock:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            self.save_index()
+            self._writer.close()
+            self._reader.close()
+            self._lock_file.close()
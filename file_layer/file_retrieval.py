@@ -1,18 +1,375 @@
-from typing import List, Dict
-from .encryption import decrypt_data
-from .redundancy import decode_file, decode_shard
-from .metadata import get_hash
-
-def Assimilate(shards: List[bytes], mapping: Dict[str, int], private_key: bytes) -> bytes:
-    # Reorder shards based on mapping
-    ordered_shards = [shards[mapping[get_hash(shard)]] for shard in shards]
-    
-    # Decrypt each shard
-    decrypted_shards = [decrypt_data(shard, private_key) for shard in ordered_shards]
-    
-    # Decode each shard individually
-    decoded_shards = [decode_shard(shard) for shard in decrypted_shards]
-    
-    # Decode the entire file to reconstruct original data
-    original_data = decode_file(decoded_shards)
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Tuple, Union
+from concurrent.futures import Executor, Future, FIRST_COMPLETED, wait
+from itertools import chain
+from reedsolo import ReedSolomonError
+from .encryption import decrypt_data, unwrap_data_key
+from .erasure import reconstruct_data_shards
+from .redundancy import decode_checked_shard, decode_file, encoded_size, strip_parity, BLOCK_SIZE, MESSAGE_SIZE
+from .shard_format import parse_shard, read_header
+from .compression import decompress_frames, stored_range
+from .metadata import get_erasure_stripes, get_hash, get_hash_algo, get_sealed_index, get_shard_count, DATA_KEY_FIELD, ERASURE_FIELD, CHUNKS_FIELD, STRIPE_FIELD, CHECKSUMS_FIELD, COMPRESSION_FIELD, SEALED_INDEXES_FIELD
+from .parallel import create_executor, resolve_workers
+from .config import PARALLEL_BACKEND, PARALLEL_MIN_SIZE
+import bisect
+import time
+
+ShardInput = Union[bytes, Tuple[int, bytes]]
+
+# Stages reported in AssimilateStream timings, in pipeline order
+TIMING_STAGES = ("unwrap_key", "decrypt", "decode_shard", "reconstruct", "decode_file")
+# How shards were decoded, as counted in AssimilateStream counters (see redundancy.decode_checked_shard)
+DECODE_OUTCOMES = ("clean", "corrected", "unchecked")
+
+def _unwrap_mapping_key(mapping: Dict[str, Any], private_key: bytes) -> Optional[bytes]:
+    """Unwrap the per-file data key for envelope-encrypted shards, if there is one."""
+    wrapped_key = mapping.get(DATA_KEY_FIELD)
+    return unwrap_data_key(bytes.fromhex(wrapped_key), private_key) if wrapped_key else None
+
+def _place(item: ShardInput, mapping: Dict[str, Any]) -> Tuple[int, bytes]:
+    """Return (shard_index, shard) for a bare shard or a pair.
+
+    Bare shards are placed by the index in their header. Legacy shards without
+    one, and the shards of delta uploads, whose reused shards carry the index of
+    the version that stored them, are looked up by their hash in the mapping.
+    """
+    if isinstance(item, tuple):
+        return item
+    header = read_header(item)
+    if header is None or SEALED_INDEXES_FIELD in mapping:
+        return mapping[get_hash(item, get_hash_algo(mapping))], item
+    if header.shard_index >= get_shard_count(mapping):
+        raise KeyError(f"Shard index {header.shard_index} is not in the mapping")
+    return header.shard_index, item
+
+def _checksum(mapping: Dict[str, Any], shard_index: int) -> Optional[int]:
+    """Return the recorded checksum of a shard, or None for uploads that predate checksums."""
+    checksums = mapping.get(CHECKSUMS_FIELD)
+    return checksums[shard_index] if checksums and shard_index < len(checksums) else None
+
+def _all_checksummed(mapping: Dict[str, Any]) -> bool:
+    """Whether every shard has a checksum, so every decoded shard is known to be intact."""
+    checksums = mapping.get(CHECKSUMS_FIELD)
+    return bool(checksums) and None not in checksums
+
+def _file_decoder(verified: bool) -> Callable[[bytes], bytes]:
+    """File-level decoder for runs of whole blocks; verified data only needs its parity stripped."""
+    return strip_parity if verified else lambda data: decode_file([data])
+
+def _open_shard(shard_index: int, shard: bytes, private_key: bytes, data_key: Optional[bytes], checksum: Optional[int], sealed_index: int) -> Tuple[int, bytes, str, float, float]:
+    """Decrypt and shard-level decode one shard, timing both; runs in pool workers.
+
+    The header of the shard, if it has one, must carry sealed_index, and supplies
+    its Reed-Solomon parameters and a checksum for shards whose mapping predates
+    checksums.
+    """
+    start = time.perf_counter()
+    header, payload = parse_shard(shard)
+    nsym = None
+    if header is not None:
+        if header.shard_index != sealed_index or header.block_size != BLOCK_SIZE:
+            raise ValueError(f"Shard {shard_index} has a header for shard {header.shard_index} with {header.block_size}-byte blocks")
+        nsym = header.parity_symbols
+        checksum = header.checksum if checksum is None else checksum
+    decrypted = decrypt_data(payload, private_key, data_key)
+    decrypted_at = time.perf_counter()
+    plain, outcome = decode_checked_shard(decrypted, checksum, nsym)
+    return shard_index, plain, outcome, decrypted_at - start, time.perf_counter() - decrypted_at
+
+def _submit_open(executor: Executor, shard_index: int, shard: bytes, mapping: Dict[str, Any], private_key: bytes, data_key: Optional[bytes]) -> Future:
+    """Start opening a shard on the executor, checked against its recorded checksum and header index."""
+    return executor.submit(_open_shard, shard_index, shard, private_key, data_key, _checksum(mapping, shard_index), get_sealed_index(mapping, shard_index))
+
+def _opened(future: Future, timings: Dict[str, float], counters: Dict[str, int]) -> Tuple[int, bytes]:
+    """Collect a finished _open_shard call, adding its stage times to timings and its outcome to counters."""
+    shard_index, plain, outcome, decrypt_seconds, decode_seconds = future.result()
+    timings["decrypt"] += decrypt_seconds
+    timings["decode_shard"] += decode_seconds
+    counters[outcome] += 1
+    return shard_index, plain
+
+def _decode_file_stream(plain_shards: Iterable[bytes], timings: Dict[str, float], chunked: bool = False, verified: bool = False) -> Iterator[bytes]:
+    """File-level decode of in-order shards, one run of complete Reed-Solomon blocks at a time.
+
+    Content-defined chunks were encoded one by one, so with chunked each shard is
+    decoded on its own. Shards are decoded in place; only a partial block left at
+    the end of a shard is copied to be joined with the next one. With verified,
+    every shard matched its checksum, so file-level parity is just stripped.
+    """
+    decode = _file_decoder(verified)
+    pending = b""
+    for shard in plain_shards:
+        if pending:
+            shard = pending + shard
+        usable = len(shard) if chunked else len(shard) - len(shard) % BLOCK_SIZE
+        with memoryview(shard) as view:
+            pending = bytes(view[usable:])
+            if usable:
+                start = time.perf_counter()
+                decoded = decode(view[:usable])
+                timings["decode_file"] += time.perf_counter() - start
+                yield decoded
+    if pending:
+        start = time.perf_counter()
+        decoded = decode(pending)
+        timings["decode_file"] += time.perf_counter() - start
+        yield decoded
+
+def _ordered_shards(shards: Iterable[ShardInput], mapping: Dict[str, Any], private_key: bytes, data_key: Optional[bytes], executor: Executor, max_in_flight: int, timings: Dict[str, float], counters: Dict[str, int]) -> Iterator[bytes]:
+    """Decrypt and decode shards on the executor, yielding them in index order.
+
+    Only shards that arrive ahead of a missing one are held, and the next shard is
+    waited for once max_in_flight are pending.
+    """
+    shard_count = get_shard_count(mapping)
+    opening: Dict[int, Future] = {}
+    next_index = 0
+    try:
+        for item in shards:
+            shard_index, shard = _place(item, mapping)
+            opening[shard_index] = _submit_open(executor, shard_index, shard, mapping, private_key, data_key)
+            while next_index in opening and (opening[next_index].done() or len(opening) >= max_in_flight):
+                yield _opened(opening.pop(next_index), timings, counters)[1]
+                next_index += 1
+        while next_index in opening:
+            yield _opened(opening.pop(next_index), timings, counters)[1]
+            next_index += 1
+    finally:
+        for future in opening.values():
+            future.cancel()
+    if next_index < shard_count:
+        raise ValueError(f"Shard {next_index} of {shard_count} is missing")
+
+def _padded(shard: bytes, size: int) -> bytes:
+    """Zero-pad a shard to size bytes, leaving full-size shards uncopied."""
+    return shard if len(shard) >= size else bytes(shard).ljust(size, b"\0")
+
+def _rebuild_stripe(received: Dict[int, bytes], stripe: List[int], data_count: int) -> List[bytes]:
+    """Rebuild the data shards of one erasure stripe from any data_count of its shards.
+
+    Content-defined chunks are only padded to a common size for the parity
+    arithmetic, so they are padded here too.
+    """
+    if all(shard_index in received for shard_index in stripe[:data_count]):
+        return [received[shard_index] for shard_index in stripe[:data_count]]
+    padded_size = max(map(len, received.values()), default=0)
+    by_position = {position: _padded(received[shard_index], padded_size) for position, shard_index in enumerate(stripe) if shard_index in received}
+    return reconstruct_data_shards(by_position, data_count)
+
+def _recovered_shards(shards: Iterable[ShardInput], mapping: Dict[str, Any], private_key: bytes, data_key: Optional[bytes], executor: Executor, timings: Dict[str, float], counters: Dict[str, int]) -> Iterator[bytes]:
+    """Rebuild the data shards of an erasure-coded file, one stripe at a time.
+
+    Each stripe is rebuilt and yielded as soon as enough of its shards have
+    decoded, in stripe order, and further shards of a finished stripe are skipped.
+    Stops pulling from shards once the last stripe is done, so callers can cancel
+    the remaining fetches. Shards that are unknown or fail to decrypt or decode
+    count as lost.
+    """
+    erasure = mapping[ERASURE_FIELD]
+    stripes = get_erasure_stripes(mapping)
+    data_counts = [len(stripe) - erasure["parity_shards"] for stripe in stripes]
+    stripe_of = {shard_index: number for number, stripe in enumerate(stripes) for shard_index in stripe}
+    received: Dict[int, Dict[int, bytes]] = {number: {} for number in range(len(stripes))}
+    opening: Dict[Future, int] = {}
+    chunks = mapping.get(CHUNKS_FIELD)
+    remaining = erasure["size"]
+    next_stripe = 0
+
+    def collect(done: Iterable[Future]) -> None:
+        for future in done:
+            del opening[future]
+            try:
+                shard_index, plain = _opened(future, timings, counters)
+            except (ValueError, ReedSolomonError):
+                continue
+            if stripe_of[shard_index] >= next_stripe:
+                received[stripe_of[shard_index]].setdefault(shard_index, plain)
+
+    def finished(final: bool = False) -> Iterator[bytes]:
+        # Yield every complete stripe in order, stripping the padding that evened out
+        # its data shards; once no more shards come, the rest must rebuild as they are
+        nonlocal next_stripe, remaining
+        while next_stripe < len(stripes) and (final or len(received[next_stripe]) >= data_counts[next_stripe]):
+            stripe = stripes[next_stripe]
+            start = time.perf_counter()
+            data = _rebuild_stripe(received.pop(next_stripe), stripe, data_counts[next_stripe])
+            timings["reconstruct"] += time.perf_counter() - start
+            next_stripe += 1
+            for shard_index, shard in zip(stripe, data):
+                length = encoded_size(chunks[shard_index][1]) if chunks is not None else remaining
+                remaining -= len(shard)
+                yield memoryview(shard)[:length]
+
+    try:
+        for item in shards:
+            try:
+                shard_index, shard = _place(item, mapping)
+            except (KeyError, ValueError):
+                continue
+            if stripe_of.get(shard_index, -1) < next_stripe or shard_index in received[stripe_of[shard_index]] or shard_index in opening.values():
+                continue
+            opening[_submit_open(executor, shard_index, shard, mapping, private_key, data_key)] = shard_index
+            collect([future for future in opening if future.done()])
+
+            # Only wait on the pool once the shards in hand could finish the next stripe
+            current = received[next_stripe]
+            pending = sum(1 for index in opening.values() if stripe_of[index] == next_stripe)
+            while pending and len(current) < data_counts[next_stripe] <= len(current) + pending:
+                collect(wait(opening, return_when=FIRST_COMPLETED).done)
+                pending = sum(1 for index in opening.values() if stripe_of[index] == next_stripe)
+            if len(current) >= data_counts[next_stripe]:
+                yield from finished()
+            if next_stripe == len(stripes):
+                break
+        collect(wait(opening).done)
+        yield from finished(final=True)
+    finally:
+        for future in opening:
+            future.cancel()
+
+def AssimilateStream(shards: Iterable[ShardInput], mapping: Dict[str, Any], private_key: bytes, workers: Optional[int] = None, backend: str = PARALLEL_BACKEND, timings: Optional[Dict[str, float]] = None, counters: Optional[Dict[str, int]] = None) -> Iterator[bytes]:
+    """Streaming variant of Assimilate.
+
+    Shards can be given as bare encrypted shards, positioned through the mapping, or
+    as (shard_index, shard) pairs, in any order. Decoded file data is yielded as soon
+    as it is contiguous, so only shards that arrived ahead of a missing one are held.
+    Erasure-coded files are rebuilt one stripe at a time from any k of the stripe's
+    shards, so only the stripe being rebuilt and shards that arrived ahead of it
+    are held; give shards in stripe order (metadata.get_erasure_stripes).
+
+    Decryption and shard-level decoding fan out over `workers` process or thread
+    workers (PARALLEL_WORKERS by default) when the file is at least
+    PARALLEL_MIN_SIZE bytes. If a timings dict is given, the seconds spent in each
+    of TIMING_STAGES are added to it; decrypt and decode_shard sum worker time.
+
+    Shards whose systematic data matches the checksum recorded at upload only have
+    their parity stripped, and Reed-Solomon correction runs just for the others. If
+    a counters dict is given, the number of shards decoded each way (see
+    DECODE_OUTCOMES) is added to it. When every shard is checksummed, file-level
+    parity is stripped without decoding as well.
+
+    Compressed uploads (see COMPRESSION_FIELD) are decompressed frame by frame as
+    the decoded stream arrives.
+    """
+    timings = {} if timings is None else timings
+    for stage in TIMING_STAGES:
+        timings.setdefault(stage, 0.0)
+    counters = {} if counters is None else counters
+    for outcome in DECODE_OUTCOMES:
+        counters.setdefault(outcome, 0)
+
+    start = time.perf_counter()
+    data_key = _unwrap_mapping_key(mapping, private_key)
+    timings["unwrap_key"] += time.perf_counter() - start
+
+    # Size the pool from the first shard, since shards are close to equal in size
+    shards = iter(shards)
+    first = next(shards, None)
+    workers = resolve_workers(workers)
+    if first is None or len(first[1] if isinstance(first, tuple) else first) * get_shard_count(mapping) < PARALLEL_MIN_SIZE:
+        workers = 1
+    shards = chain([first], shards) if first is not None else iter(())
+
+    with create_executor(workers, backend) as executor:
+        if ERASURE_FIELD in mapping:
+            plain_shards = _recovered_shards(shards, mapping, private_key, data_key, executor, timings, counters)
+        else:
+            plain_shards = _ordered_shards(shards, mapping, private_key, data_key, executor, 2 * workers, timings, counters)
+        decoded = _decode_file_stream(plain_shards, timings, chunked=CHUNKS_FIELD in mapping, verified=_all_checksummed(mapping))
+        yield from decompress_frames(decoded) if COMPRESSION_FIELD in mapping else decoded
+
+def data_extents(mapping: Dict[str, Any]) -> Optional[List[Tuple[int, int]]]:
+    """Return the (offset, length) of the file bytes held by each data shard.
+
+    Only striped and content-defined uploads decode shard by shard; for packed
+    uploads None is returned. For compressed uploads the extents are offsets into
+    the compressed stream.
+    """
+    if CHUNKS_FIELD in mapping:
+        extents = []
+        offset = 0
+        for _, length in mapping[CHUNKS_FIELD]:
+            extents.append((offset, length))
+            offset += length
+        return extents
+    stripe = mapping.get(STRIPE_FIELD)
+    if stripe is None:
+        return None
+    stripe_size = stripe["shard_size"] // BLOCK_SIZE * MESSAGE_SIZE
+    return [(offset, min(stripe_size, stripe["size"] - offset)) for offset in range(0, stripe["size"], stripe_size)]
+
+def shards_for_range(mapping: Dict[str, Any], start: int, end: int) -> List[int]:
+    """Return the indexes of the data shards holding file bytes [start, end)."""
+    extents = data_extents(mapping)
+    if extents is None:
+        raise ValueError("Byte-range reads need a striped or content-defined upload")
+    if start >= end:
+        return []
+    if COMPRESSION_FIELD in mapping:
+        start, end, _ = stored_range(mapping[COMPRESSION_FIELD], start, end)
+        if start >= end:
+            return []
+    offsets = [offset for offset, _ in extents]
+    first = max(0, bisect.bisect_right(offsets, start) - 1)
+    last = bisect.bisect_left(offsets, end)
+    # A shard starting at or before start may still end before it
+    if first < last and sum(extents[first]) <= start:
+        first += 1
+    return list(range(first, last))
+
+def AssimilateRange(shards: Iterable[ShardInput], mapping: Dict[str, Any], private_key: bytes, start: int, end: int, workers: Optional[int] = None, backend: str = PARALLEL_BACKEND) -> bytes:
+    """Decode file bytes [start, end) from the shards covering them.
+
+    Only the data shards listed by shards_for_range need to be given; any others
+    are ignored unless one of those is missing or damaged, in which case
+    erasure-coded files rebuild it from any k of the shards given from its stripe. Compressed
+    uploads decode and decompress only the frames covering the range.
+    """
+    needed = shards_for_range(mapping, start, end)
+    if not needed:
+        return b""
+    extents = data_extents(mapping)
+    timings = dict.fromkeys(TIMING_STAGES, 0.0)
+    counters = dict.fromkeys(DECODE_OUTCOMES, 0)
+    data_key = _unwrap_mapping_key(mapping, private_key)
+
+    received: Dict[int, bytes] = {}
+    with create_executor(resolve_workers(workers) if len(needed) > 1 else 1, backend) as executor:
+        opening = [_submit_open(executor, *_place(item, mapping), mapping, private_key, data_key) for item in shards]
+        for future in opening:
+            try:
+                shard_index, plain = _opened(future, timings, counters)
+            except (ValueError, ReedSolomonError):
+                if ERASURE_FIELD not in mapping:
+                    raise
+                continue
+            received[shard_index] = plain
+
+    missing = [shard_index for shard_index in needed if shard_index not in received]
+    if missing and ERASURE_FIELD not in mapping:
+        raise ValueError(f"Shards {missing} covering bytes {start}-{end} are missing")
+    for stripe in get_erasure_stripes(mapping) if missing else []:
+        if not any(shard_index in stripe for shard_index in missing):
+            continue
+        data_count = len(stripe) - mapping[ERASURE_FIELD]["parity_shards"]
+        in_stripe = {shard_index: received[shard_index] for shard_index in stripe if shard_index in received}
+        if len(in_stripe) < data_count:
+            raise ValueError(f"Shards {missing} covering bytes {start}-{end} are missing")
+        received.update(zip(stripe, _rebuild_stripe(in_stripe, stripe, data_count)))
+
+    # Each covering shard decodes on its own once its padding is stripped
+    decode = _file_decoder(_all_checksummed(mapping))
+    data = b"".join(decode(memoryview(received[shard_index])[:encoded_size(extents[shard_index][1])]) for shard_index in needed)
+    offset = extents[needed[0]][0]
+    compression = mapping.get(COMPRESSION_FIELD)
+    if compression is None:
+        return data[start - offset:end - offset]
+    stored_start, stored_end, frame_offset = stored_range(compression, start, end)
+    data = b"".join(decompress_frames([data[stored_start - offset:stored_end - offset]]))
+    return data[start - frame_offset:end - frame_offset]
+
+def Assimilate(shards: List[bytes], mapping: Dict[str, Any], private_key: bytes, workers: Optional[int] = None, timings: Optional[Dict[str, float]] = None, counters: Optional[Dict[str, int]] = None) -> bytes:
+    # Reorder, decrypt and decode shards, then decode the entire file to reconstruct original data
+    original_data = bytearray()
+    for data in AssimilateStream(shards, mapping, private_key, workers=workers, timings=timings, counters=counters):
+        original_data += data
     return original_data
@@ -1,30 +1,353 @@
-from typing import Tuple, List, Dict, Any
-from .encryption import encrypt_data
-from .redundancy import encode_file, encode_shard
-from .sharding import split_data
-from .metadata import create_shard_mapping
-from .config import DEFAULT_SHARD_SIZE
+from typing import Tuple, List, Dict, Any, Iterator, Optional
+from .encryption import encrypt_data, generate_data_key, unwrap_data_key, wrap_data_key
+from .redundancy import encode_file, encode_shard, encoded_size, shard_checksum, BLOCK_SIZE, MESSAGE_SIZE
+from .erasure import ParityEncoder, MAX_SHARDS
+from .shard_format import ShardHeader, pack_shard
+from .metadata import get_hash, get_hash_algo, get_sealed_index, DATA_KEY_FIELD, ERASURE_FIELD, CHUNKS_FIELD, STRIPE_FIELD, CHECKSUMS_FIELD, HASH_FIELD, COMPRESSION_FIELD, SEALED_INDEXES_FIELD, RESERVED_FIELDS
+from .compression import CompressingReader, resolve_codec
+from .hashing import hexdigest
+from .parallel import create_executor, ordered_map, resolve_workers, shippable
+from .sharding import iter_content_chunks, merge_data
+from .planner import UploadPlan
+from .config import DEFAULT_SHARD_SIZE, ENCRYPTION_MODE, STREAM_MEMORY_LIMIT, PARALLEL_BACKEND, PARALLEL_MIN_SIZE, CHUNKING, CDC_MIN_SIZE, CDC_MAX_SIZE, SHARD_LAYOUT, HASH_ALGO, COMPRESSION
+from concurrent.futures import Executor
+import io
 import math
+import os
 
-def Distribute(file_obj: Any, private_key: bytes, num_shards: int = None) -> Tuple[List[bytes], Dict[str, Any]]:
-    # Read file data
-    file_data: bytes = file_obj.read()
-    file_size: int = len(file_data)
-
-    # File-level Reed-Solomon encoding
-    encoded_file_data: bytes = encode_file(file_data)
-
-    # Calculate shard size based on number of shards
-    shard_size: int = math.ceil(len(encoded_file_data) / num_shards) if num_shards else DEFAULT_SHARD_SIZE
-    
-    # Split file data into shards
-    shards: List[bytes] = split_data(encoded_file_data, shard_size)
-    
-    # Shard-level Reed-Solomon encoding for each shard
-    encoded_shards: List[bytes] = [encode_shard(shard) for shard in shards]
-    
-    # Encrypt each shard and create hash mapping
-    encrypted_shards: List[bytes] = [encrypt_data(shard, private_key) for shard in encoded_shards]
-    shard_mapping: Dict[str, Any] = create_shard_mapping(encrypted_shards)
-    
-    return encrypted_shards, shard_mapping
+def _remaining_size(file_obj: Any) -> Optional[int]:
+    """Return the number of unread bytes in file_obj, or None if it cannot seek."""
+    if not getattr(file_obj, "seekable", lambda: False)():
+        return None
+    position = file_obj.tell()
+    end = file_obj.seek(0, os.SEEK_END)
+    file_obj.seek(position)
+    return end - position
+
+def _seal_shard(shard_index: int, shard: bytes, private_key: bytes, data_key: Optional[bytes], hash_algo: str) -> Tuple[int, bytes, str, int]:
+    """Shard-level Reed-Solomon encode, encrypt, checksum, frame and hash one shard; runs in pool workers."""
+    payload = encrypt_data(encode_shard(shard), private_key, data_key)
+    checksum = shard_checksum(shard)
+    sealed_shard = pack_shard(ShardHeader(shard_index, BLOCK_SIZE, BLOCK_SIZE - MESSAGE_SIZE, len(payload), checksum), payload)
+    return shard_index, sealed_shard, get_hash(sealed_shard, hash_algo), checksum
+
+class DistributeStream:
+    """Streaming variant of Distribute.
+
+    Iterating yields (shard_index, encrypted_shard) as soon as each shard is ready.
+    file_obj is read in windows sized so that the read window, its encoding and the
+    shard in flight stay under max_memory bytes. shard_mapping is complete once
+    iteration has finished.
+
+    With parity_shards, data shards are coded in stripes of stripe_width data
+    shards (as many as erasure.MAX_SHARDS allows by default), each with that many
+    parity shards, so any stripe_width of a stripe's shards rebuild it. Shorter
+    data shards are stored as they are and count as zero-padded to shard_size in
+    the parity. Parity shard indexes follow all data shards (erasure.stripe_shards),
+    so the data shards are counted before the first shard is yielded, and file_obj
+    has to be seekable. data_shards holds the count, at the latest once the first
+    parity shard is yielded.
+
+    File-level encoding of each window and shard-level encoding, encryption and
+    hashing fan out over `workers` process or thread workers (PARALLEL_WORKERS by
+    default) for files of at least PARALLEL_MIN_SIZE bytes; shards are still
+    yielded in order.
+
+    With chunking="cdc" the file is cut into content-defined chunks instead of
+    equal-size shards, each encoded on its own, so an edit only changes the shards
+    around it. The chunk hashes are listed under CHUNKS_FIELD in the mapping.
+    Chunk hashes and shard keys use HASH_ALGO, which is recorded under HASH_FIELD.
+
+    With layout="striped", fixed-size shards are rounded up to whole Reed-Solomon
+    blocks so each data shard decodes on its own and holds a known byte range of
+    the file; the layout is recorded under STRIPE_FIELD for byte-range reads.
+    Content-defined chunks are always range-addressable through CHUNKS_FIELD.
+
+    An UploadPlan from planner.plan_upload sets the shard size, parity and stripe
+    width of a fixed-size upload instead of num_shards and parity_shards, and
+    implies the striped layout.
+
+    Given the shard mapping of the previous version of the file as `previous`, a
+    content-defined upload reuses that version's data key and skips every chunk the
+    previous version already stored: such chunks are not yielded, their old shard
+    hash is mapped to the new index, and `reused` maps the new shard index to the
+    previous version's shard index so the caller can point at the stored copy.
+The headers of reused shards keep the index they were sealed with, which is
+listed under SEALED_INDEXES_FIELD.
+
+    The CRC-32 of every shard's systematic data is listed by shard index under
+    CHECKSUMS_FIELD, so retrieval can skip Reed-Solomon correction of intact shards.
+    Each yielded shard starts with a shard_format header recording its index,
+    Reed-Solomon parameters, payload length and that checksum.
+
+    With a compression codec ("auto" picks the best one installed), a fixed-size
+    upload compresses the file in independent frames before any encoding, storing
+    frames that sample as incompressible as-is, and records the codec and frame
+    offsets under COMPRESSION_FIELD. The striped layout then describes the
+    compressed stream. A seekable file is compressed into a temporary file before
+    any shard is cut, so num_shards is met exactly, and the file is removed once
+    iteration ends. To plan an upload, spool a compression.CompressingReader, plan
+    from its stored_size, pass the reader as file_obj and close it afterwards. A
+    plan made for another size is rejected. Content-defined chunking is not
+    compressed, so unchanged chunks still match across versions.
+    """
+
+    def __init__(self, file_obj: Any, private_key: bytes, num_shards: int = None, max_memory: Optional[int] = STREAM_MEMORY_LIMIT, parity_shards: int = 0, workers: Optional[int] = None, backend: str = PARALLEL_BACKEND, chunking: str = CHUNKING, layout: str = SHARD_LAYOUT, previous: Optional[Dict[str, Any]] = None, plan: Optional[UploadPlan] = None, compression: str = COMPRESSION, stripe_width: Optional[int] = None) -> None:
+        if layout not in ("packed", "striped"):
+            raise ValueError(f"Unknown shard layout: {layout}")
+        if plan is not None:
+            if num_shards or chunking != "fixed":
+                raise ValueError("An upload plan replaces num_shards and only applies to fixed-size chunking")
+            parity_shards = plan.parity_shards
+            stripe_width = plan.stripe_width
+            layout = "striped"
+        if previous is not None and (chunking != "cdc" or CHUNKS_FIELD not in previous):
+            raise ValueError("Delta uploads need content-defined chunking for both versions")
+        self.file_obj = file_obj
+        self.private_key = private_key
+        self.parity_shards = parity_shards
+        self.backend = backend
+        self.chunking = chunking
+        self.striped = layout == "striped" and chunking == "fixed"
+        self.raw_size = 0
+        self.previous = previous
+        self.reused: Dict[int, int] = {}
+        self.checksums: Dict[int, Optional[int]] = {}
+        # Versions of a file keep one hash algorithm, so their chunk hashes compare
+        self.hash_algo = get_hash_algo(previous) if previous is not None else HASH_ALGO
+        self.shard_mapping: Dict[str, Any] = {HASH_FIELD: self.hash_algo}
+        # A seekable file is compressed ahead into a temporary file, so shards are
+        # counted from the size it really compresses to
+        self.compressor = None
+        self._owns_compressor = False
+        codec = resolve_codec(compression) if chunking == "fixed" else None
+        if isinstance(file_obj, CompressingReader):
+            self.compressor = file_obj
+        elif codec is not None:
+            self.compressor = self.file_obj = CompressingReader(file_obj, codec)
+            self._owns_compressor = True
+            if _remaining_size(file_obj) is not None:
+                self.compressor.spool()
+        file_size = _remaining_size(self.file_obj)
+        if plan is not None and file_size is not None and file_size != plan.file_size:
+            raise ValueError(f"The upload plan is for {plan.file_size} bytes but there are {file_size} bytes to store")
+
+        # Calculate shard size based on number of shards, of which parity_shards carry parity;
+        # content-defined chunks are at most CDC_MAX_SIZE bytes before encoding
+        if chunking == "cdc":
+            if num_shards:
+                raise ValueError("num_shards cannot be combined with content-defined chunking")
+            self.shard_size: int = encoded_size(CDC_MAX_SIZE)
+        elif chunking != "fixed":
+            raise ValueError(f"Unknown chunking strategy: {chunking}")
+        elif plan is not None:
+            self.shard_size = plan.shard_size
+        elif num_shards:
+            if num_shards <= parity_shards:
+                raise ValueError(f"num_shards ({num_shards}) must exceed parity_shards ({parity_shards})")
+            if file_size is None:
+                raise ValueError("num_shards requires a seekable file object")
+            self.shard_size = max(1, math.ceil(encoded_size(file_size) / (num_shards - parity_shards)))
+        else:
+            self.shard_size = DEFAULT_SHARD_SIZE
+        if self.striped:
+            self.shard_size = math.ceil(self.shard_size / BLOCK_SIZE) * BLOCK_SIZE
+
+        # Small files are not worth a worker pool
+        self.workers = resolve_workers(workers)
+        if file_size is not None and file_size < PARALLEL_MIN_SIZE:
+            self.workers = 1
+        self.max_in_flight = 2 * self.workers if self.workers > 1 else 1
+
+        # Read whole Reed-Solomon messages so each window encodes exactly as the full file would;
+        # every shard in flight holds its encoding and ciphertext, and parity shards are
+        # accumulated in memory until the last data shard is out
+        budget = max_memory - (1 + 2 * self.max_in_flight + parity_shards) * self.shard_size if max_memory else STREAM_MEMORY_LIMIT
+        self.window_size: int = budget // (2 * BLOCK_SIZE) * MESSAGE_SIZE
+        if self.window_size < MESSAGE_SIZE:
+            raise ValueError(f"max_memory of {max_memory} bytes cannot hold shards of {self.shard_size} bytes; use more shards")
+
+        # Parity shards of a stripe go out as soon as the stripe is complete, at
+        # indexes after every data shard, so the data shards are counted first
+        self.stripe_width = stripe_width or MAX_SHARDS - parity_shards
+        self.data_shards: Optional[int] = None
+        if parity_shards:
+            if not 0 < self.stripe_width <= MAX_SHARDS - parity_shards:
+                raise ValueError(f"Stripes hold 1 to {MAX_SHARDS - parity_shards} data shards besides {parity_shards} parity shards")
+            if file_size is None:
+                raise ValueError("Erasure parity requires a seekable file object")
+            self.data_shards = self._count_data_shards(file_size)
+
+    def __iter__(self) -> Iterator[Tuple[int, bytes]]:
+        # In envelope mode a single per-file data key encrypts the shards and only
+        # that key goes through RSA; a new version keeps the previous version's key so
+        # the chunks it reuses still decrypt
+        if self.previous is not None:
+            wrapped_key = self.previous.get(DATA_KEY_FIELD)
+            data_key = unwrap_data_key(bytes.fromhex(wrapped_key), self.private_key) if wrapped_key else None
+        else:
+            data_key = generate_data_key() if ENCRYPTION_MODE == "envelope" else None
+        if data_key is not None:
+            self.shard_mapping[DATA_KEY_FIELD] = self.previous[DATA_KEY_FIELD] if self.previous else wrap_data_key(data_key, self.private_key).hex()
+
+        # Shard-level encoding, encryption and hashing are independent per shard; a
+        # compressor spooled here has its temporary file removed once it is read
+        try:
+            with create_executor(self.workers, self.backend) as executor:
+                jobs = ((shard_index, shippable(executor, shard), self.private_key, data_key, self.hash_algo) for shard_index, shard in self._plain_shards(executor) if shard_index not in self.reused)
+                for result in ordered_map(executor, _seal_shard, jobs, self.max_in_flight):
+                    yield self._record(*result)
+        finally:
+            if self._owns_compressor:
+                self.compressor.close()
+
+        # Reused chunks keep the checksums the previous version recorded, if it had them
+        previous_checksums = self.previous.get(CHECKSUMS_FIELD) if self.previous is not None else None
+        for shard_index, previous_index in self.reused.items():
+            self.checksums[shard_index] = previous_checksums[previous_index] if previous_checksums else None
+        self.shard_mapping[CHECKSUMS_FIELD] = [self.checksums[shard_index] for shard_index in range(len(self.checksums))]
+        # Reused shards keep the index they were sealed with, which may be from an earlier version still
+        if self.reused:
+            sealed = list(range(len(self.checksums)))
+            for shard_index, previous_index in self.reused.items():
+                sealed[shard_index] = get_sealed_index(self.previous, previous_index)
+            self.shard_mapping[SEALED_INDEXES_FIELD] = sealed
+
+    def _encode_window(self, data: bytes, executor: Executor) -> bytes:
+        """File-level Reed-Solomon encode a window, split across the pool when there is one."""
+        if self.workers <= 1 or len(data) < 2 * MESSAGE_SIZE * self.workers:
+            return encode_file(data)
+        piece = math.ceil(len(data) / self.workers / MESSAGE_SIZE) * MESSAGE_SIZE
+        return merge_data(list(executor.map(encode_file, [shippable(executor, data[i:i + piece]) for i in range(0, len(data), piece)])))
+
+    def _count_data_shards(self, file_size: int) -> Optional[int]:
+        """Number of data shards the rest of the file makes, or None if it surely fits one stripe."""
+        if self.chunking == "fixed":
+            return math.ceil(encoded_size(file_size) / self.shard_size)
+        # Every chunk but the last has at least CDC_MIN_SIZE bytes
+        if math.ceil(file_size / CDC_MIN_SIZE) <= self.stripe_width:
+            return None
+        position = self.file_obj.tell()
+        count = sum(1 for _ in iter_content_chunks(self.file_obj, self.window_size))
+        self.file_obj.seek(position)
+        return count
+
+    def _plain_shards(self, executor: Executor) -> Iterator[Tuple[int, bytes]]:
+        """Yield file-level encoded data shards, each erasure stripe followed by its parity shards."""
+        parity = None
+        data_shards = self._chunk_shards(executor) if self.chunking == "cdc" else self._fixed_shards(executor)
+        encoded_length = 0
+        shard_index = 0
+        for shard in data_shards:
+            encoded_length += len(shard)
+            if self.parity_shards:
+                # Short shards are stored as they are; parity treats them as zero-padded
+                if parity is None:
+                    parity = ParityEncoder(self.parity_shards, self.shard_size)
+                parity.update(shard_index % self.stripe_width, shard)
+            yield shard_index, shard
+            shard_index += 1
+            if parity is not None and shard_index % self.stripe_width == 0 and self.data_shards is not None and shard_index < self.data_shards:
+                stripe = shard_index // self.stripe_width - 1
+                yield from enumerate(parity.finalize(), start=self.data_shards + stripe * self.parity_shards)
+                parity = None
+
+        if self.striped:
+            self.shard_mapping[STRIPE_FIELD] = {"shard_size": self.shard_size, "size": self.raw_size}
+        if self.compressor is not None:
+            self.shard_mapping[COMPRESSION_FIELD] = self.compressor.metadata()
+
+        # Erasure parity shards of the last stripe come last
+        if parity is not None:
+            if self.data_shards is not None and shard_index != self.data_shards:
+                raise ValueError(f"Expected {self.data_shards} data shards but the file made {shard_index}; it changed during the upload")
+            self.data_shards = shard_index
+            self.shard_mapping[ERASURE_FIELD] = {
+                "data_shards": shard_index,
+                "parity_shards": self.parity_shards,
+                "stripe_width": self.stripe_width,
+                "size": encoded_length,
+            }
+            stripe = (shard_index - 1) // self.stripe_width
+            yield from enumerate(parity.finalize(), start=shard_index + stripe * self.parity_shards)
+
+    def _fixed_shards(self, executor: Executor) -> Iterator[bytes]:
+        """File-level encode the file window by window and cut it into shard_size shards.
+
+        Whole messages are encoded straight from each window read and shards are
+        memoryview slices of the encoded window; only a partial message or shard
+        left at the end of a window is copied to be joined with the next one.
+        """
+        raw = b""
+        pending = b""
+        eof = False
+        while not eof:
+            window = self.file_obj.read(self.window_size)
+            eof = not window
+            self.raw_size += len(window)
+            if raw:
+                window = raw + window
+
+            # File-level Reed-Solomon encoding of every complete message read so far
+            usable = len(window) if eof else len(window) - len(window) % MESSAGE_SIZE
+            with memoryview(window) as view:
+                encoded = memoryview(self._encode_window(view[:usable], executor))
+                raw = bytes(view[usable:])
+
+            # Cut shards off the encoded data as soon as they are full
+            start = 0
+            if pending and (len(pending) + len(encoded) >= self.shard_size or eof):
+                start = self.shard_size - len(pending)
+                yield pending + encoded[:start]
+                pending = b""
+            while len(encoded) - start >= self.shard_size:
+                yield encoded[start:start + self.shard_size]
+                start += self.shard_size
+            pending += bytes(encoded[start:])
+            if eof and pending:
+                yield pending
+
+    def _chunk_shards(self, executor: Executor) -> Iterator[bytes]:
+        """File-level encode each content-defined chunk on its own, recording its hash."""
+        chunks = self.shard_mapping.setdefault(CHUNKS_FIELD, [])
+        stored = self._previous_chunks()
+
+        def jobs() -> Iterator[Tuple[bytes]]:
+            for chunk in iter_content_chunks(self.file_obj, self.window_size):
+                chunk_id = (hexdigest(chunk, self.hash_algo), len(chunk))
+                # Each stored shard is referenced at most once, since the mapping is keyed by shard hash
+                if chunk_id in stored:
+                    previous_index, shard_hash = stored.pop(chunk_id)
+                    self.reused[len(chunks)] = previous_index
+                    self.shard_mapping[shard_hash] = len(chunks)
+                chunks.append(list(chunk_id))
+                yield (chunk,)
+
+        yield from ordered_map(executor, encode_file, jobs(), self.max_in_flight)
+
+    def _previous_chunks(self) -> Dict[Tuple[str, int], Tuple[int, str]]:
+        """Map (chunk hash, length) of each previous-version data shard to its (index, shard hash)."""
+        if self.previous is None:
+            return {}
+        shard_hashes = {shard_index: shard_hash for shard_hash, shard_index in self.previous.items() if shard_hash not in RESERVED_FIELDS}
+        stored: Dict[Tuple[str, int], Tuple[int, str]] = {}
+        for shard_index, (chunk_hash, length) in enumerate(self.previous[CHUNKS_FIELD]):
+            stored.setdefault((chunk_hash, length), (shard_index, shard_hashes[shard_index]))
+        return stored
+
+    def _record(self, shard_index: int, encrypted_shard: bytes, shard_hash: str, checksum: int) -> Tuple[int, bytes]:
+        """Add a sealed shard and its checksum to the mapping and pass it on."""
+        self.shard_mapping[shard_hash] = shard_index
+        self.checksums[shard_index] = checksum
+        return shard_index, encrypted_shard
+
+def Distribute(file_obj: Any, private_key: bytes, num_shards: int = None, parity_shards: int = 0, workers: Optional[int] = None, chunking: str = CHUNKING, layout: str = SHARD_LAYOUT, plan: Optional[UploadPlan] = None, compression: str = COMPRESSION, stripe_width: Optional[int] = None) -> Tuple[List[bytes], Dict[str, Any]]:
+    # Sizing shards by count and placing parity need the file length up front
+    if (num_shards or parity_shards or plan) and _remaining_size(file_obj) is None:
+        file_obj = io.BytesIO(file_obj.read())
+
+    stream = DistributeStream(file_obj, private_key, num_shards=num_shards, max_memory=None, parity_shards=parity_shards, workers=workers, chunking=chunking, layout=layout, plan=plan, compression=compression, stripe_width=stripe_width)
+    # Parity shards of a stripe are yielded before the next stripe's data shards
+    encrypted_shards: List[bytes] = [shard for _, shard in sorted(stream, key=lambda item: item[0])]
+
+    return encrypted_shards, stream.shard_mapping
@@ -0,0 +1,77 @@
+"""Pluggable hash provider for file IDs, shard mapping keys, chunk fingerprints and proofs.
+
+HASH_ALGO picks the algorithm for new uploads and DEFAULT_PROOF_HASH_ALGO the one
+for storage proofs: "sha256" (the original scheme), "blake2b" or "blake3" (needs
+the blake3 package). hashlib releases the GIL while it hashes inputs over 2 KiB,
+so shards hashed on worker threads run in parallel; blake3 also splits large
+inputs across threads on its own.
+
+Identifiers record the algorithm that made them. File IDs of non-SHA-256 uploads
+are prefixed with "<algo>-" and shard mappings list the algorithm under
+HASH_FIELD; bare 64-digit file IDs and mappings without the field are SHA-256, so
+objects hashed with the old scheme are still found and verified.
+"""
+from typing import Any, Callable, Union
+import hashlib
+import hmac
+from .config import HASH_ALGO
+
+HASH_ALGOS = ("sha256", "blake2b", "blake3")
+LEGACY_HASH_ALGO = "sha256"  # Algorithm of identifiers that do not name one
+DIGEST_SIZE = 32  # Bytes of file IDs and chunk fingerprints, whatever the algorithm
+SHARD_KEY_SIZE = 16  # Bytes of shard mapping keys
+HASH_READ_SIZE = 1 << 20  # Bytes hashed per read when hashing a file
+
+def new_hash(algo: str = HASH_ALGO, data: bytes = b"") -> Any:
+    """Return a hashlib-style object (update, digest, hexdigest, copy) for algo."""
+    if algo == "sha256":
+        return hashlib.sha256(data)
+    if algo == "blake2b":
+        return hashlib.blake2b(data, digest_size=DIGEST_SIZE)
+    if algo == "blake3":
+        try:
+            from blake3 import blake3
+        except ImportError:
+            raise ValueError("The blake3 hash algorithm needs the blake3 package") from None
+        return blake3(data, max_threads=blake3.AUTO)
+    raise ValueError(f"Unknown hash algorithm: {algo}")
+
+def hexdigest(data: bytes, algo: str = HASH_ALGO) -> str:
+    """Hex digest of data, DIGEST_SIZE bytes long."""
+    return new_hash(algo, data).hexdigest()
+
+def shard_key(data: bytes, algo: str = HASH_ALGO) -> str:
+    """Shard mapping key of a shard; SHA-256 keeps the original MD5-of-SHA-256 key."""
+    if algo == LEGACY_HASH_ALGO:
+        return hashlib.md5(hashlib.sha256(data).digest()).hexdigest()
+    return new_hash(algo, data).digest()[:SHARD_KEY_SIZE].hex()
+
+def format_id(digest: str, algo: str = HASH_ALGO) -> str:
+    """File ID for a content hex digest; SHA-256 IDs stay bare for compatibility."""
+    return digest if algo == LEGACY_HASH_ALGO else f"{algo}-{digest}"
+
+def id_algo(file_id: str) -> str:
+    """Algorithm a file ID was hashed with."""
+    algo, _, digest = file_id.partition("-")
+    return algo if digest and algo in HASH_ALGOS else LEGACY_HASH_ALGO
+
+def hash_file(file_obj: Any, algo: str = HASH_ALGO) -> str:
+    """File ID of the rest of file_obj, read HASH_READ_SIZE bytes at a time."""
+    file_hash = new_hash(algo)
+    for block in iter(lambda: file_obj.read(HASH_READ_SIZE), b""):
+        file_hash.update(block)
+    return format_id(file_hash.hexdigest(), algo)
+
+def hmac_digestmod(algo: str) -> Union[str, Callable[..., Any]]:
+    """digestmod for hmac.new; hashlib algorithms go by name so OpenSSL's HMAC is used."""
+    if algo not in HASH_ALGOS:
+        raise ValueError(f"Unknown hash algorithm: {algo}")
+    if algo in hashlib.algorithms_available:
+        return algo
+    return lambda data=b"": new_hash(algo, data)
+
+def keyed_digest(key: bytes, data: bytes, salt: bytes, algo: str) -> bytes:
+    """HMAC of data followed by salt, fed separately so data is never copied."""
+    mac = hmac.new(key, data, hmac_digestmod(algo))
+    mac.update(salt)
+    return mac.digest()
@@ -1,14 +1,53 @@
-import hashlib
-from typing import List, Dict
-
-def get_hash(data: bytes) -> str:
-    """Generate a smaller hash using a double-hashing technique."""
-    # First, compute SHA-256 hash
-    sha256_hash = hashlib.sha256(data).digest()
-    # Second, compute MD5 hash of the SHA-256 output to get a smaller hash
-    final_hash = hashlib.md5(sha256_hash).hexdigest()  # Use SHA-1 instead of MD5 if desired
-    return final_hash
-
-def create_shard_mapping(shards: List[bytes]) -> Dict[str, int]:
-    """Create a mapping of double-hashed shard keys to their sequence number."""
-    return {get_hash(shard): idx for idx, shard in enumerate(shards)}
+from typing import List, Dict, Any
+from .erasure import stripe_shards
+from .hashing import shard_key, LEGACY_HASH_ALGO
+from .config import HASH_ALGO
+
+# Reserved shard mapping field holding the RSA-wrapped data key (hex) in envelope mode
+DATA_KEY_FIELD = "data_key"
+# Reserved shard mapping field holding cross-shard erasure coding parameters: data and parity shards per stripe, encoded size
+ERASURE_FIELD = "erasure"
+# Reserved shard mapping field listing [content hash hex, length] of each content-defined chunk
+CHUNKS_FIELD = "chunks"
+# Reserved shard mapping field holding the striped layout: encoded bytes per data shard and size of the encoded stream
+STRIPE_FIELD = "stripe"
+# Reserved shard mapping field listing the CRC-32 of each shard's systematic data, by shard index
+CHECKSUMS_FIELD = "checksums"
+# Reserved shard mapping field naming the hash algorithm of the shard keys and chunk hashes
+HASH_FIELD = "hash"
+# Reserved shard mapping field describing compressed uploads: codec, frame size, raw and stored sizes, frame offsets
+COMPRESSION_FIELD = "compression"
+# Reserved shard mapping field listing the index in each shard's header, by shard index; only delta uploads
+# that reuse shards sealed under another index have it
+SEALED_INDEXES_FIELD = "sealed_indexes"
+RESERVED_FIELDS = {DATA_KEY_FIELD, ERASURE_FIELD, CHUNKS_FIELD, STRIPE_FIELD, CHECKSUMS_FIELD, HASH_FIELD, COMPRESSION_FIELD, SEALED_INDEXES_FIELD}
+
+def get_hash(data: bytes, algo: str = HASH_ALGO) -> str:
+    """Shard mapping key of a shard (see hashing.shard_key)."""
+    return shard_key(data, algo)
+
+def create_shard_mapping(shards: List[bytes], algo: str = HASH_ALGO) -> Dict[str, int]:
+    """Create a mapping of shard keys to their sequence number."""
+    return {get_hash(shard, algo): idx for idx, shard in enumerate(shards)}
+
+def get_shard_count(mapping: Dict[str, Any]) -> int:
+    """Count the shard entries in a mapping, ignoring reserved metadata fields."""
+    return sum(1 for key in mapping if key not in RESERVED_FIELDS)
+
+def get_sealed_index(mapping: Dict[str, Any], shard_index: int) -> int:
+    """Index recorded in the header of a shard, which reused shards keep from the version that stored them."""
+    sealed = mapping.get(SEALED_INDEXES_FIELD)
+    return sealed[shard_index] if sealed and shard_index < len(sealed) else shard_index
+
+def get_erasure_stripes(mapping: Dict[str, Any]) -> List[List[int]]:
+    """Shard indexes of each erasure stripe, data shards first; older mappings are a single stripe."""
+    erasure = mapping[ERASURE_FIELD]
+    return stripe_shards(erasure["data_shards"], erasure["parity_shards"], erasure.get("stripe_width", erasure["data_shards"]))
+
+def get_hash_algo(mapping: Dict[str, Any]) -> str:
+    """Hash algorithm of a mapping's shard keys and chunk hashes; older mappings are SHA-256."""
+    return mapping.get(HASH_FIELD, LEGACY_HASH_ALGO)
+
+def get_chunk_hashes(mapping: Dict[str, Any]) -> List[str]:
+    """Return the plaintext chunk hashes of a content-defined upload, in file order."""
+    return [chunk_hash for chunk_hash, _ in mapping.get(CHUNKS_FIELD, [])]
@@ -0,0 +1,146 @@
+"""On-disk cache of reconstructed files for clients, keyed by file ID.
+
+File IDs are the hash of the file content (hashing.hash_file), so every hit is
+verified by rehashing the cached copy with the algorithm the ID names, and a
+reconstruction is only cached if it hashes to its file ID. The cache is kept
+under a byte budget by evicting the least recently used objects.
+"""
+from typing import BinaryIO, Dict, Optional
+import os
+import tempfile
+import threading
+from .hashing import format_id, hash_file, id_algo, new_hash
+from .config import OBJECT_CACHE_PATH, OBJECT_CACHE_BYTES
+
+PART_SUFFIX = ".part"
+
+class ObjectCacheWriter:
+    """Collects a reconstructed file and adds it to the cache once it verifies.
+
+    Used as a context manager; the object is discarded if the block raises.
+    """
+
+    def __init__(self, cache: "ObjectCache", file_id: str) -> None:
+        self.cache = cache
+        self.file_id = file_id
+        self.size = 0
+        self._algo = id_algo(file_id)
+        self._hash = new_hash(self._algo)
+        self._file = tempfile.NamedTemporaryFile(dir=cache.root, suffix=PART_SUFFIX, delete=False)
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> bool:
+        """Publish the object if it matches its file ID and fits the budget."""
+        self._file.close()
+        if format_id(self._hash.hexdigest(), self._algo) != self.file_id or self.size > self.cache.max_bytes:
+            os.remove(self._file.name)
+            return False
+        self.cache._add(self.file_id, self._file.name, self.size)
+        return True
+
+    def abort(self) -> None:
+        self._file.close()
+        os.remove(self._file.name)
+
+    def __enter__(self) -> "ObjectCacheWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+class ObjectCache:
+    """Verified, byte-bounded LRU cache of whole files on disk."""
+
+    def __init__(self, root: str = OBJECT_CACHE_PATH, max_bytes: int = OBJECT_CACHE_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name.endswith(PART_SUFFIX):
+                # Left behind by an interrupted download
+                os.remove(path)
+            else:
+                self._sizes[name] = os.path.getsize(path)
+                self.size += self._sizes[name]
+
+    def _path(self, file_id: str) -> str:
+        return os.path.join(self.root, file_id)
+
+    def __contains__(self, file_id: str) -> bool:
+        return file_id in self._sizes
+
+    def lookup(self, file_id: str) -> Optional[BinaryIO]:
+        """Open the verified cached object, or return None on a miss; the caller closes it.
+
+        The object is opened under the lock, so an eviction afterwards cannot take
+        it away from the caller, and rehashed outside it. A cached copy that no
+        longer hashes to its file ID is removed.
+        """
+        with self._lock:
+            if file_id not in self._sizes:
+                self.misses += 1
+                return None
+            cached_file = open(self._path(file_id), "rb")
+        verified = hash_file(cached_file, id_algo(file_id)) == file_id
+        with self._lock:
+            # The entry may have been evicted or replaced while it was hashed
+            current = file_id in self._sizes and os.path.samestat(os.fstat(cached_file.fileno()), os.stat(self._path(file_id)))
+            if not verified:
+                if current:
+                    self._remove(file_id)
+                self.misses += 1
+                cached_file.close()
+                return None
+            # Access time for LRU ordering
+            if current:
+                os.utime(self._path(file_id))
+            self.hits += 1
+        cached_file.seek(0)
+        return cached_file
+
+    def writer(self, file_id: str) -> ObjectCacheWriter:
+        """Start caching a reconstructed file as it is written."""
+        return ObjectCacheWriter(self, file_id)
+
+    def _add(self, file_id: str, temp_path: str, size: int) -> None:
+        with self._lock:
+            self._remove(file_id)
+            os.replace(temp_path, self._path(file_id))
+            self._sizes[file_id] = size
+            self.size += size
+            self._evict(keep=file_id)
+
+    def _remove(self, file_id: str) -> None:
+        size = self._sizes.pop(file_id, None)
+        if size is not None:
+            self.size -= size
+            os.remove(self._path(file_id))
+
+    def _evict(self, keep: str) -> None:
+        """Drop least recently used objects until the cache fits its budget."""
+        if self.size <= self.max_bytes:
+            return
+        by_age = sorted(self._sizes, key=lambda file_id: os.path.getmtime(self._path(file_id)))
+        for file_id in by_age:
+            if self.size <= self.max_bytes:
+                break
+            if file_id != keep:
+                self._remove(file_id)
+
+    def invalidate(self, file_id: str) -> None:
+        with self._lock:
+            self._remove(file_id)
@@ -0,0 +1,85 @@
+"""Worker pools for fanning independent per-shard work out across cores."""
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+import multiprocessing
+import os
+import threading
+from .config import PARALLEL_WORKERS, PARALLEL_BACKEND
+
+def resolve_workers(workers: Optional[int] = None) -> int:
+    """Return the worker count to use; None reads the config and 0 means one per core."""
+    workers = PARALLEL_WORKERS if workers is None else workers
+    return workers or os.cpu_count() or 1
+
+class InlineExecutor(Executor):
+    """Executor that runs every call synchronously in the caller."""
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+class SharedProcessPool(ProcessPoolExecutor):
+    """Process pool that outlives the with blocks it is used in.
+
+    Its workers start from a forkserver (spawn where that is unavailable) rather
+    than forking the caller, which in the servers has network and Flask threads.
+    """
+
+    def __exit__(self, *exc_info: Any) -> bool:
+        return False
+
+_process_pools: Dict[int, SharedProcessPool] = {}
+_process_pools_lock = threading.Lock()
+
+def _process_pool(workers: int) -> SharedProcessPool:
+    with _process_pools_lock:
+        if workers not in _process_pools:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _process_pools[workers] = SharedProcessPool(max_workers=workers, mp_context=multiprocessing.get_context(method))
+        return _process_pools[workers]
+
+def create_executor(workers: int, backend: str = PARALLEL_BACKEND) -> Executor:
+    """Create a "thread" pool, or return the shared "process" pool, with the given number of workers.
+
+    A single worker runs inline, so callers can use one code path for serial and
+    parallel work. Process pools are kept per worker count and reused, since
+    starting one costs far more than the shards of a single file take to encode.
+    """
+    if workers <= 1:
+        return InlineExecutor()
+    if backend == "process":
+        return _process_pool(workers)
+    if backend == "thread":
+        return ThreadPoolExecutor(max_workers=workers)
+    raise ValueError(f"Unknown parallel backend: {backend}")
+
+def shippable(executor: Executor, data: Any) -> Any:
+    """Return data in a form executor can hand to its workers.
+
+    Process pools pickle their arguments, which memoryviews do not support and which
+    copies them anyway; thread pools and inline calls share the buffer.
+    """
+    return bytes(data) if isinstance(data, memoryview) and isinstance(executor, ProcessPoolExecutor) else data
+
+def ordered_map(executor: Executor, func: Callable[..., Any], items: Iterable[Tuple], max_in_flight: int) -> Iterator[Any]:
+    """Apply func to each argument tuple on the executor and yield results in input order.
+
+    Items are pulled lazily and at most max_in_flight calls are pending at once, so a
+    streaming producer is never read far ahead of its consumer.
+    """
+    in_flight = deque()
+    try:
+        for args in items:
+            in_flight.append(executor.submit(func, *args))
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
@@ -0,0 +1,127 @@
+"""Upload planning: how many shards of what size, with how much parity, on which peers.
+
+The shard count follows the file rather than the peer count. Small files get a
+few shards of at least MIN_SHARD_SIZE bytes, so 500 peers do not mean 500 tiny
+deals. Large files get shards no bigger than MAX_SHARD_SIZE, or than what fits
+the streaming memory budget, and peers then hold several shards each. Shards are
+whole Reed-Solomon blocks, so the plan uses the striped layout. Erasure parity
+is added per stripe of data shards small enough for retrieval to rebuild in
+memory, so a file is rebuilt one stripe at a time.
+"""
+import math
+from typing import List, NamedTuple, Optional
+from .erasure import MAX_SHARDS
+from .parallel import resolve_workers
+from .redundancy import encoded_size, BLOCK_SIZE
+from .config import DEFAULT_PARITY_SHARDS, MIN_SHARD_SIZE, MAX_SHARD_SIZE, PEER_CAPACITY, PARALLEL_MIN_SIZE, STREAM_MEMORY_LIMIT
+
+class UploadPlan(NamedTuple):
+    file_size: int
+    peer_count: int
+    shard_size: int  # Encoded bytes per data shard, a multiple of BLOCK_SIZE
+    data_shards: int
+    parity_shards: int  # Per stripe
+    stripe_width: int  # Data shards per erasure stripe
+    reasons: List[str]  # Why the sizes were chosen, in the order they were decided
+
+    @property
+    def stripes(self) -> int:
+        return math.ceil(self.data_shards / self.stripe_width)
+
+    @property
+    def total_shards(self) -> int:
+        return self.data_shards + self.parity_shards * self.stripes
+
+    @property
+    def shards_per_peer(self) -> int:
+        """Most shards any one peer holds."""
+        return math.ceil(self.total_shards / self.peer_count)
+
+    def peer_for(self, shard_index: int) -> int:
+        """Peer that stores a shard; consecutive shards of a stripe go to different peers.
+
+        Each stripe starts where the previous one left off, so stripes spread over all peers.
+        """
+        if shard_index < self.data_shards or not self.parity_shards:
+            stripe, position = divmod(shard_index, self.stripe_width)
+        else:
+            stripe, parity_index = divmod(shard_index - self.data_shards, self.parity_shards)
+            position = self.stripe_width + parity_index
+        return (stripe * (self.stripe_width + self.parity_shards) + position) % self.peer_count
+
+    @property
+    def chunk_stripe_width(self) -> int:
+        """Data shards per stripe of a content-defined upload that uses this plan's parity.
+
+        Chunks are far smaller than planned shards, so their stripes are only as
+        wide as the peers allow, keeping every shard of a stripe on its own peer.
+        """
+        return max(1, min(self.peer_count - self.parity_shards, MAX_SHARDS - self.parity_shards))
+
+    def for_chunks(self, data_shards: int) -> "UploadPlan":
+        """The plan with the data shards and stripe width of a content-defined upload, for placing its shards."""
+        return self._replace(data_shards=data_shards, stripe_width=self.chunk_stripe_width)
+
+    def explain(self) -> str:
+        parity = f"{self.parity_shards} parity shards" if self.stripes < 2 else f"{self.parity_shards} parity shards per stripe of {self.stripe_width}"
+        summary = (f"{self.data_shards} data + {parity} of {self.shard_size} bytes "
+                   f"over {self.peer_count} peers (up to {self.shards_per_peer} per peer)")
+        return "\n".join([summary] + [f"  - {reason}" for reason in self.reasons])
+
+def _align(size: int) -> int:
+    """Round up to whole Reed-Solomon blocks."""
+    return max(1, math.ceil(size / BLOCK_SIZE)) * BLOCK_SIZE
+
+def plan_upload(file_size: int, peer_count: int, parity_shards: int = DEFAULT_PARITY_SHARDS, peer_capacity: int = PEER_CAPACITY, min_shard_size: int = MIN_SHARD_SIZE, max_shard_size: int = MAX_SHARD_SIZE, max_memory: Optional[int] = STREAM_MEMORY_LIMIT, workers: Optional[int] = None) -> UploadPlan:
+    """Choose shard size, shard count and parity for a file of file_size bytes.
+
+    peer_capacity is the most bytes one peer may hold for this file (0 for no
+    limit). workers and max_memory should match the DistributeStream the plan
+    is used with, since every shard in flight is held in memory.
+    """
+    if peer_count < 1:
+        raise ValueError("An upload needs at least one peer")
+    reasons = []
+    encoded = encoded_size(file_size)
+    if parity_shards > peer_count - 1:
+        parity_shards = peer_count - 1
+        reasons.append(f"parity limited to {parity_shards} so every shard of a stripe is on a different peer")
+
+    # One shard per peer when the shards come out at a sensible size
+    data_shards = max(1, peer_count - parity_shards)
+    shard_size = _align(math.ceil(encoded / data_shards))
+    reasons.append(f"{encoded} encoded bytes over {data_shards} data peers gives {shard_size}-byte shards")
+
+    # Each shard is a deal and a proof stream, so small files use fewer, larger shards
+    raised = _align(min(min_shard_size, encoded))
+    if raised > shard_size:
+        shard_size = raised
+        reasons.append(f"raised to {shard_size} bytes (MIN_SHARD_SIZE {min_shard_size}) to avoid tiny shards")
+
+    # Every shard in flight, plus parity, has to fit the streaming memory budget
+    workers = 1 if file_size < PARALLEL_MIN_SIZE else resolve_workers(workers)
+    in_flight = 2 * workers if workers > 1 else 1
+    memory_cap = max_memory // (2 + 2 * in_flight + parity_shards) if max_memory else max_shard_size
+    largest = max(BLOCK_SIZE, min(max_shard_size, memory_cap) // BLOCK_SIZE * BLOCK_SIZE)
+    if shard_size > largest:
+        shard_size = largest
+        limit = f"MAX_SHARD_SIZE {max_shard_size}" if max_shard_size <= memory_cap else f"{in_flight} shards in flight within {max_memory} bytes of memory"
+        reasons.append(f"lowered to {shard_size} bytes ({limit}), so peers hold several shards each")
+
+    # Retrieval holds a stripe's data shards to rebuild it, and erasure coefficients
+    # address at most MAX_SHARDS shards, so longer files get parity per stripe
+    data_shards = math.ceil(encoded / shard_size)
+    stripe_width = MAX_SHARDS - parity_shards
+    if max_memory:
+        stripe_width = max(1, min(stripe_width, max_memory // shard_size))
+    if parity_shards and data_shards > stripe_width:
+        limit = f"{max_memory} bytes of memory" if stripe_width < MAX_SHARDS - parity_shards else f"{MAX_SHARDS} erasure-coded shards"
+        reasons.append(f"parity added per stripe of {stripe_width} data shards ({limit}), so files are rebuilt a stripe at a time")
+    stripe_width = min(stripe_width, max(1, data_shards))
+
+    if not data_shards:
+        parity_shards = 0
+    plan = UploadPlan(file_size, peer_count, shard_size, data_shards, parity_shards, stripe_width, reasons)
+    if peer_capacity and plan.shards_per_peer * shard_size > peer_capacity:
+        raise ValueError(f"Upload needs {plan.shards_per_peer * shard_size} bytes on some peer, above its capacity of {peer_capacity} bytes")
+    return plan
@@ -1,12 +1,54 @@
 import hashlib
 import hmac
+import struct
+from typing import Optional
 
 from .config import DEFAULT_PROOF_HASH_ALGO
+from .hashing import hmac_digestmod, keyed_digest
 
-def generate_proof(data: bytes, salt: bytes, key: bytes) -> str:
-    """Generate a proof of data integrity using HMAC."""
-    return hmac.new(key, data + salt, getattr(hashlib, DEFAULT_PROOF_HASH_ALGO)).hexdigest()
+SALT_SIZE = 16  # Bytes of each challenge salt
+CHALLENGE_SEED_SIZE = 32  # Bytes of the per-file secret the challenge salts are derived from
+PROOF_BLOCK_SIZE = 65536  # Bytes of a shard fed to every timestep's HMAC before the next block is read
+
+def proof_size(algo: Optional[str] = None) -> int:
+    """Bytes of a binary proof made with algo (the configured proof algorithm by default)."""
+    return hmac.new(b"", digestmod=hmac_digestmod(algo or DEFAULT_PROOF_HASH_ALGO)).digest_size
+
+PROOF_SIZE = proof_size()  # Bytes of a binary proof with the configured algorithm
+
+def generate_proof(data: bytes, salt: bytes, key: bytes, algo: Optional[str] = None) -> str:
+    """Generate a proof of data integrity using HMAC with algo (DEFAULT_PROOF_HASH_ALGO by default)."""
+    # Feed data and salt separately instead of hashing a concatenated copy of the shard
+    return keyed_digest(key, data, salt, algo or DEFAULT_PROOF_HASH_ALGO).hex()
 
 def verify_proof(expected_proof: str, proof: str) -> bool:
     """Verify a proof of data integrity."""
-    return hmac.compare_digest(expected_proof, proof)
\ No newline at end of file
+    return hmac.compare_digest(expected_proof, proof)
+
+def derive_salt(seed: bytes, shard_index: int, timestep: int) -> bytes:
+    """Challenge salt for a shard at a timestep, derived from the file's secret seed."""
+    return hmac.new(seed, struct.pack("<QQ", shard_index, timestep), hashlib.sha256).digest()[:SALT_SIZE]
+
+def expected_proofs(data: bytes, seed: bytes, shard_index: int, timesteps: int, algo: Optional[str] = None) -> bytes:
+    """Precompute the proofs of a shard for every timestep, packed proof_size(algo) bytes each.
+
+    Every timestep's HMAC is keyed by its own salt, so each still hashes the whole
+    shard, but they are fed together one PROOF_BLOCK_SIZE block at a time and the
+    shard is only read from memory once.
+    """
+    digestmod = hmac_digestmod(algo or DEFAULT_PROOF_HASH_ALGO)
+    salts = [derive_salt(seed, shard_index, timestep) for timestep in range(timesteps)]
+    macs = [hmac.new(salt, digestmod=digestmod) for salt in salts]
+    with memoryview(data) as view:
+        for start in range(0, len(view), PROOF_BLOCK_SIZE):
+            block = view[start:start + PROOF_BLOCK_SIZE]
+            for mac in macs:
+                mac.update(block)
+    for mac, salt in zip(macs, salts):
+        mac.update(salt)
+    return b"".join(mac.digest() for mac in macs)
+
+def proof_at(proofs: bytes, timestep: int, algo: Optional[str] = None) -> str:
+    """Hex proof for a timestep out of an expected_proofs array, as storage nodes send it."""
+    size = proof_size(algo)
+    return proofs[timestep * size:(timestep + 1) * size].hex()
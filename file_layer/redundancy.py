@@ -1,8 +1,33 @@
-from reedsolo import RSCodec
-from .config import DEFAULT_ERROR_CORRECTION
+import functools
+import math
+import zlib
+import numpy as np
+from typing import Optional, Tuple
+from reedsolo import RSCodec, ReedSolomonError
+from .sharding import merge_data
+from .config import DEFAULT_ERROR_CORRECTION, RS_CODEC
+
+def create_codec(nsym: int = DEFAULT_ERROR_CORRECTION, codec: str = RS_CODEC):
+    """Create the configured Reed-Solomon codec; both produce identical output."""
+    if codec == "numpy":
+        from .rs_codec import NumpyRSCodec
+        return NumpyRSCodec(nsym)
+    if codec == "reedsolo":
+        return RSCodec(nsym)
+    raise ValueError(f"Unknown Reed-Solomon codec: {codec}")
 
 # Create Reed-Solomon codec
-rs = RSCodec(DEFAULT_ERROR_CORRECTION)
+rs = create_codec()
+
+# Reed-Solomon codeword length and the number of data bytes each codeword carries.
+# Encoding is block-local, so data fed in multiples of MESSAGE_SIZE encodes identically
+# whether it is passed in one call or in several.
+BLOCK_SIZE = rs.nsize
+MESSAGE_SIZE = rs.nsize - rs.nsym
+
+def encoded_size(size: int) -> int:
+    """Return the length of `size` bytes after Reed-Solomon encoding."""
+    return size + math.ceil(size / MESSAGE_SIZE) * rs.nsym
 
 def encode_file(data: bytes) -> bytes:
     """Encode the entire file with Reed-Solomon"""
@@ -12,10 +37,61 @@ def encode_shard(shard: bytes) -> bytes:
     """Encode each shard with Reed-Solomon encoding """
     return rs.encode(shard)
 
+@functools.lru_cache(maxsize=None)
+def codec_for(nsym: int):
+    """Codec for data encoded with nsym parity symbols, such as shards written under an older config."""
+    return rs if nsym == rs.nsym else create_codec(nsym)
+
+def _decode_message(data: bytes, codec=rs) -> bytes:
+    """Strip parity from data; NumpyRSCodec skips the repaired codewords, which are not used."""
+    decode_message = getattr(codec, "decode_message", None)
+    return decode_message(data) if decode_message else codec.decode(data)[0]
+
 def decode_file(shards: list[bytes]) -> bytes:
     """Decode an entire file from Reed-Solomon encoded shards."""
-    return rs.decode(b''.join(shards))[0]
+    return _decode_message(shards[0] if len(shards) == 1 else merge_data(shards))
 
 def decode_shard(shard_data: bytes) -> bytes:
     """Decode a single shard using Reed-Solomon encoding."""
-    return rs.decode(shard_data)[0]
+    return _decode_message(shard_data)
+
+
+def shard_checksum(data: bytes) -> int:
+    """CRC-32 of a shard's systematic data, the bytes shard-level encoding protects."""
+    return zlib.crc32(data)
+
+def strip_parity(data: bytes, nsym: Optional[int] = None) -> bytearray:
+    """Drop the parity bytes of every codeword without checking or correcting anything.
+
+    Only valid for data known to be intact, such as a shard whose checksum matched.
+    nsym defaults to the configured number of parity symbols.
+    """
+    nsym = rs.nsym if nsym is None else nsym
+    message_size = BLOCK_SIZE - nsym
+    codewords = np.frombuffer(data, dtype=np.uint8)
+    full = len(codewords) // BLOCK_SIZE
+    tail = codewords[full * BLOCK_SIZE:][:-nsym]
+    stripped = bytearray(full * message_size + len(tail))
+    out = np.frombuffer(stripped, dtype=np.uint8)
+    out[:full * message_size].reshape(full, message_size)[...] = codewords[:full * BLOCK_SIZE].reshape(full, BLOCK_SIZE)[:, :message_size]
+    out[full * message_size:] = tail
+    return stripped
+
+def decode_checked_shard(shard_data: bytes, checksum: Optional[int], nsym: Optional[int] = None) -> Tuple[bytes, str]:
+    """Decode a shard, only running Reed-Solomon correction if its checksum fails.
+
+    Returns the data and how it was decoded: "clean" if the systematic data matched
+    the checksum and parity was just stripped, "corrected" if the full decode ran and
+    repaired it, or "unchecked" if there was no checksum to compare against. nsym
+    is the number of parity symbols the shard was encoded with, if it is known.
+    """
+    codec = codec_for(rs.nsym if nsym is None else nsym)
+    if checksum is None:
+        return _decode_message(shard_data, codec), "unchecked"
+    stripped = strip_parity(shard_data, codec.nsym)
+    if shard_checksum(stripped) == checksum:
+        return stripped, "clean"
+    decoded = _decode_message(shard_data, codec)
+    if shard_checksum(decoded) != checksum:
+        raise ReedSolomonError("Shard does not match its checksum after correction")
+    return decoded, "corrected"
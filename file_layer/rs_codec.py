@@ -0,0 +1,269 @@
+"""NumPy-vectorized Reed-Solomon codec over GF(256).
+
+`NumpyRSCodec` is a drop-in replacement for `reedsolo.RSCodec` with its default
+field parameters (primitive polynomial 0x11d, generator 2, first consecutive root 0).
+Encoding is byte-identical. Encoding and syndrome checks run over all 255-byte
+blocks of the input at once using log/antilog and multiplication tables; only
+blocks whose syndromes are non-zero go through the per-block Berlekamp-Massey
+correction. Erasure decoding (known errata positions) is delegated to reedsolo.
+
+Inputs of up to TABLE_BLOCKS codewords, such as single shards, are coded with
+per-position tables of each byte's contribution to the parity and syndromes
+(about 1.3 MB for nsym=10), one lookup per byte, since a column-by-column pass
+costs the same per column whether it covers one block or thousands.
+"""
+from itertools import zip_longest
+from typing import Dict, List, Tuple
+import numpy as np
+from reedsolo import ReedSolomonError, RSCodec
+
+PRIM = 0x11d  # Primitive polynomial of GF(256)
+FIELD_CHARAC = 255  # Number of non-zero field elements
+TABLE_BLOCKS = 256  # Inputs of up to this many codewords are coded by table lookup rather than column by column
+
+def _init_tables() -> Tuple[np.ndarray, np.ndarray]:
+    """Build the antilog (doubled to skip modulo reductions) and log tables."""
+    gf_exp = np.zeros(2 * FIELD_CHARAC, dtype=np.uint8)
+    gf_log = np.zeros(FIELD_CHARAC + 1, dtype=np.intp)
+    x = 1
+    for i in range(FIELD_CHARAC):
+        gf_exp[i] = x
+        gf_log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= PRIM
+    gf_exp[FIELD_CHARAC:] = gf_exp[:FIELD_CHARAC]
+    return gf_exp, gf_log
+
+GF_EXP, GF_LOG = _init_tables()
+
+# Full 256x256 multiplication table, GF_MUL[a, b] == a * b
+GF_MUL = GF_EXP[GF_LOG[:, None] + GF_LOG[None, :]]
+GF_MUL[0, :] = 0
+GF_MUL[:, 0] = 0
+
+# Python-int copies for the scalar correction path
+_EXP = GF_EXP.tolist()
+_LOG = GF_LOG.tolist()
+
+def gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+def gf_div(a: int, b: int) -> int:
+    if b == 0:
+        raise ZeroDivisionError("division by zero in GF(256)")
+    if a == 0:
+        return 0
+    return _EXP[(_LOG[a] - _LOG[b]) % FIELD_CHARAC]
+
+def gf_pow_alpha(power: int) -> int:
+    """Return the generator raised to `power`."""
+    return _EXP[power % FIELD_CHARAC]
+
+def _poly_eval(poly: List[int], x: int) -> int:
+    """Evaluate a lowest-degree-first polynomial at x."""
+    y = 0
+    for coef in reversed(poly):
+        y = gf_mul(y, x) ^ coef
+    return y
+
+class NumpyRSCodec:
+    """Reed-Solomon codec with the same `encode`/`decode` interface as `reedsolo.RSCodec`."""
+
+    def __init__(self, nsym: int = 10, nsize: int = 255) -> None:
+        if not 0 < nsym < nsize <= FIELD_CHARAC:
+            raise ValueError(f"Unsupported Reed-Solomon parameters nsym={nsym}, nsize={nsize}")
+        self.nsym = nsym
+        self.nsize = nsize
+
+        # Generator polynomial prod(x - alpha^i), highest degree first like reedsolo
+        gen = [1]
+        for i in range(nsym):
+            root = gf_pow_alpha(i)
+            gen = [a ^ gf_mul(b, root) for a, b in zip_longest(gen + [0], [0] + gen, fillvalue=0)]
+        self.gen = gen
+
+        # _gen_mul[c] is the generator tail scaled by c, one row per field element
+        self._gen_mul = GF_MUL[:, gen[1:]].copy()
+        # Flattened tables multiplying syndrome column i by alpha^i
+        alphas = [gf_pow_alpha(i) for i in range(nsym)]
+        self._alpha_mul = GF_MUL[:, alphas].T.ravel().copy()
+        self._alpha_offsets = np.arange(nsym, dtype=np.intp) * 256
+        self._erasure_codec = None
+
+        # Parity and syndromes are linear in the codeword bytes, so a few blocks are
+        # cheaper as one lookup per byte than as one pass per column: _parity_table[i, v]
+        # is the parity of a message holding only v at position i, _syndrome_table[i, v]
+        # the syndromes of a codeword holding only v at position i
+        message_size = nsize - nsym
+        units = np.zeros((message_size, nsize), dtype=np.uint8)
+        self._lfsr_encode(np.eye(message_size, dtype=np.uint8), units)
+        self._parity_table = GF_MUL[:, units[:, message_size:]].transpose(1, 0, 2).copy()
+        powers = (np.arange(nsize - 1, -1, -1)[:, None] * np.arange(nsym)[None, :]) % FIELD_CHARAC
+        self._syndrome_table = GF_MUL[:, GF_EXP[powers]].transpose(1, 0, 2).copy()
+
+    def _blocks(self, data: np.ndarray, size: int) -> List[np.ndarray]:
+        """Split data into a (blocks, size) array plus a one-row array for the tail."""
+        full = len(data) // size * size
+        parts = []
+        if full:
+            parts.append(data[:full].reshape(-1, size))
+        if full < len(data):
+            parts.append(data[full:].reshape(1, -1))
+        return parts
+
+    def _encode_blocks(self, blocks: np.ndarray, out: np.ndarray) -> None:
+        """Systematically encode every row into out."""
+        if blocks.shape[0] > TABLE_BLOCKS:
+            self._lfsr_encode(blocks, out)
+            return
+        # A message shorter than nsize - nsym encodes like one with leading zeros
+        message_size = self.nsize - self.nsym
+        positions = np.arange(message_size - blocks.shape[1], message_size)
+        out[:, :-self.nsym] = blocks
+        out[:, -self.nsym:] = np.bitwise_xor.reduce(self._parity_table[positions, blocks], axis=1)
+
+    def _lfsr_encode(self, blocks: np.ndarray, out: np.ndarray) -> None:
+        """Systematically encode every row into out with an LFSR run over all rows at once."""
+        remainder = np.zeros((blocks.shape[0], self.nsym), dtype=np.uint8)
+        for column in blocks.T:
+            coef = column ^ remainder[:, 0]
+            remainder[:, :-1] = remainder[:, 1:]
+            remainder[:, -1] = 0
+            remainder ^= self._gen_mul[coef]
+        out[:, :-self.nsym] = blocks
+        out[:, -self.nsym:] = remainder
+
+    def _syndromes(self, blocks: np.ndarray) -> np.ndarray:
+        """Evaluate every row at alpha^0 .. alpha^(nsym-1) with Horner's rule."""
+        if blocks.shape[0] <= TABLE_BLOCKS:
+            # Leading zeros do not change the syndromes of a shorter codeword
+            positions = np.arange(self.nsize - blocks.shape[1], self.nsize)
+            return np.bitwise_xor.reduce(self._syndrome_table[positions, blocks], axis=1)
+        synd = np.zeros((blocks.shape[0], self.nsym), dtype=np.uint8)
+        for column in blocks.T:
+            synd = self._alpha_mul[synd + self._alpha_offsets] ^ column[:, None]
+        return synd
+
+    def _correct(self, msg: List[int], synd: List[int]) -> Tuple[List[int], List[int]]:
+        """Correct one codeword from its syndromes (Berlekamp-Massey, Chien search, Forney)."""
+        nsym = self.nsym
+        n = len(msg)
+
+        # Berlekamp-Massey: error locator polynomial, lowest degree first
+        err_loc, prev_loc = [1], [1]
+        errors, shift, prev_discrepancy = 0, 1, 1
+        for r in range(nsym):
+            discrepancy = synd[r]
+            for i in range(1, min(len(err_loc), r + 1)):
+                discrepancy ^= gf_mul(err_loc[i], synd[r - i])
+            if discrepancy == 0:
+                shift += 1
+                continue
+            scale = gf_div(discrepancy, prev_discrepancy)
+            update = [0] * shift + [gf_mul(scale, coef) for coef in prev_loc]
+            new_loc = [a ^ b for a, b in zip_longest(err_loc, update, fillvalue=0)]
+            if 2 * errors <= r:
+                prev_loc, errors, prev_discrepancy, shift = err_loc, r + 1 - errors, discrepancy, 1
+            else:
+                shift += 1
+            err_loc = new_loc
+        while len(err_loc) > 1 and err_loc[-1] == 0:
+            err_loc.pop()
+        if 2 * errors > nsym or len(err_loc) - 1 != errors:
+            raise ReedSolomonError("Too many errors to correct")
+
+        # Chien search: byte j sits at power n-1-j, so it is in error if the locator vanishes at alpha^-(n-1-j)
+        err_pos = [j for j in range(n) if _poly_eval(err_loc, gf_pow_alpha(-(n - 1 - j))) == 0]
+        if len(err_pos) != errors:
+            raise ReedSolomonError("Could not locate errors")
+
+        # Forney: error evaluator omega = synd * err_loc mod x^nsym, magnitude X * omega(X^-1) / err_loc'(X^-1)
+        omega = [0] * nsym
+        for i, s in enumerate(synd):
+            for k, coef in enumerate(err_loc[:nsym - i]):
+                omega[i + k] ^= gf_mul(s, coef)
+        corrected = list(msg)
+        for j in err_pos:
+            x_inv = gf_pow_alpha(-(n - 1 - j))
+            derivative = 0
+            for i in range(1, len(err_loc), 2):
+                derivative ^= gf_mul(err_loc[i], gf_pow_alpha(-(n - 1 - j) * (i - 1)))
+            if derivative == 0:
+                raise ReedSolomonError("Could not find error magnitude")
+            corrected[j] ^= gf_div(gf_mul(gf_pow_alpha(n - 1 - j), _poly_eval(omega, x_inv)), derivative)
+
+        check = self._syndromes(np.array([corrected], dtype=np.uint8))
+        if check.any():
+            raise ReedSolomonError("Could not correct message")
+        return corrected, err_pos
+
+    def encode(self, data: bytes, nsym: int = None) -> bytearray:
+        """Encode data, chunked into nsize-nsym byte messages, with Reed-Solomon parity.
+
+        data can be any buffer, such as a memoryview slice; it is read in place and
+        the codewords are written straight into the returned bytearray.
+        """
+        if nsym and nsym != self.nsym:
+            raise ValueError(f"Codec was built for nsym={self.nsym}")
+        msg = np.frombuffer(data, dtype=np.uint8)
+        blocks = self._blocks(msg, self.nsize - self.nsym)
+        encoded = bytearray(sum(part.size + part.shape[0] * self.nsym for part in blocks))
+        out = np.frombuffer(encoded, dtype=np.uint8)
+        offset = 0
+        for part in blocks:
+            size = part.size + part.shape[0] * self.nsym
+            self._encode_blocks(part, out[offset:offset + size].reshape(part.shape[0], -1))
+            offset += size
+        return encoded
+
+    def _decode(self, data: bytes) -> Tuple[bytearray, bytearray, Dict[int, List[int]]]:
+        """Repair and strip parity, writing messages straight into the returned bytearray.
+
+        Also returns the errata positions and the corrected codeword of every
+        repaired block, keyed by block number.
+        """
+        codewords = np.frombuffer(data, dtype=np.uint8)
+        blocks = self._blocks(codewords, self.nsize)
+        decoded = bytearray(sum(part.shape[0] * max(0, part.shape[1] - self.nsym) for part in blocks))
+        out = np.frombuffer(decoded, dtype=np.uint8)
+        errata_pos, corrections = bytearray(), {}
+        offset = row_offset = 0
+        for part in blocks:
+            messages = part[:, :-self.nsym]
+            target = out[offset:offset + messages.size].reshape(messages.shape)
+            target[...] = messages
+            synd = self._syndromes(part)
+            for row in np.flatnonzero(synd.any(axis=1)):
+                corrected, positions = self._correct(part[row].tolist(), synd[row].tolist())
+                target[row] = corrected[:-self.nsym]
+                corrections[row_offset + int(row)] = corrected
+                errata_pos.extend(positions)
+            offset += messages.size
+            row_offset += part.shape[0]
+        return decoded, errata_pos, corrections
+
+    def decode(self, data: bytes, nsym: int = None, erase_pos: List[int] = None, only_erasures: bool = False) -> Tuple[bytearray, bytearray, bytearray]:
+        """Repair and strip parity from nsize byte chunks.
+
+        Returns the decoded message, the repaired message with parity and the
+        errata positions, like `reedsolo.RSCodec.decode`. Calls with erase_pos or
+        only_erasures go to reedsolo, which produces the same output.
+        """
+        if nsym and nsym != self.nsym:
+            raise ValueError(f"Codec was built for nsym={self.nsym}")
+        if erase_pos or only_erasures:
+            if self._erasure_codec is None:
+                self._erasure_codec = RSCodec(self.nsym, nsize=self.nsize)
+            return self._erasure_codec.decode(data, erase_pos=erase_pos, only_erasures=only_erasures)
+        decoded, errata_pos, corrections = self._decode(data)
+        decoded_full = bytearray(data)
+        for row, corrected in corrections.items():
+            decoded_full[row * self.nsize:row * self.nsize + len(corrected)] = bytes(corrected)
+        return decoded, decoded_full, errata_pos
+
+    def decode_message(self, data: bytes) -> bytearray:
+        """Return only the decoded message of `decode`, skipping the copy of the repaired codewords."""
+        return self._decode(data)[0]
@@ -0,0 +1,68 @@
+"""Byte-bounded LRU cache of shard bytes for storage nodes."""
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+import threading
+from .config import SHARD_CACHE_BYTES
+
+class ShardCache:
+    """Least-recently-used cache holding at most max_bytes of shard data.
+
+    Counts hits, misses and evictions so the byte budget can be tuned. Shards
+    larger than the whole budget are never cached.
+    """
+
+    def __init__(self, max_bytes: int = SHARD_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: Hashable, data: bytes) -> None:
+        with self._lock:
+            self._discard(key)
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop key, e.g. because the shard was overwritten or deleted."""
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key: Hashable) -> None:
+        data = self._entries.pop(key, None)
+        if data is not None:
+            self.size -= len(data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Counters and current size, for reporting."""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self._entries), "bytes": self.size}
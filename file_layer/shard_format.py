@@ -0,0 +1,64 @@
+"""Self-describing container for the shards sent to storage peers.
+
+Every shard starts with a fixed header in front of the encrypted payload:
+
+    magic (4s) | version (B) | shard index (I) | RS block size (B) | RS parity symbols (B)
+    | payload length (Q) | systematic data crc32 (I) | header crc32 (I)
+
+The header is parsed with one struct unpack, so a shard can be placed and
+sanity-checked without hashing its body. The data checksum is the CRC-32 of the
+shard's systematic data, as in the CHECKSUMS_FIELD of the shard mapping. Shards
+written before the header existed are plain encrypted payloads and are still
+read as such.
+"""
+from typing import NamedTuple, Optional, Tuple
+import struct
+import zlib
+
+SHARD_MAGIC = b"BSF1"
+SHARD_FORMAT_VERSION = 1
+SHARD_HEADER = struct.Struct("<4sBIBBQI")  # magic, version, shard index, RS block size, RS parity symbols, payload length, data crc32
+HEADER_CHECKSUM = struct.Struct("<I")  # crc32 of the packed header fields
+HEADER_SIZE = SHARD_HEADER.size + HEADER_CHECKSUM.size
+
+class ShardHeader(NamedTuple):
+    shard_index: int
+    block_size: int  # Shard-level Reed-Solomon codeword length
+    parity_symbols: int  # Shard-level Reed-Solomon parity bytes per codeword
+    payload_length: int
+    checksum: int  # CRC-32 of the systematic data
+    version: int = SHARD_FORMAT_VERSION
+
+def pack_shard(header: ShardHeader, payload: bytes) -> bytearray:
+    """Prefix an encrypted payload with its header."""
+    fields = SHARD_HEADER.pack(SHARD_MAGIC, header.version, header.shard_index, header.block_size, header.parity_symbols, header.payload_length, header.checksum)
+    shard = bytearray(HEADER_SIZE + len(payload))
+    shard[:SHARD_HEADER.size] = fields
+    shard[SHARD_HEADER.size:HEADER_SIZE] = HEADER_CHECKSUM.pack(zlib.crc32(fields))
+    shard[HEADER_SIZE:] = payload
+    return shard
+
+def read_header(shard: bytes) -> Optional[ShardHeader]:
+    """Return the header of a shard, or None for a legacy shard without one.
+
+    Raises ValueError for a shard that has a header which is damaged, of an
+    unknown version or does not match the shard's length.
+    """
+    if len(shard) < HEADER_SIZE or shard[:len(SHARD_MAGIC)] != SHARD_MAGIC:
+        return None
+    view = memoryview(shard)
+    fields = view[:SHARD_HEADER.size]
+    if HEADER_CHECKSUM.unpack_from(view, SHARD_HEADER.size)[0] != zlib.crc32(fields):
+        # Four random payload bytes can match the magic, but not the header checksum as well
+        return None
+    _, version, shard_index, block_size, parity_symbols, payload_length, checksum = SHARD_HEADER.unpack(fields)
+    if version != SHARD_FORMAT_VERSION:
+        raise ValueError(f"Unsupported shard format version {version}")
+    if payload_length != len(shard) - HEADER_SIZE:
+        raise ValueError(f"Shard {shard_index} is truncated: {len(shard) - HEADER_SIZE} of {payload_length} payload bytes")
+    return ShardHeader(shard_index, block_size, parity_symbols, payload_length, checksum, version)
+
+def parse_shard(shard: bytes) -> Tuple[Optional[ShardHeader], memoryview]:
+    """Split a shard into its header (None for legacy shards) and a view of its payload."""
+    header = read_header(shard)
+    return header, memoryview(shard)[HEADER_SIZE if header else 0:]
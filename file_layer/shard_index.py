@@ -0,0 +1,208 @@
+"""Persistent index of the shards a storage node holds.
+
+Maps (file_id, shard_index) to where the shard lives in the segment files, its
+size, checksum and deal expiry, and keeps running totals so inventory queries
+(bytes held, shards per file) are O(1). The index is saved as a compact binary
+snapshot, so a restart loads it and only replays records written after it.
+"""
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+import heapq
+import os
+import struct
+import zlib
+
+SNAPSHOT_MAGIC = b"BSIX"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<4sBIIIII")  # magic, version, active segment, segment, shard, tombstone and shadowed counts
+SEGMENT_ENTRY = struct.Struct("<IQ")  # segment, size
+SHARD_ENTRY = struct.Struct("<HIIQIId")  # file ID length, shard index, segment, offset, length, crc32, expiry
+TOMBSTONE_ENTRY = struct.Struct("<HIIi")  # file ID length, shard index, tombstone segment, shadowed segment or -1
+SHADOWED_ENTRY = struct.Struct("<HII")  # file ID length, shard index, oldest shadowed segment
+RECORD_OVERHEAD = 27  # Bytes a segment record header adds (shard_store.RECORD_HEADER)
+
+ShardKey = Tuple[str, int]
+
+class ShardEntry(NamedTuple):
+    segment: int
+    offset: int  # Offset of the shard bytes within the segment
+    length: int
+    checksum: int  # crc32 of the file ID and shard bytes
+    expires_at: float = 0.0  # Unix time the storage deal ends, 0 if unknown
+
+def record_size(key: ShardKey, length: int) -> int:
+    """Bytes a record for key with a length-byte shard takes in a segment."""
+    return RECORD_OVERHEAD + len(key[0].encode()) + length
+
+class ShardIndex:
+    """In-memory shard index with O(1) inventory totals and snapshot persistence."""
+
+    def __init__(self) -> None:
+        self.entries: Dict[ShardKey, ShardEntry] = {}
+        # Deleted keys whose tombstone must survive compaction while a segment that
+        # may hold an older record still exists: key -> (tombstone segment, oldest
+        # shadowed segment)
+        self.tombstones: Dict[ShardKey, Tuple[int, Optional[int]]] = {}
+        # Oldest segment that may still hold an overwritten record of a live key
+        self.shadowed: Dict[ShardKey, int] = {}
+        self.segment_sizes: Dict[int, int] = {}
+        self.segment_live: Dict[int, int] = {}
+        self.active_segment = 0
+        self.total_bytes = 0
+        self._files: Dict[str, Set[int]] = {}
+        self._file_bytes: Dict[str, int] = {}
+        self._expiry: List[Tuple[float, ShardKey]] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: ShardKey) -> bool:
+        return key in self.entries
+
+    def get(self, key: ShardKey) -> Optional[ShardEntry]:
+        return self.entries.get(key)
+
+    def add_segment(self, segment: int) -> None:
+        self.segment_sizes.setdefault(segment, 0)
+        self.segment_live.setdefault(segment, 0)
+
+    def drop_segment(self, segment: int) -> None:
+        del self.segment_sizes[segment], self.segment_live[segment]
+
+    def put(self, key: ShardKey, entry: ShardEntry) -> None:
+        """Point key at a newly written record, replacing any earlier one."""
+        previous = self.remove(key)
+        tombstone = self.tombstones.get(key)
+        oldest = self._oldest(previous.segment if previous else None, tombstone[1] if tombstone else None, self.shadowed.get(key))
+        if oldest is not None:
+            self.shadowed[key] = oldest
+        self.entries[key] = entry
+        self.segment_live[entry.segment] += record_size(key, entry.length)
+        self._files.setdefault(key[0], set()).add(key[1])
+        self._file_bytes[key[0]] = self._file_bytes.get(key[0], 0) + entry.length
+        self.total_bytes += entry.length
+        self.tombstones.pop(key, None)
+        if entry.expires_at:
+            heapq.heappush(self._expiry, (entry.expires_at, key))
+
+    def delete(self, key: ShardKey, tombstone_segment: int) -> None:
+        """Apply a tombstone written to tombstone_segment."""
+        previous = self.remove(key)
+        tombstone = self.tombstones.get(key)
+        self.tombstones[key] = (tombstone_segment, self._oldest(previous.segment if previous else None, tombstone[1] if tombstone else None, self.shadowed.pop(key, None)))
+
+    @staticmethod
+    def _oldest(*segments: Optional[int]) -> Optional[int]:
+        return min((segment for segment in segments if segment is not None), default=None)
+
+    def holds_older(self, oldest: Optional[int], segment: int) -> bool:
+        """Whether a segment from oldest up to (not including) segment still exists, so may hold an older record."""
+        return oldest is not None and any(oldest <= other < segment for other in self.segment_sizes)
+
+    def prune_shadowed(self) -> None:
+        """Forget overwritten records whose segments have all been compacted away."""
+        for key, oldest in list(self.shadowed.items()):
+            if key not in self.entries or not self.holds_older(oldest, self.entries[key].segment):
+                del self.shadowed[key]
+
+    def remove(self, key: ShardKey) -> Optional[ShardEntry]:
+        """Forget key and take it out of the totals, returning its entry."""
+        previous = self.entries.pop(key, None)
+        if previous is None:
+            return None
+        self.segment_live[previous.segment] -= record_size(key, previous.length)
+        self.total_bytes -= previous.length
+        self._file_bytes[key[0]] -= previous.length
+        self._files[key[0]].discard(key[1])
+        if not self._files[key[0]]:
+            del self._files[key[0]], self._file_bytes[key[0]]
+        return previous
+
+    def file_shards(self, file_id: str) -> Set[int]:
+        """Shard indexes held for a file."""
+        return set(self._files.get(file_id, ()))
+
+    def file_stats(self, file_id: str) -> Tuple[int, int]:
+        """Return (shards, bytes) held for a file."""
+        return len(self._files.get(file_id, ())), self._file_bytes.get(file_id, 0)
+
+    @property
+    def file_count(self) -> int:
+        return len(self._files)
+
+    def pop_expired(self, now: float) -> List[ShardKey]:
+        """Return the keys whose deals ended by now; each is returned once."""
+        expired = []
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            entry = self.entries.get(key)
+            # Skip heap items left behind by a later put or a delete
+            if entry is not None and entry.expires_at == expires_at:
+                expired.append(key)
+        return expired
+
+    def save(self, path: str) -> None:
+        """Write the index to path atomically."""
+        parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.active_segment, len(self.segment_sizes), len(self.entries), len(self.tombstones), len(self.shadowed))]
+        for segment, size in self.segment_sizes.items():
+            parts.append(SEGMENT_ENTRY.pack(segment, size))
+        for (file_id, shard_index), entry in self.entries.items():
+            encoded_id = file_id.encode()
+            parts.append(SHARD_ENTRY.pack(len(encoded_id), shard_index, *entry) + encoded_id)
+        for (file_id, shard_index), (tombstone_segment, shadowed) in self.tombstones.items():
+            encoded_id = file_id.encode()
+            parts.append(TOMBSTONE_ENTRY.pack(len(encoded_id), shard_index, tombstone_segment, -1 if shadowed is None else shadowed) + encoded_id)
+        for (file_id, shard_index), oldest in self.shadowed.items():
+            encoded_id = file_id.encode()
+            parts.append(SHADOWED_ENTRY.pack(len(encoded_id), shard_index, oldest) + encoded_id)
+        body = b"".join(parts)
+
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as snapshot_file:
+            snapshot_file.write(body + struct.pack("<I", zlib.crc32(body)))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["ShardIndex"]:
+        """Read a snapshot, or return None if it is missing, corrupt or from another version."""
+        try:
+            with open(path, "rb") as snapshot_file:
+                data = snapshot_file.read()
+        except FileNotFoundError:
+            return None
+        body = data[:-4]
+        if len(data) < SNAPSHOT_HEADER.size + 4 or struct.unpack("<I", data[-4:])[0] != zlib.crc32(body):
+            return None
+        magic, version, active, segment_count, entry_count, tombstone_count, shadowed_count = SNAPSHOT_HEADER.unpack_from(body)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            return None
+
+        index = cls()
+        index.active_segment = active
+        offset = SNAPSHOT_HEADER.size
+        for _ in range(segment_count):
+            segment, size = SEGMENT_ENTRY.unpack_from(body, offset)
+            offset += SEGMENT_ENTRY.size
+            index.add_segment(segment)
+            index.segment_sizes[segment] = size
+        # Live byte counts are rebuilt as the entries are put back
+        for _ in range(entry_count):
+            id_length, shard_index, *fields = SHARD_ENTRY.unpack_from(body, offset)
+            offset += SHARD_ENTRY.size
+            file_id = body[offset:offset + id_length].decode()
+            offset += id_length
+            index.put((file_id, shard_index), ShardEntry(*fields))
+        for _ in range(tombstone_count):
+            id_length, shard_index, tombstone_segment, shadowed = TOMBSTONE_ENTRY.unpack_from(body, offset)
+            offset += TOMBSTONE_ENTRY.size
+            file_id = body[offset:offset + id_length].decode()
+            offset += id_length
+            index.tombstones[(file_id, shard_index)] = (tombstone_segment, None if shadowed < 0 else shadowed)
+        for _ in range(shadowed_count):
+            id_length, shard_index, oldest = SHADOWED_ENTRY.unpack_from(body, offset)
+            offset += SHADOWED_ENTRY.size
+            file_id = body[offset:offset + id_length].decode()
+            offset += id_length
+            index.shadowed[(file_id, shard_index)] = oldest
+        return index
@@ -0,0 +1,325 @@
+"""Log-structured shard store for storage nodes.
+
+Shards are appended to large segment files instead of one file per shard. Each
+record is a fixed header followed by the file ID and the shard bytes:
+
+    magic (4s) | kind (B) | file ID length (H) | shard index (I) | data length (I) | crc32 (I) | deal expiry (d)
+
+Records written before deal expiries were tracked use the magic b"BSHD" and
+have no expiry field; they are still read.
+
+A ShardIndex maps (file_id, shard_index) to the record's segment and offset, so
+reads are a single seek. It is snapshotted to disk, so a restart only replays
+the records written since. Deletes append a tombstone record; compaction copies
+the live records of mostly-dead segments forward and removes them, carrying a
+tombstone along while any older segment may still hold a copy of its shard.
+"""
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from .shard_cache import ShardCache
+from .shard_index import ShardEntry, ShardIndex, ShardKey
+from .config import SHARD_STORE_PATH, SEGMENT_SIZE, COMPACTION_THRESHOLD, INDEX_SNAPSHOT_INTERVAL, SHARD_CACHE_BYTES
+
+RECORD_MAGIC = b"BSH2"
+RECORD_HEADER = struct.Struct("<4sBHIIId")  # Size must match shard_index.RECORD_OVERHEAD
+LEGACY_RECORD_MAGIC = b"BSHD"
+LEGACY_RECORD_HEADER = struct.Struct("<4sBHIII")
+PUT, DELETE = 0, 1  # Record kinds
+SEGMENT_SUFFIX = ".seg"
+INDEX_SNAPSHOT_NAME = "index.snapshot"
+LEGACY_SHARD_NAME = re.compile(r"shard_(\d+)\.bin")
+
+class ShardStore:
+    """Append-only segment files plus an index of where each shard lives.
+
+    Safe to share between the network handler threads of one node. Recently read
+    shards are kept in a ShardCache of cache_bytes, so repeated audits and
+    downloads of the same shard skip the disk.
+    """
+
+    def __init__(self, root: str = SHARD_STORE_PATH, segment_size: int = SEGMENT_SIZE, compaction_threshold: float = COMPACTION_THRESHOLD, snapshot_interval: int = INDEX_SNAPSHOT_INTERVAL, cache_bytes: int = SHARD_CACHE_BYTES) -> None:
+        self.root = root
+        self.segment_size = segment_size
+        self.compaction_threshold = compaction_threshold
+        self.snapshot_interval = snapshot_interval
+        self.cache = ShardCache(cache_bytes)
+        self._lock = threading.RLock()
+        self._readers: Dict[int, BinaryIO] = {}
+        self._unsaved = 0
+        os.makedirs(root, exist_ok=True)
+
+        segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(root) if name.endswith(SEGMENT_SUFFIX))
+        self._index = self._warm_index(segments)
+        if self._index is None:
+            # No usable snapshot, so rebuild the index from every record
+            self._index = ShardIndex()
+            for segment in segments:
+                self._load_segment(segment, 0, is_last=segment == segments[-1])
+        else:
+            # Replay only what was appended after the snapshot
+            for segment in segments:
+                start = self._index.segment_sizes.get(segment, 0)
+                if start < os.path.getsize(self._path(segment)):
+                    self._load_segment(segment, start, is_last=segment == segments[-1])
+        self._index.active_segment = max(segments, default=0)
+        self._writer = self._open_writer(self._index.active_segment)
+
+    def _warm_index(self, segments: List[int]) -> Optional[ShardIndex]:
+        """Load the index snapshot if it matches the segments on disk."""
+        index = ShardIndex.load(os.path.join(self.root, INDEX_SNAPSHOT_NAME))
+        if index is None:
+            return None
+        known = set(index.segment_sizes)
+        newest = max(known, default=-1)
+        # Segments may only have grown or been added after the snapshot
+        if not known <= set(segments) or any(segment < newest for segment in set(segments) - known):
+            return None
+        if any(os.path.getsize(self._path(segment)) < size for segment, size in index.segment_sizes.items()):
+            return None
+        return index
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.root, f"{segment:08d}{SEGMENT_SUFFIX}")
+
+    def _open_writer(self, segment: int) -> BinaryIO:
+        self._index.add_segment(segment)
+        return open(self._path(segment), "ab")
+
+    def _reader(self, segment: int) -> BinaryIO:
+        if segment not in self._readers:
+            self._readers[segment] = open(self._path(segment), "rb")
+        return self._readers[segment]
+
+    def _load_segment(self, segment: int, offset: int, is_last: bool) -> None:
+        """Replay a segment from offset into the index, truncating a torn record at the end of the last one."""
+        path = self._path(segment)
+        self._index.add_segment(segment)
+        with open(path, "rb") as segment_file:
+            segment_file.seek(offset)
+            while True:
+                header = segment_file.read(LEGACY_RECORD_HEADER.size)
+                if len(header) < LEGACY_RECORD_HEADER.size:
+                    break
+                expires_at = 0.0
+                if header[:4] == RECORD_MAGIC:
+                    header += segment_file.read(RECORD_HEADER.size - LEGACY_RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break
+                    magic, kind, key_length, shard_index, length, checksum, expires_at = RECORD_HEADER.unpack(header)
+                else:
+                    magic, kind, key_length, shard_index, length, checksum = LEGACY_RECORD_HEADER.unpack(header)
+                body = segment_file.read(key_length + length)
+                if magic not in (RECORD_MAGIC, LEGACY_RECORD_MAGIC) or len(body) < key_length + length or zlib.crc32(body) != checksum:
+                    break
+                key = (body[:key_length].decode(), shard_index)
+                data_offset = offset + len(header) + key_length
+                if kind == PUT:
+                    self._index.put(key, ShardEntry(segment, data_offset, length, checksum, expires_at))
+                else:
+                    self._index.delete(key, segment)
+                offset = data_offset + length
+        if offset < os.path.getsize(path):
+            if not is_last:
+                raise ValueError(f"Segment {path} is corrupt at offset {offset}")
+            with open(path, "r+b") as segment_file:
+                segment_file.truncate(offset)
+        self._index.segment_sizes[segment] = offset
+
+    def _append(self, key: ShardKey, kind: int, data: bytes = b"", expires_at: float = 0.0) -> None:
+        """Write one record to the active segment, rolling over to a new segment when it is full."""
+        if self._index.segment_sizes[self._index.active_segment] >= self.segment_size:
+            self._roll()
+        segment = self._index.active_segment
+        file_id = key[0].encode()
+        checksum = zlib.crc32(data, zlib.crc32(file_id))
+        offset = self._index.segment_sizes[segment]
+        self._writer.write(RECORD_HEADER.pack(RECORD_MAGIC, kind, len(file_id), key[1], len(data), checksum, expires_at) + file_id + data)
+        self._writer.flush()
+        self._index.segment_sizes[segment] += RECORD_HEADER.size + len(file_id) + len(data)
+        self.cache.invalidate(key)
+        if kind == PUT:
+            self._index.put(key, ShardEntry(segment, offset + RECORD_HEADER.size + len(file_id), len(data), checksum, expires_at))
+        else:
+            self._index.delete(key, segment)
+
+        self._unsaved += 1
+        if self.snapshot_interval and self._unsaved >= self.snapshot_interval:
+            self.save_index()
+
+    def _roll(self) -> None:
+        """Seal the active segment and start the next one."""
+        self._writer.close()
+        self._index.active_segment += 1
+        self._writer = self._open_writer(self._index.active_segment)
+
+    def _is_dead(self, segment: int) -> bool:
+        size = self._index.segment_sizes[segment]
+        return size > 0 and 1 - self._index.segment_live[segment] / size >= self.compaction_threshold
+
+    def put(self, file_id: str, shard_index: int, data: bytes, expires_at: float = 0.0) -> None:
+        """Store a shard, replacing any earlier copy. expires_at is when its storage deal ends."""
+        with self._lock:
+            self._append((file_id, shard_index), PUT, data, expires_at)
+
+    def get(self, file_id: str, shard_index: int) -> Optional[bytes]:
+        """Return a stored shard, or None if this node does not hold it."""
+        cached = self.cache.get((file_id, shard_index))
+        if cached is not None:
+            return cached
+        with self._lock:
+            entry = self._index.get((file_id, shard_index))
+            if entry is None:
+                return None
+            data = self._read(entry)
+            self.cache.put((file_id, shard_index), data)
+            return data
+
+    def _read(self, entry: ShardEntry) -> bytes:
+        reader = self._reader(entry.segment)
+        reader.seek(entry.offset)
+        return reader.read(entry.length)
+
+    def entry(self, file_id: str, shard_index: int) -> Optional[ShardEntry]:
+        """Location, size, checksum and deal expiry of a stored shard, without reading it."""
+        return self._index.get((file_id, shard_index))
+
+    def __contains__(self, key: ShardKey) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def keys(self) -> Iterator[ShardKey]:
+        with self._lock:
+            return iter(list(self._index.entries))
+
+    @property
+    def total_bytes(self) -> int:
+        """Shard bytes held, excluding record overhead and dead records."""
+        return self._index.total_bytes
+
+    @property
+    def file_count(self) -> int:
+        return self._index.file_count
+
+    def file_stats(self, file_id: str) -> Tuple[int, int]:
+        """Return (shards, bytes) held for a file."""
+        return self._index.file_stats(file_id)
+
+    def delete(self, file_id: str, shard_index: int) -> bool:
+        """Drop a shard; returns False if it was not stored. Compacts once enough space is dead."""
+        with self._lock:
+            if (file_id, shard_index) not in self._index:
+                return False
+            self._append((file_id, shard_index), DELETE)
+            if self.garbage_ratio() >= self.compaction_threshold:
+                self.compact()
+            return True
+
+    def delete_file(self, file_id: str) -> int:
+        """Drop every shard of a file and return how many were removed."""
+        with self._lock:
+            return sum(self.delete(file_id, shard_index) for shard_index in self._index.file_shards(file_id))
+
+    def delete_expired(self, now: Optional[float] = None) -> int:
+        """Drop the shards whose storage deals have ended and return how many were removed."""
+        with self._lock:
+            expired = self._index.pop_expired(time.time() if now is None else now)
+            return sum(self.delete(*key) for key in expired)
+
+    def garbage_ratio(self) -> float:
+        """Fraction of segment bytes taken by overwritten or deleted records."""
+        total = sum(self._index.segment_sizes.values())
+        return 1 - sum(self._index.segment_live.values()) / total if total else 0.0
+
+    def compact(self) -> int:
+        """Rewrite segments that are at least compaction_threshold dead; returns bytes reclaimed."""
+        with self._lock:
+            reclaimed = 0
+            if self._is_dead(self._index.active_segment):
+                self._roll()
+            dead = [segment for segment in sorted(self._index.segment_sizes) if segment != self._index.active_segment and self._is_dead(segment)]
+            for segment in dead:
+                reclaimed += self._index.segment_sizes[segment] - self._index.segment_live[segment]
+                # Copy live records forward, then tombstones while an older segment may
+                # still hold a record of their key
+                for key, entry in [(key, entry) for key, entry in self._index.entries.items() if entry.segment == segment]:
+                    oldest = self._index.shadowed.get(key)
+                    self._append(key, PUT, self._read(entry), entry.expires_at)
+                    # The copied record goes away with its segment, so it shadows nothing
+                    if oldest is None:
+                        del self._index.shadowed[key]
+                    else:
+                        self._index.shadowed[key] = oldest
+                for key, (tombstone_segment, shadowed) in list(self._index.tombstones.items()):
+                    if tombstone_segment != segment:
+                        continue
+                    if self._index.holds_older(shadowed, segment):
+                        self._append(key, DELETE)
+                    else:
+                        del self._index.tombstones[key]
+                self.sync()
+                self._index.drop_segment(segment)
+                reader = self._readers.pop(segment, None)
+                if reader:
+                    reader.close()
+                os.remove(self._path(segment))
+            if dead:
+                self._index.prune_shadowed()
+                self.save_index()
+            return reclaimed
+
+    def import_legacy_tree(self, legacy_root: str) -> int:
+        """Move shards from the old shards/<file_id>/shard_<i>.bin layout into the store.
+
+        Legacy files are removed only after every shard has been appended and synced,
+        so an interrupted import can simply be run again.
+        """
+        imported = []
+        with self._lock:
+            for file_id in sorted(os.listdir(legacy_root)):
+                file_dir = os.path.join(legacy_root, file_id)
+                if not os.path.isdir(file_dir):
+                    continue
+                for name in sorted(os.listdir(file_dir)):
+                    match = LEGACY_SHARD_NAME.fullmatch(name)
+                    if not match:
+                        continue
+                    shard_path = os.path.join(file_dir, name)
+                    with open(shard_path, "rb") as shard_file:
+                        self._append((file_id, int(match.group(1))), PUT, shard_file.read())
+                    imported.append(shard_path)
+            self.save_index()
+
+        for shard_path in imported:
+            os.remove(shard_path)
+        for file_dir in {os.path.dirname(shard_path) for shard_path in imported}:
+            if not os.listdir(file_dir):
+                os.rmdir(file_dir)
+        return len(imported)
+
+    def sync(self) -> None:
+        """Flush the active segment to disk."""
+        with self._lock:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+
+    def save_index(self) -> None:
+        """Sync the segments and snapshot the index, so a restart skips replaying them."""
+        with self._lock:
+            self.sync()
+            self._index.save(os.path.join(self.root, INDEX_SNAPSHOT_NAME))
+            self._unsaved = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self.save_index()
+            self._writer.close()
+            for reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
@@ -1,9 +1,103 @@
-from typing import List
+from typing import Any, Iterator, List, Sequence
+import hashlib
+import numpy as np
+from .config import CDC_MIN_SIZE, CDC_AVG_SIZE, CDC_MAX_SIZE
 
-def split_data(data: bytes, shard_size: int) -> List[bytes]:
-    """Split data into chunks of shard_size."""
-    return [data[i:i + shard_size] for i in range(0, len(data), shard_size)]
+# Gear table for content-defined chunking, derived from SHA-256 so it never changes
+# between releases; changing it would move every chunk boundary
+GEAR = np.array([int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "big") for i in range(256)], dtype=np.uint32)
+GEAR_WINDOW = 32  # Bytes that contribute to each 32-bit gear hash
 
-def merge_data(shards: List[bytes]) -> bytes:
-    """Combine shards to form the original data."""
-    return b''.join(shards)
+def split_data(data: bytes, shard_size: int) -> List[memoryview]:
+    """Split data into chunks of shard_size, as views of data rather than copies."""
+    view = memoryview(data)
+    return [view[i:i + shard_size] for i in range(0, len(data), shard_size)]
+
+def merge_data(shards: Sequence[bytes]) -> bytearray:
+    """Combine shards to form the original data, copying each once into a preallocated buffer."""
+    merged = bytearray(sum(map(len, shards)))
+    offset = 0
+    for shard in shards:
+        merged[offset:offset + len(shard)] = shard
+        offset += len(shard)
+    return merged
+
+def gear_hashes(data: bytes) -> np.ndarray:
+    """Return the 32-bit gear hash ending at every byte of data.
+
+    hash[i] is sum(GEAR[data[i - k]] << k for k < 32), the value the FastCDC
+    recurrence fp = (fp << 1) + GEAR[byte] holds at byte i. The window is built
+    by doubling (1, 2, 4, .. 32 bytes), so the whole buffer is hashed in five
+    vector passes instead of a loop over bytes.
+    """
+    hashes = GEAR[np.frombuffer(data, dtype=np.uint8)]
+    shifted = np.empty_like(hashes)
+    size = len(hashes)
+    span = 1
+    while span < GEAR_WINDOW:
+        np.left_shift(hashes[:size - span], np.uint32(span), out=shifted[:size - span])
+        np.add(hashes[span:], shifted[:size - span], out=hashes[span:])
+        span *= 2
+    return hashes
+
+def _mask(bits: int) -> np.uint32:
+    """Mask over the top bits of the hash, which depend on the most bytes."""
+    return np.uint32(((1 << bits) - 1) << (32 - bits))
+
+def content_defined_cuts(data: bytes, min_size: int = CDC_MIN_SIZE, avg_size: int = CDC_AVG_SIZE, max_size: int = CDC_MAX_SIZE, final: bool = True) -> List[int]:
+    """Return the end offsets of the content-defined chunks of data (FastCDC).
+
+    Chunks are min_size to max_size bytes. A cut needs more matching hash bits
+    before avg_size and fewer after it, which keeps sizes close to avg_size.
+    Unless final, a trailing part shorter than max_size is left uncut, since
+    more data could still move its boundary.
+    """
+    if not GEAR_WINDOW <= min_size <= avg_size <= max_size:
+        raise ValueError(f"Chunk sizes must satisfy {GEAR_WINDOW} <= min <= avg <= max, got {min_size}, {avg_size}, {max_size}")
+    bits = max(avg_size.bit_length() - 1, 3)
+    hashes = gear_hashes(data)
+    # The strict mask covers the loose one, so its matches are a subset
+    loose = np.flatnonzero((hashes & _mask(bits - 2)) == 0)
+    strict = loose[(hashes[loose] & _mask(bits + 2)) == 0]
+
+    cuts: List[int] = []
+    start = 0
+    while start < len(data) and (final or len(data) - start >= max_size):
+        # A match at byte i cuts the chunk after i
+        i = np.searchsorted(strict, start + min_size - 1)
+        if i < len(strict) and strict[i] < start + avg_size - 1:
+            start = int(strict[i]) + 1
+        else:
+            i = np.searchsorted(loose, start + avg_size - 1)
+            if i < len(loose) and loose[i] < start + max_size - 1:
+                start = int(loose[i]) + 1
+            else:
+                start = min(start + max_size, len(data))
+        cuts.append(start)
+    return cuts
+
+def split_content_defined(data: bytes, min_size: int = CDC_MIN_SIZE, avg_size: int = CDC_AVG_SIZE, max_size: int = CDC_MAX_SIZE) -> List[bytes]:
+    """Split data into content-defined chunks, so an edit only changes the chunks around it."""
+    cuts = content_defined_cuts(data, min_size, avg_size, max_size)
+    return [data[start:end] for start, end in zip([0] + cuts, cuts)]
+
+def iter_content_chunks(file_obj: Any, read_size: int, min_size: int = CDC_MIN_SIZE, avg_size: int = CDC_AVG_SIZE, max_size: int = CDC_MAX_SIZE) -> Iterator[bytes]:
+    """Read file_obj in read_size blocks and yield its content-defined chunks.
+
+    Yields the same chunks as split_content_defined on the whole file; only the
+    undecided tail of each block (under max_size bytes) is carried over.
+    """
+    buffer = bytearray()
+    eof = False
+    while not eof:
+        block = file_obj.read(read_size)
+        eof = not block
+        buffer += block
+        start = 0
+        view = memoryview(buffer)
+        for end in content_defined_cuts(buffer, min_size, avg_size, max_size, final=eof):
+            yield bytes(view[start:end])
+            start = end
+        # The buffer cannot shrink while a view of it is held
+        view.release()
+        del buffer[:start]
@@ -18,3 +18,5 @@ GIVE_ALL_NODES = "#GIVE_ALL_NODES"
 STARTUP_CONNECTION = "#STARTUP_CONNECTION"
 
 STARTUP_DISCONNECT = "#STARTUP_DISCONNECT"
+
+FRAME_HELLO = "#FRAME_HELLO"
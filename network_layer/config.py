@@ -7,6 +7,10 @@ CONFIG_PATH = os.path.join(os.path.dirname(__file__), "../config.yaml")
 # Default values if config file or setting is missing
 DEFAULT_CONFIG = {
     "BUFFER_SIZE": 1024,  # Default buffer size in bytes
+    "BINARY_FRAMES": True,  # Offer binary frames to peers at connect time
+    "FRAME_HANDSHAKE_TIMEOUT": 2.0,  # Seconds to wait for a peer to accept frames before using JSON
+    "REQUEST_TIMEOUT": 60.0,  # Seconds Network.request waits for a reply
+    "MAX_FRAME_SIZE": 67108864,  # Largest message, metadata plus payload, accepted from a peer in bytes
 }
 
 # Load configuration from the YAML file
@@ -19,3 +23,10 @@ except FileNotFoundError:
 
 # Extract the buffer size, falling back to default if missing
 BUFFER_SIZE = config_data.get("BUFFER_SIZE", DEFAULT_CONFIG["BUFFER_SIZE"])
+# Extract the frame negotiation settings, falling back to defaults if missing
+BINARY_FRAMES = config_data.get("BINARY_FRAMES", DEFAULT_CONFIG["BINARY_FRAMES"])
+FRAME_HANDSHAKE_TIMEOUT = config_data.get("FRAME_HANDSHAKE_TIMEOUT", DEFAULT_CONFIG["FRAME_HANDSHAKE_TIMEOUT"])
+# Extract the reply timeout, falling back to default if missing
+REQUEST_TIMEOUT = config_data.get("REQUEST_TIMEOUT", DEFAULT_CONFIG["REQUEST_TIMEOUT"])
+# Extract the message size limit, falling back to default if missing
+MAX_FRAME_SIZE = config_data.get("MAX_FRAME_SIZE", DEFAULT_CONFIG["MAX_FRAME_SIZE"])
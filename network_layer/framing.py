@@ -0,0 +1,86 @@
+"""Wire formats for messages between nodes.
+
+A binary frame is a fixed header, the message as compact JSON and a raw payload:
+
+    magic (2s) | version (B) | frame type (B) | request id (I) | metadata length (I) | payload length (Q)
+
+Shard bytes travel in the payload as they are, rather than as hex inside the
+JSON message, so a transfer takes its own size on the wire and no megabyte
+strings are built or parsed. Nodes that predate frames send a 10-character ASCII
+length followed by JSON. That length never starts with FRAME_MAGIC, so a node
+reads either format from the same connection. Senders only switch to frames
+once the peer has answered a FRAME_HELLO with a HELLO frame (Network.negotiate).
+Lengths come from the peer, so messages over MAX_FRAME_SIZE are refused before
+any of their body is read.
+"""
+from typing import Any, BinaryIO, Dict, NamedTuple, Optional
+import json
+import socket
+import struct
+from .config import MAX_FRAME_SIZE
+
+FRAME_MAGIC = b"BF"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<2sBBIIQ")  # magic, version, frame type, request id, metadata length, payload length
+LEGACY_HEADER_LEN = 10  # ASCII length in front of legacy JSON messages
+COALESCE_SIZE = 65536  # Payloads up to this size go out in one write with their header
+
+# Frame types
+MESSAGE = 1
+REPLY = 2
+HELLO = 3
+
+class Frame(NamedTuple):
+    frame_type: int
+    request_id: int  # 0 when no reply is expected
+    metadata: Optional[Dict[str, Any]]  # The JSON message, None for an empty legacy message
+    payload: bytes
+    version: int = FRAME_VERSION  # 0 for legacy JSON messages
+
+def pack_header(frame_type: int, request_id: int, metadata: Dict[str, Any], payload_length: int) -> bytes:
+    """Header and metadata of a frame; the payload follows them as is."""
+    meta = json.dumps(metadata, separators=(",", ":")).encode("utf-8")
+    return FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, frame_type, request_id, len(meta), payload_length) + meta
+
+def write_frame(conn: socket.socket, frame_type: int, request_id: int, metadata: Dict[str, Any], payload: bytes = b"") -> int:
+    """Send a frame and return the number of bytes it took on the wire."""
+    head = pack_header(frame_type, request_id, metadata, len(payload))
+    if len(payload) <= COALESCE_SIZE:
+        conn.sendall(head + bytes(payload))
+    else:
+        # Large payloads are written straight from the caller's buffer
+        conn.sendall(head)
+        conn.sendall(payload)
+    return len(head) + len(payload)
+
+def pack_legacy(metadata: Dict[str, Any]) -> bytes:
+    """A message in the length-prefixed JSON format of nodes without frames."""
+    message = json.dumps(metadata)
+    return f"{len(message):^{LEGACY_HEADER_LEN}}{message}".encode("utf-8")
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) < size:
+        raise ConnectionError("Connection closed in the middle of a message")
+    return data
+
+def read_message(stream: BinaryIO, max_size: int = MAX_FRAME_SIZE) -> Frame:
+    """Read the next message of either format from a buffered socket file.
+
+    Legacy JSON messages come back as version-0 MESSAGE frames without a payload.
+    Raises ConnectionError when the peer hangs up and ValueError for a frame of
+    an unknown version or a message whose header claims more than max_size bytes.
+    """
+    prefix = _read_exact(stream, len(FRAME_MAGIC))
+    if prefix != FRAME_MAGIC:
+        length = int(prefix + _read_exact(stream, LEGACY_HEADER_LEN - len(prefix)))
+        if not 0 <= length <= max_size:
+            raise ValueError(f"Message of {length} bytes is over the {max_size}-byte limit")
+        return Frame(MESSAGE, 0, json.loads(_read_exact(stream, length)) if length else None, b"", 0)
+    _, version, frame_type, request_id, meta_length, payload_length = FRAME_HEADER.unpack(prefix + _read_exact(stream, FRAME_HEADER.size - len(prefix)))
+    if version > FRAME_VERSION:
+        raise ValueError(f"Unsupported frame version {version}")
+    if meta_length + payload_length > max_size:
+        raise ValueError(f"Frame of {meta_length + payload_length} bytes is over the {max_size}-byte limit")
+    metadata = json.loads(_read_exact(stream, meta_length))
+    return Frame(frame_type, request_id, metadata, _read_exact(stream, payload_length), version)
@@ -3,13 +3,16 @@ import threading
 import json
 import logging
 import os
-from typing import List, Dict, Optional, Union, Tuple
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, List, Dict, Optional, Union, Tuple
 # from .utils import bcolors
 from .utils import print_colored
 import network_layer.node as node
 import network_layer.commands as commands
 from .message import Message
-from .config import BUFFER_SIZE
+from .framing import FRAME_VERSION, HELLO, MESSAGE, REPLY, pack_legacy, read_message, write_frame
+from .config import BUFFER_SIZE, BINARY_FRAMES, FRAME_HANDSHAKE_TIMEOUT, REQUEST_TIMEOUT
 
 # Configure logging
 logging.basicConfig(
@@ -37,6 +40,18 @@ class Network(node.Node):
         self.nodes_in_network.append(
             {"ip_addr": self.GENESIS_NODE_ADDR, "port": self.GENESIS_NODE_PORT})
 
+        # Binary frame state per connection (see framing.py): agreed version, send
+        # lock, the request being handled and the futures of requests awaiting replies
+        self.frame_versions: Dict[socket.socket, int] = {}
+        self.frame_locks: Dict[socket.socket, threading.Lock] = {}
+        self.handling_request: Dict[socket.socket, int] = {}
+        self.pending_replies: Dict[socket.socket, Dict[int, Future]] = {}
+        self.pending_lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+        # Legacy connections carry one request at a time
+        self.legacy_locks: Dict[socket.socket, threading.Lock] = {}
+        self.legacy_requests = ThreadPoolExecutor(thread_name_prefix="legacy-request")
+
     def bindAndListen(self, port: int) -> None:
         self.SERVER_PORT: int = port
         self.SERVER_ADDR: tuple = (self.SERVER_IP, self.SERVER_PORT)
@@ -78,60 +93,25 @@ class Network(node.Node):
         connectionError: bool = True
         ind: int = 0
 
-        flag: int = 1
-
-        msg_buffer: str = ''
-        flag = 1
+        # Legacy JSON messages and binary frames can both arrive on this connection
+        reader = conn.makefile("rb")
         while connected:
 
-            full_msg: str = ''
-
-            new_msg: bool = True
-
-            while True:
-                if new_msg:
-                    if flag == 1:
-                        msg = msg_buffer + conn.recv(2048).decode(self.FORMAT)
-                    else:
-                        msg = msg_buffer
-
-                    # Controlling if msg is bigger than header
-                    if len(msg) >= self.HEADER_LEN:
-                        msg_len = int(msg[:self.HEADER_LEN])
-                    else:
-                        msg_buffer = msg
-                        flag = 1
-                        continue
-
-                    full_msg += msg
-                    if len(full_msg) - self.HEADER_LEN == msg_len:
-                        msg_buffer = full_msg[self.HEADER_LEN + msg_len:]
-                        new_msg = False
-
-                        break
-                    elif len(full_msg) - self.HEADER_LEN > msg_len:
-                        msg_buffer = full_msg[self.HEADER_LEN + msg_len:]
-                        full_msg = full_msg[:self.HEADER_LEN + msg_len]
-                        new_msg = False
-                        flag = 0
-                        break
-                    else:
-                        msg_buffer = full_msg
-                        flag = 1
-                        full_msg = ''
-
-                        continue
+            try:
+                frame = read_message(reader)
+            except (OSError, ValueError) as error:
+                print_colored(f"{addr} closed: {error}", "red")
+                break
+            msg = frame.metadata
 
-            if msg_len:
+            if msg:
                 ind += 1
 
-                full_msg = full_msg[self.HEADER_LEN:]
-
-                try:
-                    msg = json.loads(full_msg)
-                except:
-                    print_colored(msg, "green")
-                # msg=json.loads(msg)
+                if frame.version:
+                    # Replies to a framed message carry its request id
+                    self.handling_request[conn] = frame.request_id
+                    if frame.payload:
+                        msg["payload"] = frame.payload
 
                 try:
                     index = self.message_logs.index(msg["id"])
@@ -189,6 +169,12 @@ class Network(node.Node):
                         print_colored(
                             f"{addr} 2 Way Connection Established...", "green")
 
+                # The peer offers binary frames; nodes without them never answer
+                if commands.FRAME_HELLO == msg["title"] and BINARY_FRAMES:
+                    version = min(FRAME_VERSION, max(msg["message"]["versions"]))
+                    write_frame(conn, HELLO, 0, {"version": version})
+                    self._enable_frames(conn, version)
+
                 if commands.CMD_JOIN_MSG in msg:
 
                     mssg = json.dumps(self.getSelfOrAdjacent())
@@ -267,6 +253,9 @@ class Network(node.Node):
                 if msg:
                     self.handle_messages(msg, conn)
 
+        for state in (self.frame_versions, self.frame_locks, self.handling_request, self.legacy_locks):
+            state.pop(conn, None)
+        reader.close()
         conn.close()
 
         return
@@ -275,7 +264,13 @@ class Network(node.Node):
         # can be overriden by the user to register custom message handlers
         return
 
-    def reply(self, conn: socket.socket, msg_json: dict) -> None:
+    def reply(self, conn: socket.socket, msg_json: dict, payload: Optional[bytes] = None) -> None:
+        if self.frame_version(conn):
+            with self.frame_locks[conn]:
+                write_frame(conn, REPLY, self.handling_request.get(conn, 0), msg_json, payload or b"")
+            return
+        if payload is not None:
+            raise ValueError("Raw payloads need a connection that negotiated binary frames")
         message = json.dumps(msg_json)
         message = message.encode(self.FORMAT)
         conn.send(message)
@@ -402,19 +397,152 @@ class Network(node.Node):
         connection.connect(CONN_ADDR)
         return connection
 
-    def send(self, conn: socket.socket, msg_json: dict, hasResponse: int = 0) -> str:
+    def send(self, conn: socket.socket, msg_json: dict, hasResponse: int = 0, payload: Optional[bytes] = None) -> str:
+        if hasResponse:
+            if self.frame_version(conn):
+                reply, _ = self.request(conn, msg_json, payload)
+                return json.dumps(reply) if reply is not None else ""
+            return self._legacy_exchange(conn, msg_json, payload)
+
+        if self.frame_version(conn):
+            with self.frame_locks[conn]:
+                write_frame(conn, MESSAGE, 0, msg_json, payload or b"")
+            return ""
+        if payload is not None:
+            raise ValueError("Raw payloads need a connection that negotiated binary frames")
+        with self.legacy_locks.setdefault(conn, threading.Lock()):
+            conn.sendall(pack_legacy(msg_json))
+        return ""
+
+    def request(self, conn: socket.socket, msg_json: dict, payload: Optional[bytes] = None, timeout: Optional[float] = REQUEST_TIMEOUT) -> Tuple[Optional[dict], bytes]:
+        """Send a message and wait for the reply, returned as (reply message, reply payload).
+
+        Only framed connections carry payloads; legacy peers reply with JSON alone.
+        Raises TimeoutError if no reply arrives within timeout seconds.
+        """
+        future = self.request_async(conn, msg_json, payload)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def request_async(self, conn: socket.socket, msg_json: dict, payload: Optional[bytes] = None) -> Future:
+        """Send a request and return a Future of its (reply message, reply payload).
+
+        On framed connections every request carries an id and a reader thread hands
+        each reply to the future of its request, so any number of requests can be in
+        flight on one connection, answered in any order. Requests to legacy peers run
+        one at a time per connection on worker threads.
+        """
+        if not self.frame_version(conn):
+            return self.legacy_requests.submit(lambda: self._legacy_reply(self._legacy_exchange(conn, msg_json, payload)))
+        future: Future = Future()
+        request_id = next(self.request_ids)
+        with self.pending_lock:
+            pending = self.pending_replies.get(conn)
+            if pending is None:
+                raise ConnectionError("The connection to this peer is closed")
+            pending[request_id] = future
+        try:
+            with self.frame_locks[conn]:
+                write_frame(conn, MESSAGE, request_id, msg_json, payload or b"")
+        except OSError:
+            with self.pending_lock:
+                pending.pop(request_id, None)
+            raise
+        return future
+
+    def _route_replies(self, conn: socket.socket, reader: BinaryIO) -> None:
+        # Runs for as long as a framed outgoing connection is open
+        error: Exception = ConnectionError("Connection closed")
+        try:
+            while True:
+                frame = read_message(reader)
+                with self.pending_lock:
+                    future = self.pending_replies.get(conn, {}).pop(frame.request_id, None)
+                # Requests given up on are cancelled, and their late replies dropped
+                if future is not None and future.set_running_or_notify_cancel():
+                    future.set_result((frame.metadata, frame.payload))
+        except (OSError, ValueError) as read_error:
+            error = read_error
+        with self.pending_lock:
+            pending = self.pending_replies.pop(conn, {})
+        for future in pending.values():
+            if future.set_running_or_notify_cancel():
+                future.set_exception(ConnectionError(f"Connection closed before the reply arrived: {error}"))
+        reader.close()
+
+    def _legacy_exchange(self, conn: socket.socket, msg_json: dict, payload: Optional[bytes]) -> str:
+        """Send a legacy JSON request and return the whole JSON reply as text."""
+        if payload is not None:
+            raise ValueError("Raw payloads need a connection that negotiated binary frames")
+        with self.legacy_locks.setdefault(conn, threading.Lock()):
+            conn.sendall(pack_legacy(msg_json))
+            return self._read_legacy_reply(conn)
+
+    def _read_legacy_reply(self, conn: socket.socket) -> str:
+        # Nodes without frames reply with bare JSON, so read until a whole document has arrived
+        decoder = json.JSONDecoder()
+        data = bytearray()
+        while True:
+            chunk = conn.recv(BUFFER_SIZE)
+            if not chunk:
+                return data.decode(self.FORMAT)
+            data += chunk
+            # A reply only ends at a short read or a closing bracket; this skips most attempts to parse a long one
+            if len(chunk) == BUFFER_SIZE and data[-1:] not in (b"}", b"]"):
+                continue
+            text = data.decode(self.FORMAT, errors="ignore")
+            try:
+                _, end = decoder.raw_decode(text)
+            except ValueError:
+                continue
+            return text[:end]
+
+    @staticmethod
+    def _legacy_reply(response: str) -> Tuple[Optional[dict], bytes]:
+        return (json.loads(response) if response else None), b""
 
-        message = json.dumps(msg_json)
-        temp_len = len(message)
+    def frame_version(self, conn: socket.socket) -> int:
+        """Binary frame version agreed with the peer on conn, 0 for legacy JSON."""
+        return self.frame_versions.get(conn, 0)
 
-        message = f'{temp_len:^{self.HEADER_LEN}}'+message
-        message = message.encode(self.FORMAT)
-        conn.send(message)
-        if hasResponse:
-            msg = conn.recv(BUFFER_SIZE).decode(self.FORMAT)
-        else:
-            msg = ""
-        return msg
+    def negotiate(self, conn: socket.socket) -> int:
+        """Offer binary frames on a new connection and return the version the peer accepted.
+
+        The offer is a legacy JSON message, which nodes without frames ignore, so
+        no HELLO frame within FRAME_HANDSHAKE_TIMEOUT means the peer gets JSON.
+        Once frames are agreed, a reader thread routes the peer's replies.
+        """
+        if not BINARY_FRAMES:
+            return 0
+        self.send(conn, self.short_json_msg(commands.FRAME_HELLO, {"versions": [FRAME_VERSION]}))
+        reader = conn.makefile("rb")
+        conn.settimeout(FRAME_HANDSHAKE_TIMEOUT)
+        try:
+            frame = read_message(reader)
+        except (OSError, ValueError):
+            # A timed-out reader cannot be used again
+            reader.close()
+            return 0
+        finally:
+            conn.settimeout(None)
+        if frame.frame_type != HELLO or not frame.metadata.get("version"):
+            reader.close()
+            return 0
+        with self.pending_lock:
+            self.pending_replies[conn] = {}
+        self._enable_frames(conn, frame.metadata["version"])
+        threading.Thread(target=self._route_replies, args=(conn, reader), daemon=True).start()
+        return frame.metadata["version"]
+
+    def _enable_frames(self, conn: socket.socket, version: int) -> None:
+        # Frames are written header first, so Nagle would hold back their last segment
+        if conn.family in (socket.AF_INET, socket.AF_INET6):
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.frame_locks.setdefault(conn, threading.Lock())
+        self.frame_versions[conn] = version
 
     def connectToNode(self, address: str, port: int) -> None:
         logging.debug(f"_______{address}_{port}_______________________-")
@@ -436,6 +564,7 @@ class Network(node.Node):
             msg = self.short_json_msg(commands.NODE_CON_ADDR, f"{self.SERVER_IP},{self.SERVER_PORT}")
 
             self.send(connection, msg)
+            self.negotiate(connection)
 
         print_colored(f"Connected To->{address}:{port}", "green", 2)
         return
@@ -1,15 +1,32 @@
 from Crypto.PublicKey import RSA
-import json
-import hashlib
 import os
+import shutil
 import threading
-from file_layer import Distribute, Assimilate, generate_proof, verify_proof
+from file_layer import DistributeStream, AssimilateRange, AssimilateStream, generate_proof, verify_proof
+from file_layer.metadata import get_erasure_stripes, get_shard_count, CHUNKS_FIELD, ERASURE_FIELD
+from file_layer.shard_store import ShardStore
+from file_layer.object_cache import ObjectCache
+from file_layer.hashing import LEGACY_HASH_ALGO, hash_file
+from file_layer.file_catalog import FileCatalog, SUMMARY_FIELDS
+from file_layer.planner import UploadPlan, plan_upload
+from file_layer.compression import CompressingReader, resolve_codec
+from file_layer.config import COMPRESSION
+from file_layer.proofs import CHALLENGE_SEED_SIZE, DEFAULT_PROOF_HASH_ALGO, derive_salt, expected_proofs, proof_at
+from file_layer.file_retrieval import shards_for_range
 from network_layer import Network, Message
-from typing import Optional, Dict, Any
+from network_layer.config import REQUEST_TIMEOUT
+from typing import Optional, Dict, Any, List, Iterator, Tuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import islice
+from collections import deque
+from contextlib import ExitStack
 import socket
 import time
 
 GENESIS_PORT = 5050  # Macro for Genesis Node port
+LEGACY_SHARD_DIR = "shards"  # One-file-per-shard layout used before the segment store
+DEAL_TIMESTEP_SECONDS = 3600  # propose_deal books each timestep as one hour of storage
+FETCH_PIPELINE_DEPTH = 8  # Shard requests kept in flight while shards are fetched
 
 from incentive_layer import (
     propose_deal, validate_proof, approve_deal, invalidate_deal, complete_deal
@@ -21,107 +38,183 @@ class P2PFileStorageCLI:
         self.network = Network(ip)
         self.port = port
         self.genesis_ip = genesis_ip
-        # Stores file metadata: file_id -> {filename, size, extension, shard_mapping, peer_mapping}
-        self.file_table: Dict[str, Dict[str, Any]] = {}
+        # Stores file metadata on disk: file_id -> {filename, size, extension, shard_mapping, shard_locations, ...}
+        self.file_table = FileCatalog()
         self.network.start(port)
         self.client_address = client_address
         self.ether_private_key = ether_private_key
         # get input from init
         self.msg_gen = Message(sender_ip=ip, sender_port=port)
+        # Files this node has downloaded before, verified against their file IDs
+        self.object_cache = ObjectCache()
+        # Shards this node stores for others, appended to segment files
+        self.shard_store = ShardStore()
+        if os.path.isdir(LEGACY_SHARD_DIR):
+            migrated = self.shard_store.import_legacy_tree(LEGACY_SHARD_DIR)
+            if migrated:
+                print(f"Imported {migrated} shards from '{LEGACY_SHARD_DIR}/' into the shard store")
+        expired = self.shard_store.delete_expired()
+        if expired:
+            print(f"Dropped {expired} shards whose storage deals have ended")
 
         # Join the network if not Genesis node
         if genesis_ip:
             print(f"Joining network with genesis IP: {genesis_ip}")
             self.network.join_network(ip=genesis_ip)
 
-    def _generate_file_id(self, file_content: bytes) -> str:
-        """Generate a unique file ID based on file content using SHA-256."""
-        file_hash = hashlib.sha256(file_content).hexdigest()
-        return file_hash
+    def _generate_file_id(self, file_obj: Any) -> str:
+        """Generate a unique file ID based on file content using HASH_ALGO."""
+        return hash_file(file_obj)
 
-    def distribute_file(self, file_path: str, private_key: bytes, timestep_count: int) -> Optional[str]:
-        """Distribute a file across the P2P network."""
+    def distribute_file(self, file_path: str, private_key: bytes, timestep_count: int, versioned: bool = False, previous_version: Optional[str] = None) -> Optional[str]:
+        """Distribute a file across the P2P network.
+
+        Versioned uploads are split into content-defined chunks. Given the file ID of
+        the previous version, chunks that version already stored are referenced
+        instead of being sent again and get no new storage deal.
+        """
         filename = os.path.basename(file_path)
         extension = os.path.splitext(filename)[1]
         file_size = os.path.getsize(file_path)
 
-        # Determine number of shards based on available peers
+        # Size the shards from the file and the available peers
         peers = self.network.get_connections()
-        num_shards = len(peers)
-
-        if num_shards < 1:
+        if len(peers) < 1:
             print("Not enough peers to distribute the file.")
             return None
-
-        with open(file_path, 'rb') as file_obj:
-            file_content = file_obj.read()
+        # Chunks of the previous version can only be reused if they are stored for at least as long
+        deal_ends = time.time() + timestep_count * DEAL_TIMESTEP_SECONDS
+        previous = None
+        if previous_version:
+            previous = self.file_table.get(previous_version)
+            if not previous or CHUNKS_FIELD not in previous["shard_mapping"]:
+                print("Previous version not found or not a versioned upload.")
+                return None
+            if previous["deal_ends"] < deal_ends:
+                print("Previous version's storage deals end before this one's; uploading every chunk.")
+                previous = None
+
+        # Where each shard is stored: shard_index -> (peer_indx, stored file ID, stored shard index)
+        shard_locations: Dict[int, Tuple[int, str, int]] = {}
+        # Challenge salts are derived from this secret, so only the expected proofs are kept
+        challenge_seed = os.urandom(CHALLENGE_SEED_SIZE)
+        proof_jobs = {}
+        proof_executor = ThreadPoolExecutor()
+
+        with open(file_path, 'rb') as file_obj, ExitStack() as cleanup:
+            file_id = self._generate_file_id(file_obj)
             file_obj.seek(0)
-            file_id = self._generate_file_id(file_content)
-            encrypted_shards, shard_mapping = Distribute(
-                file_obj, private_key, num_shards=num_shards)
-
-        peer_mapping = {peer_indx: -1 for peer_indx in range(len(peers))}
-
-        # Distribute shards to peers
-        for shard_index, shard in enumerate(encrypted_shards):
-            peer = peers[shard_index % len(peers)]
-            self._send_shard(peer, shard, shard_index, file_id, self.ether_private_key, timesteps=timestep_count)
-            peer_mapping[shard_index % len(peers)] = shard_index
-
-        shard_metadata = {}
-        for shard_index, shard in enumerate(encrypted_shards):
-            salts = [os.urandom(16) for _ in range(timestep_count)]
-            proofs = [generate_proof(shard, salt, salt) for salt in salts]
-            shard_metadata[shard_index] = {
-                "salts": salts,
-                "proofs": proofs, # hashed (shard+salt)
-                "timesteps": timestep_count,
-            }
-
-        # Store file metadata in memory
+            # Fixed-size uploads are compressed into a temporary file first, so they
+            # are planned for the size they really compress to
+            source = file_obj
+            planned_size = file_size
+            codec = resolve_codec(COMPRESSION)
+            if codec is not None and not (versioned or previous_version):
+                source = cleanup.enter_context(CompressingReader(file_obj, codec)).spool()
+                planned_size = source.stored_size
+            plan = plan_upload(planned_size, len(peers))
+            print(f"Upload plan: {plan.explain()}")
+
+            # Any data_shards of the shards rebuild the file; content-defined chunks
+            # take only the plan's parity and placement
+            if versioned or previous_version:
+                shard_stream = DistributeStream(file_obj, private_key, parity_shards=plan.parity_shards, stripe_width=plan.chunk_stripe_width, chunking="cdc", previous=previous and previous["shard_mapping"])
+            else:
+                shard_stream = DistributeStream(source, private_key, chunking="fixed", plan=plan)
+
+            # Distribute shards to peers as soon as each one is ready, hashing the
+            # expected proofs on worker threads while the next shard is sent
+            for shard_index, shard in shard_stream:
+                proof_jobs[shard_index] = proof_executor.submit(expected_proofs, shard, challenge_seed, shard_index, timestep_count, DEFAULT_PROOF_HASH_ALGO)
+                peer_indx = self._peer_for(plan, shard_stream, shard_index)
+                self._send_shard(peers[peer_indx], shard, shard_index, file_id, self.ether_private_key, timesteps=timestep_count)
+                shard_locations[shard_index] = (peer_indx, file_id, shard_index)
+            shard_mapping = shard_stream.shard_mapping
+        # The upload returns without waiting for the proofs; proof checking does
+        proof_executor.shutdown(wait=False)
+
+        # "proofs" (packed HMACs of shard+salt, PROOF_SIZE bytes per timestep) are added once hashed
+        shard_metadata = {shard_index: {"timesteps": timestep_count} for shard_index in proof_jobs}
+
+        # Unchanged chunks point at the copy the previous version stored
+        for shard_index, previous_index in shard_stream.reused.items():
+            shard_locations[shard_index] = previous["shard_locations"][previous_index]
+        shard_locations = dict(sorted(shard_locations.items()))
+
+        # Store file metadata in the catalog
         self.file_table[file_id] = {
             "filename": filename,
             "size": file_size,
             "extension": extension,
             "shard_mapping": shard_mapping,
-            "peer_mapping": peer_mapping,
-            "shard_metadata": shard_metadata
+            "shard_count": get_shard_count(shard_mapping),
+            "shard_locations": shard_locations,
+            "shard_metadata": shard_metadata,
+            "challenge_seed": challenge_seed,
+            "proof_hash_algo": DEFAULT_PROOF_HASH_ALGO,
+            "deal_ends": deal_ends,
+            "previous_version": previous_version,
+            "plan": plan.explain(),
         }
+        if shard_stream.reused:
+            print(f"Reused {len(shard_stream.reused)} unchanged chunks of version {previous_version}; sent {len(shard_metadata)} shards")
         print(f"File '{filename}' distributed with File ID: {file_id}")
-        threading.Thread(target=self._start_proof_checking, args=(file_id,), daemon=True).start()
+        threading.Thread(target=self._start_proof_checking, args=(file_id, proof_jobs), daemon=True).start()
 
         return file_id
 
-    def _start_proof_checking(self, file_id: str) -> None:
+    @staticmethod
+    def _peer_for(plan: UploadPlan, shard_stream: DistributeStream, shard_index: int) -> int:
+        """Peer for a shard of shard_stream; content-defined uploads are placed by their own chunk count and stripes."""
+        if shard_stream.chunking != "cdc":
+            return plan.peer_for(shard_index)
+        # Every shard before the first parity shard is a data shard, so the count can still be open
+        return plan.for_chunks(shard_stream.data_shards or shard_index + 1).peer_for(shard_index)
+
+    def _start_proof_checking(self, file_id: str, proof_jobs: Dict[int, Future]) -> None:
+        # The expected proofs finish hashing in the background after the upload has returned
         file_info = self.file_table[file_id]
+        for shard_index, proof_job in proof_jobs.items():
+            file_info["shard_metadata"][shard_index]["proofs"] = proof_job.result()
+        self.file_table[file_id] = file_info
         shard_metadata = file_info["shard_metadata"]
+        shard_locations = file_info["shard_locations"]
+        challenge_seed = file_info["challenge_seed"]
+        # Proofs are checked with the algorithm they were computed with at upload
+        proof_hash_algo = file_info.get("proof_hash_algo", LEGACY_HASH_ALGO)
 
         for timestep in range(max(shard["timesteps"] for shard in shard_metadata.values())):
+            # Every shard of the file is challenged at once, then the proofs are checked
+            challenges: Dict[int, Future] = {}
             for shard_index, metadata in shard_metadata.items():
                 if timestep < metadata["timesteps"]:
-                    peer = self.network.get_connections()[shard_index % len(self.network.get_connections())]
-                    salt = metadata["salts"][timestep]
-                    expected_proof = metadata["proofs"][timestep]
-
-                    response_proof = self._request_proof(peer, file_id, shard_index, salt)
-                    print(f"expected_proof {expected_proof}, response proof {response_proof}")
-                    if response_proof and verify_proof(expected_proof=expected_proof, proof=response_proof) :
-                        # print(f"ADDRESSSSSSSSSSSSSSSSSS  VALIDATE     {self.client_address}")
-                        validate_proof(
-
-                            file_id=f"{file_id}_{shard_index}",
-                            client_address = self.client_address,
-                            client_private_key = self.ether_private_key
-                        )
-                    else:
-                        # print(f"ADDRESSSSSSSSSSSSSSSSSS   INVALIDATE    {self.client_address}")
-
-                        invalidate_deal(
-                            file_id=f"{file_id}_{shard_index}",
-                            reason="Proof mismatch or timeout",
-                            client_address=self.client_address,
-                            client_private_key=self.ether_private_key
-                        )
+                    peer = self.network.get_connections()[shard_locations[shard_index][0]]
+                    salt = derive_salt(challenge_seed, shard_index, timestep)
+                    challenges[shard_index] = self._request_proof(peer, file_id, shard_index, salt, proof_hash_algo)
+
+            for shard_index, challenge in challenges.items():
+                metadata = shard_metadata[shard_index]
+                expected_proof = proof_at(metadata["proofs"], timestep, proof_hash_algo)
+
+                response_proof = self._proof_from_reply(challenge)
+                print(f"expected_proof {expected_proof}, response proof {response_proof}")
+                if response_proof and verify_proof(expected_proof=expected_proof, proof=response_proof) :
+                    # print(f"ADDRESSSSSSSSSSSSSSSSSS  VALIDATE     {self.client_address}")
+                    validate_proof(
+
+                        file_id=f"{file_id}_{shard_index}",
+                        client_address = self.client_address,
+                        client_private_key = self.ether_private_key
+                    )
+                else:
+                    # print(f"ADDRESSSSSSSSSSSSSSSSSS   INVALIDATE    {self.client_address}")
+
+                    invalidate_deal(
+                        file_id=f"{file_id}_{shard_index}",
+                        reason="Proof mismatch or timeout",
+                        client_address=self.client_address,
+                        client_private_key=self.ether_private_key
+                    )
             time.sleep(1)  # Wait for 10 seconds (or timestep duration) before the next proof check
         # All shards are validated for timestep amount of time
         for shard_index, metadata in shard_metadata.items():
@@ -132,20 +225,36 @@ class P2PFileStorageCLI:
             )
         del self.file_table[file_id]
         print(f"Proof check completed and deal completed for file ID: {file_id}")
-    def _request_proof(self, peer: socket.socket, file_id: str, shard_index: int, salt: bytes) -> Optional[str]:
+    def _request_proof(self, peer: socket.socket, file_id: str, shard_index: int, salt: bytes, hash_algo: str) -> Future:
+        """Challenge a peer for the proof of a shard; the Future resolves to the peer's reply."""
         message = {
             "file_id": file_id,
             "shard_index": shard_index,
             "salt": salt.hex(),
+            "hash_algo": hash_algo,
         }
         print("SALT")
         print(salt.hex())
-        response = self.network.send(peer, self.msg_gen.msg(message, "#REQUEST_PROOF"), hasResponse=1)
-        if response:
-            proof = json.loads(response).get("message", {}).get("proof")
-            print(f"SENDING RESPONSE{proof}")
-            return proof
-        return None
+        return self._request(peer, self.msg_gen.msg(message, "#REQUEST_PROOF"))
+
+    def _proof_from_reply(self, challenge: Future) -> Optional[str]:
+        """The proof in a #REQUEST_PROOF reply, or None if the peer failed or did not answer in time."""
+        try:
+            response, _ = challenge.result(REQUEST_TIMEOUT)
+        except (OSError, ValueError):
+            return None
+        proof = response.get("message", {}).get("proof") if response else None
+        print(f"SENDING RESPONSE{proof}")
+        return proof
+
+    def _request(self, peer: socket.socket, message: Dict[str, Any]) -> Future:
+        """Send a request without waiting; a connection that fails to send gives a failed Future."""
+        try:
+            return self.network.request_async(peer, message)
+        except OSError as error:
+            failed: Future = Future()
+            failed.set_exception(error)
+            return failed
     def retrieve_file(self, file_id: str, private_key: bytes) -> Optional[str]:
         """Retrieve a file from the P2P network using its file ID."""
         file_info = self.file_table.get(file_id)
@@ -155,29 +264,135 @@ class P2PFileStorageCLI:
 
         filename = file_info["filename"]
         shard_mapping = file_info["shard_mapping"]
-        peer_mapping = file_info["peer_mapping"]
+        shard_locations = file_info["shard_locations"]
+        output_path = f"retrieved_{filename}"
 
-        peers = self.network.get_connections()
+        # Repeat downloads are served from the local object cache without contacting peers
+        cached_file = self.object_cache.lookup(file_id)
+        if cached_file:
+            with cached_file, open(output_path, 'wb') as out_file:
+                shutil.copyfileobj(cached_file, out_file)
+            print(f"File '{filename}' served from the local cache and saved as '{output_path}'")
+            return output_path
 
-        # Retrieve each shard from its respective peer
-        shards = []
-        for peer_indx, shard_index in peer_mapping.items():
-            shard = self._request_shard(peers[peer_indx], file_id, shard_index)
-            if shard:
-                shards.append(shard)
-            else:
-                print(f"Failed to retrieve shard {shard_index} from peer {peers[peer_indx]}")
+        peers = self.network.get_connections()
 
-        # Reassemble file from shards
-        original_data = Assimilate(
-            shards, shard_mapping, private_key)
-        output_path = f"retrieved_{filename}"
-        with open(output_path, 'wb') as out_file:
-            out_file.write(original_data)
+        # Erasure-coded files only need k shards of each stripe to arrive, in any order;
+        # they are requested stripe by stripe, so a stripe is written before the next is held
+        if ERASURE_FIELD in shard_mapping:
+            in_stripe_order = [shard_index for stripe in get_erasure_stripes(shard_mapping) for shard_index in stripe]
+            shards = self._fetch_shards_as_completed(peers, {shard_index: shard_locations[shard_index] for shard_index in in_stripe_order})
+        else:
+            shards = self._fetch_shards_in_order(peers, shard_locations)
+
+        # Reassemble file from shards straight into the output file and the object cache
+        timings: Dict[str, float] = {}
+        counters: Dict[str, int] = {}
+        try:
+            with open(output_path, 'wb') as out_file, self.object_cache.writer(file_id) as cached:
+                for chunk in AssimilateStream(shards, shard_mapping, private_key, timings=timings, counters=counters):
+                    out_file.write(chunk)
+                    cached.write(chunk)
+        finally:
+            shards.close()
 
         print(f"File '{filename}' retrieved and saved as '{output_path}'")
+        print("Stage timings: " + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in timings.items()))
+        print("Shards decoded: " + ", ".join(f"{outcome} {count}" for outcome, count in counters.items()))
         return output_path
 
+    def read_range(self, file_id: str, private_key: bytes, start: int, end: int) -> Optional[bytes]:
+        """Read bytes [start, end) of a stored file, fetching only the shards that hold them."""
+        file_info = self.file_table.get(file_id)
+        if not file_info:
+            print("File ID not found in table.")
+            return None
+
+        shard_mapping = file_info["shard_mapping"]
+        shard_locations = file_info["shard_locations"]
+        needed = set(shards_for_range(shard_mapping, start, end))
+        peers = self.network.get_connections()
+        shards = list(self._fetch_shards_in_order(peers, {shard_index: location for shard_index, location in shard_locations.items() if shard_index in needed}))
+
+        # A lost covering shard of an erasure-coded file is rebuilt from the rest of its stripe
+        if len(shards) < len(needed) and ERASURE_FIELD in shard_mapping:
+            fetched = {shard_index for shard_index, _ in shards}
+            stripes = [stripe for stripe in get_erasure_stripes(shard_mapping) if any(shard_index in needed and shard_index not in fetched for shard_index in stripe)]
+            others = {shard_index: shard_locations[shard_index] for stripe in stripes for shard_index in stripe if shard_index not in needed}
+            shards += self._fetch_shards_as_completed(peers, others)
+
+        data = AssimilateRange(shards, shard_mapping, private_key, start, end)
+        print(f"Read {len(data)} bytes of '{file_info['filename']}' from {len(shards)} of {get_shard_count(shard_mapping)} shards")
+        return data
+
+    def _fetch_shards_in_order(self, peers: List[socket.socket], shard_locations: Dict[int, Tuple[int, str, int]]) -> Iterator[Tuple[int, bytes]]:
+        """Retrieve each shard from its respective peer in order, keeping FETCH_PIPELINE_DEPTH requests in flight.
+
+        Closing the generator cancels the outstanding requests.
+        """
+        in_flight: deque = deque()
+        try:
+            for shard_index, (peer_indx, stored_id, stored_index) in shard_locations.items():
+                in_flight.append((shard_index, peer_indx, self._request_shard(peers[peer_indx], stored_id, stored_index)))
+                if len(in_flight) >= FETCH_PIPELINE_DEPTH:
+                    yield from self._received_shard(peers, *in_flight.popleft())
+            while in_flight:
+                yield from self._received_shard(peers, *in_flight.popleft())
+        finally:
+            for _, _, request in in_flight:
+                request.cancel()
+
+    def _fetch_shards_as_completed(self, peers: List[socket.socket], shard_locations: Dict[int, Tuple[int, str, int]]) -> Iterator[Tuple[int, bytes]]:
+        """Request shards in order, FETCH_PIPELINE_DEPTH at a time, and yield them in arrival order.
+
+        Each request gets REQUEST_TIMEOUT seconds from when it is sent. Requests to
+        the same peer share its connection. Closing the generator cancels the
+        outstanding requests.
+        """
+        locations = iter(shard_locations.items())
+        # Request future -> (peer_indx, shard_index, deadline)
+        in_flight: Dict[Future, Tuple[int, int, float]] = {}
+        try:
+            while True:
+                for shard_index, (peer_indx, stored_id, stored_index) in islice(locations, FETCH_PIPELINE_DEPTH - len(in_flight)):
+                    in_flight[self._request_shard(peers[peer_indx], stored_id, stored_index)] = (peer_indx, shard_index, time.monotonic() + REQUEST_TIMEOUT)
+                if not in_flight:
+                    return
+                first_deadline = min(deadline for _, _, deadline in in_flight.values())
+                done, _ = wait(in_flight, timeout=max(0.0, first_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    peer_indx, shard_index, _ = in_flight.pop(future)
+                    yield from self._received_shard(peers, shard_index, peer_indx, future)
+                for future, (peer_indx, shard_index, deadline) in list(in_flight.items()):
+                    if deadline <= time.monotonic():
+                        del in_flight[future]
+                        future.cancel()
+                        print(f"Request for shard {shard_index} from peer {peers[peer_indx]} timed out after {REQUEST_TIMEOUT} seconds")
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def _received_shard(self, peers: List[socket.socket], shard_index: int, peer_indx: int, request: Future) -> Iterator[Tuple[int, bytes]]:
+        """Yield (shard_index, shard) once a shard request is answered, or report the failure."""
+        try:
+            response, payload = request.result(REQUEST_TIMEOUT)
+        except (OSError, ValueError):
+            response, payload = None, b""
+        shard_data = response.get("message", {}).get("shard_data") if response else None
+        shard = payload or (bytes.fromhex(shard_data) if shard_data else None)
+        if shard:
+            yield shard_index, shard
+        else:
+            print(f"Failed to retrieve shard {shard_index} from peer {peers[peer_indx]}")
+
+    def storage_summary(self) -> None:
+        """Show what this node stores for others, straight from the shard index."""
+        print(f"Holding {len(self.shard_store)} shards of {self.shard_store.file_count} files, {self.shard_store.total_bytes} bytes")
+        print(f"Dead space in segments: {self.shard_store.garbage_ratio():.1%}")
+        cache = self.shard_store.cache.stats()
+        print(f"Shard cache: {cache['entries']} shards, {cache['bytes']} bytes, {cache['hits']} hits, {cache['misses']} misses, {cache['evictions']} evictions")
+        print("-" * 40)
+
     def list_files(self) -> None:
         """List all files available in the network with metadata."""
         if not self.file_table:
@@ -185,12 +400,15 @@ class P2PFileStorageCLI:
             return
 
         print("Files stored in the network:")
-        for file_id, info in self.file_table.items():
+        for file_id, info in self.file_table.summaries(SUMMARY_FIELDS):
             print(f"File ID: {file_id}")
             print(f"Filename: {info['filename']}")
             print(f"Size: {info['size']} bytes")
             print(f"Extension: {info['extension']}")
-            print(f"Shards: {len(info['shard_mapping'])}")
+            shard_count = info["shard_count"] if "shard_count" in info else get_shard_count(self.file_table[file_id]["shard_mapping"])
+            print(f"Shards: {shard_count}")
+            if info.get("previous_version"):
+                print(f"Previous version: {info['previous_version']}")
             print("-" * 40)
         
         def list_peers(self) -> None:
@@ -216,10 +434,13 @@ class P2PFileStorageCLI:
         message = {
             "file_id": file_id,
             "shard_index": shard_index,
-            "shard_data": shard.hex(),
             "timestep": time_step,
             "shard_id": shard_id
         }
+        # Peers that negotiated binary frames take the shard as a raw payload
+        payload = shard if self.network.frame_version(peer) else None
+        if payload is None:
+            message["shard_data"] = shard.hex()
 
 
         # propose the deal
@@ -232,7 +453,7 @@ class P2PFileStorageCLI:
 
         print(f"Propose deal was successful {propose_hash}") # DEBUG
         response = self.network.send(peer, self.msg_gen.msg(
-            message, "#STORE_SHARD"), hasResponse=1)
+            message, "#STORE_SHARD"), hasResponse=1, payload=payload)
         print(f"Shard {shard_index} sent to peer {peer}")    # DEBUG
         if response:
             print(response)
@@ -241,18 +462,13 @@ class P2PFileStorageCLI:
             else:
                 print(f"Peer {peer} failed to receive shard {shard_index}")
 
-    def _request_shard(self, peer: socket.socket, file_id: str, shard_index: int) -> Optional[bytes]:
-        """Request a specific shard from a peer."""
+    def _request_shard(self, peer: socket.socket, file_id: str, shard_index: int) -> Future:
+        """Request a specific shard from a peer; the Future resolves to the peer's reply."""
         message = {
             "file_id": file_id,
             "shard_index": shard_index
         }
-        response = self.network.send(peer, self.msg_gen.msg(
-            message, "#REQUEST_SHARD"), hasResponse=1)
-        if response:
-            shard_data = json.loads(response).get("message", {}).get("shard_data")
-            return bytes.fromhex(shard_data) if shard_data else None
-        return None
+        return self._request(peer, self.msg_gen.msg(message, "#REQUEST_SHARD"))
 
     def listen_for_messages(self) -> None:
         """Listen for incoming shard storage or retrieval requests."""
@@ -261,6 +477,7 @@ class P2PFileStorageCLI:
     def _handle_message(self, message: Dict[str, Any], conn: socket.socket) -> None:
         """Handle incoming messages based on type."""
         msg_type = message.get("title")
+        payload = message.get("payload")
         message = message.get("message")
 
         if msg_type == "#STORE_SHARD":
@@ -268,12 +485,10 @@ class P2PFileStorageCLI:
             print("Received shard storage request.")
             file_id = message["file_id"]
             shard_index = message["shard_index"]
-            shard_data = bytes.fromhex(message["shard_data"])
+            shard_data = payload if payload is not None else bytes.fromhex(message["shard_data"])
             time_step = message["timestep"]
             shard_id = message["shard_id"]
-            os.makedirs(f"shards/{file_id}", exist_ok=True)
-            with open(f"shards/{file_id}/shard_{shard_index}.bin", 'wb') as shard_file:
-                shard_file.write(shard_data)
+            self.shard_store.put(file_id, shard_index, shard_data, expires_at=time.time() + time_step * DEAL_TIMESTEP_SECONDS)
             print(f"Stored shard {shard_index} for file ID {file_id}")
 
             value = len(shard_data)*time_step
@@ -287,36 +502,39 @@ class P2PFileStorageCLI:
             print("Received shard retrieval request.")
             file_id = message["file_id"]
             shard_index = message["shard_index"]
-            shard_path = f"shards/{file_id}/shard_{shard_index}.bin"
-            if os.path.exists(shard_path):
-                with open(shard_path, 'rb') as shard_file:
-                    shard_data = shard_file.read()
-                response_message = {
-                    "shard_data": shard_data.hex()
-                }
-
-                self.network.reply(conn, self.msg_gen.msg(
-                    response_message, "#REPLY"))
+            shard_data = self.shard_store.get(file_id, shard_index)
+            if shard_data is not None:
+                if self.network.frame_version(conn):
+                    self.network.reply(conn, self.msg_gen.msg({}, "#REPLY"), payload=shard_data)
+                else:
+                    response_message = {
+                        "shard_data": shard_data.hex()
+                    }
+
+                    self.network.reply(conn, self.msg_gen.msg(
+                        response_message, "#REPLY"))
                 print(f"Sent shard {shard_index} for file ID {file_id}")
             else:
+                # Answer anyway, so the request fails now rather than at its timeout
+                self.network.reply(conn, self.msg_gen.msg({}, "#REPLY"))
                 print(f"Shard {shard_index} for file ID {file_id} not found")
         elif msg_type == "#REQUEST_PROOF":
             # generate proof
             # send proof
             file_id = message["file_id"]
             shard_index = message["shard_index"]
-            shard_path = f"shards/{file_id}/shard_{shard_index}.bin"
             salt = message["salt"]
-            if os.path.exists(shard_path):
-                with open(shard_path, 'rb') as shard_file:
-                    shard_data = shard_file.read()
+            shard_data = self.shard_store.get(file_id, shard_index)
+            if shard_data is not None:
                 bytesalt = bytes.fromhex(salt)
-                response_message = {"proof":generate_proof(shard_data, bytesalt, bytesalt)}
+                # Requests from clients that predate hash_algo expect the node's configured algorithm
+                response_message = {"proof":generate_proof(shard_data, bytesalt, bytesalt, message.get("hash_algo"))}
 
                 self.network.reply(conn, self.msg_gen.msg(
                     response_message, "#REPLY"))
                 print(f"Sent shard proof for {shard_index} with salt {salt}") # DEBUG
             else:
+                self.network.reply(conn, self.msg_gen.msg({"proof": None}, "#REPLY"))
                 print(f"Sent shard proof for {shard_index} with salt {salt} not found") # DEBUG
 
 def main() -> None:
@@ -342,33 +560,51 @@ def main() -> None:
 
     while True:
         command = input(
-            "Enter command (upload, download, list, clear, peers, exit): ").strip().lower()
+            "Enter command (upload, download, read, list, storage, clear, peers, exit): ").strip().lower()
 
         try:
             if command == "upload":
                 file_path = input("Enter path to file for upload: ")
                 time_step_count = int(input("Please enter the duration of file(timestepcount): "))
-                cli.distribute_file(file_path, private_key=private_key, timestep_count = time_step_count)
+                versioned = input("Keep versions of this file? (yes/no): ").strip().lower() in ("yes", "y")
+                previous_version = (input("Enter File ID of the previous version (leave empty for the first): ").strip() or None) if versioned else None
+                cli.distribute_file(file_path, private_key=private_key, timestep_count = time_step_count, versioned=versioned, previous_version=previous_version)
 
             elif command == "download":
                 file_id = input("Enter File ID for download: ")
                 cli.retrieve_file(file_id, private_key=private_key)
 
+            elif command == "read":
+                file_id = input("Enter File ID to read from: ")
+                start = int(input("Enter first byte offset: "))
+                end = int(input("Enter end byte offset (exclusive): "))
+                data = cli.read_range(file_id, private_key=private_key, start=start, end=end)
+                if data is not None:
+                    output_path = f"range_{start}_{end}_{cli.file_table[file_id]['filename']}"
+                    with open(output_path, 'wb') as out_file:
+                        out_file.write(data)
+                    print(f"Saved as '{output_path}'")
+
             elif command == "list":
                 cli.list_files()
 
+            elif command == "storage":
+                cli.storage_summary()
+
             elif command == "clear":
                 os.system('cls' if os.name == 'nt' else 'clear')
 
             elif command == "exit":
                 cli.network.stop()
+                cli.shard_store.close()
+                cli.file_table.close()
                 print("Exiting program.")
                 os._exit(0)
             elif command == "peers":
                 cli.list_peers()
             else:
                 print(
-                    "Invalid command. Please use upload, download, list, clear, or exit.")
+                    "Invalid command. Please use upload, download, read, list, storage, clear, or exit.")
         except Exception as e:
             print(f"Error: {e}")
             y = input("Do you want a complete traceback? (yes/no): ")
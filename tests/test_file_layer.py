@@ -1,7 +1,32 @@
 # tests/test_sharding.py
+import hashlib
 import io
+import itertools
+import os
+import random
+import tracemalloc
 import pytest
-from file_layer import Distribute, Assimilate
+from reedsolo import RSCodec, ReedSolomonError
+from file_layer import Distribute, DistributeStream, Assimilate, AssimilateRange, AssimilateStream
+from file_layer import file_retrieval, file_upload, planner
+from file_layer.file_retrieval import data_extents, shards_for_range
+from file_layer.encryption import encrypt_data, decrypt_data, generate_data_key
+from file_layer.metadata import CHECKSUMS_FIELD, COMPRESSION_FIELD, DATA_KEY_FIELD, ERASURE_FIELD, HASH_FIELD, create_shard_mapping, get_chunk_hashes, get_erasure_stripes, get_hash, get_shard_count
+from file_layer.erasure import MAX_SHARDS
+from file_layer.config import CDC_MAX_SIZE, DEFAULT_ERROR_CORRECTION
+from file_layer.compression import FRAME_HEADER, CompressingReader, sample_entropy
+from file_layer.rs_codec import NumpyRSCodec
+from file_layer.hashing import format_id, hash_file, id_algo, shard_key
+from file_layer.file_catalog import FileCatalog, LOG_NAME, SUMMARY_FIELDS, pack_entry, unpack_entry, unpack_fields
+from file_layer.object_cache import ObjectCache
+from file_layer.parallel import create_executor
+from file_layer.planner import plan_upload
+from file_layer.redundancy import BLOCK_SIZE, decode_checked_shard, encode_shard, encoded_size, shard_checksum, strip_parity
+from file_layer.proofs import CHALLENGE_SEED_SIZE, PROOF_BLOCK_SIZE, PROOF_SIZE, derive_salt, expected_proofs, generate_proof, proof_at, verify_proof
+from file_layer.shard_cache import ShardCache
+from file_layer.shard_format import HEADER_SIZE, parse_shard, read_header
+from file_layer.shard_store import ShardStore
+from file_layer.sharding import GEAR, gear_hashes, iter_content_chunks, merge_data, split_content_defined, split_data
 from Crypto.PublicKey import RSA
 
 @pytest.fixture(scope="module")
@@ -61,5 +86,922 @@ def test_actual_file(rsa_key):
     reconstructed_data = Assimilate(shards, mapping, rsa_key)
     assert reconstructed_data == test_data
 
+def test_envelope_mode_handles_large_shards(rsa_key):
+    # Shards far larger than an RSA-OAEP block only work with the envelope mode
+    test_data = bytes(range(256)) * 40
+
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=2)
+
+    assert DATA_KEY_FIELD in mapping
+    assert get_shard_count(mapping) == len(shards) == 2
+    assert Assimilate(shards, mapping, rsa_key) == test_data
+
+def test_legacy_rsa_mode_still_decodes(rsa_key, monkeypatch):
+    monkeypatch.setattr(file_upload, "ENCRYPTION_MODE", "rsa")
+    test_data = b"Shards encrypted before the envelope mode existed."
+
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key)
+
+    assert DATA_KEY_FIELD not in mapping
+    assert Assimilate(shards, mapping, rsa_key) == test_data
+
+def test_envelope_encryption_is_authenticated(rsa_key):
+    data_key = generate_data_key()
+    ciphertext = bytearray(encrypt_data(b"authenticated shard", rsa_key, data_key))
+    assert decrypt_data(bytes(ciphertext), rsa_key, data_key) == b"authenticated shard"
+
+    ciphertext[-1] ^= 0x01
+    with pytest.raises(ValueError):
+        decrypt_data(bytes(ciphertext), rsa_key, data_key)
+
+def test_distribute_stream_yields_before_file_is_read(rsa_key):
+    test_data = bytes(range(256)) * 200
+    file_obj = io.BytesIO(test_data)
+
+    stream = DistributeStream(file_obj, rsa_key, num_shards=8, max_memory=32 * 1024)
+    shard_iter = iter(stream)
+    first_index, first_shard = next(shard_iter)
+
+    # The first shard is out while most of the file is still unread
+    assert first_index == 0
+    assert file_obj.tell() < len(test_data)
+
+    shards = [first_shard] + [shard for _, shard in shard_iter]
+    assert len(shards) == 8
+    assert Assimilate(shards, stream.shard_mapping, rsa_key) == test_data
+
+def test_distribute_stream_rejects_shards_over_memory_limit(rsa_key):
+    with pytest.raises(ValueError):
+        DistributeStream(io.BytesIO(b"x" * 100000), rsa_key, num_shards=1, max_memory=64 * 1024)
+
+def test_assimilate_stream_accepts_shards_out_of_order(rsa_key):
+    test_data = bytes(range(256)) * 30
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=5)
+
+    # Indexed pairs arriving in reverse order
+    chunks = list(AssimilateStream(reversed(list(enumerate(shards))), mapping, rsa_key))
+    assert b"".join(chunks) == test_data
+
+    # Bare shards placed through the mapping
+    assert Assimilate(shards[::-1], mapping, rsa_key) == test_data
+
+def test_assimilate_stream_yields_chunks_incrementally(rsa_key):
+    test_data = bytes(range(256)) * 30
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=5)
+
+    stream = AssimilateStream(iter(enumerate(shards)), mapping, rsa_key)
+    first_chunk = next(stream)
+
+    assert 0 < len(first_chunk) < len(test_data)
+    assert first_chunk + b"".join(stream) == test_data
+
+def test_assimilate_stream_reports_missing_shard(rsa_key):
+    shards, mapping = Distribute(io.BytesIO(bytes(range(256)) * 30), rsa_key, num_shards=5)
+
+    with pytest.raises(ValueError):
+        b"".join(AssimilateStream(shards[:3] + shards[4:], mapping, rsa_key))
+
+# Small inputs are coded by table lookup, more than TABLE_BLOCKS codewords column by column
+@pytest.mark.parametrize("size", [0, 1, 245, 1000, 12345, 70000])
+def test_numpy_codec_matches_reedsolo(size):
+    reference = RSCodec(DEFAULT_ERROR_CORRECTION)
+    codec = NumpyRSCodec(DEFAULT_ERROR_CORRECTION)
+    data = os.urandom(size)
+
+    encoded = codec.encode(data)
+    assert encoded == reference.encode(data)
+    assert codec.decode(encoded)[0] == data
+
+def test_numpy_codec_corrects_errors():
+    rng = random.Random(7)
+    codec = NumpyRSCodec(DEFAULT_ERROR_CORRECTION)
+    data = rng.randbytes(3000)
+    corrupted = bytearray(codec.encode(data))
+
+    # Up to nsym/2 byte errors in every 255-byte block are correctable
+    for start in range(0, len(corrupted), 255):
+        block_len = min(255, len(corrupted) - start)
+        for pos in rng.sample(range(block_len), DEFAULT_ERROR_CORRECTION // 2):
+            corrupted[start + pos] ^= rng.randint(1, 255)
+
+    assert codec.decode(corrupted)[0] == data
+    assert RSCodec(DEFAULT_ERROR_CORRECTION).decode(corrupted)[0] == data
+
+    # More errors than that are detected rather than silently decoded
+    for pos in range(DEFAULT_ERROR_CORRECTION):
+        corrupted[pos] ^= 0xFF
+    with pytest.raises(ReedSolomonError):
+        codec.decode(corrupted)
+
+def test_numpy_codec_decodes_erasures():
+    codec = NumpyRSCodec(DEFAULT_ERROR_CORRECTION)
+    data = random.Random(3).randbytes(1000)
+    corrupted = bytearray(codec.encode(data))
+
+    # Known positions allow up to nsym erasures in a block, twice the unknown errors
+    erased = list(range(DEFAULT_ERROR_CORRECTION))
+    for pos in erased:
+        corrupted[pos] = 0
+    decoded = codec.decode(corrupted, erase_pos=erased)
+    assert decoded[0] == data
+    assert decoded == RSCodec(DEFAULT_ERROR_CORRECTION).decode(corrupted, erase_pos=erased)
+
+def test_erasure_coding_rebuilds_from_any_k_shards(rsa_key):
+    test_data = bytes(range(256)) * 20
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=5, parity_shards=2)
+
+    assert len(shards) == 5
+    assert mapping[ERASURE_FIELD]["data_shards"] == 3
+    for kept in itertools.combinations(range(5), 3):
+        assert Assimilate([shards[i] for i in kept], mapping, rsa_key) == test_data
+
+def test_erasure_coding_skips_corrupt_shards_and_stops_at_k(rsa_key):
+    test_data = bytes(range(256)) * 20
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=5, parity_shards=2)
+    corrupted = bytearray(shards[0])
+    corrupted[-1] ^= 0xFF
+
+    pulled = []
+    def arrivals():
+        for item in [(0, bytes(corrupted)), (4, shards[4]), (2, shards[2]), (1, shards[1]), (3, shards[3])]:
+            pulled.append(item[0])
+            yield item
+
+    assert b"".join(AssimilateStream(arrivals(), mapping, rsa_key)) == test_data
+    # The corrupt shard is ignored and the last shard is never requested
+    assert pulled == [0, 4, 2, 1]
+
+def test_erasure_coding_needs_k_shards(rsa_key):
+    shards, mapping = Distribute(io.BytesIO(b"x" * 2000), rsa_key, num_shards=4, parity_shards=1)
+
+    with pytest.raises(ValueError):
+        Assimilate(shards[:2], mapping, rsa_key)
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_parallel_distribute_keeps_shard_order(rsa_key, backend, monkeypatch):
+    monkeypatch.setattr(file_upload, "PARALLEL_MIN_SIZE", 0)
+    test_data = bytes(range(256)) * 64
+
+    stream = DistributeStream(io.BytesIO(test_data), rsa_key, num_shards=6, parity_shards=1, workers=3, backend=backend)
+    indexed = list(stream)
+
+    assert stream.workers == 3
+    assert [index for index, _ in indexed] == list(range(6))
+    assert all(stream.shard_mapping[get_hash(shard)] == index for index, shard in indexed)
+    assert Assimilate([shard for _, shard in indexed], stream.shard_mapping, rsa_key) == test_data
+
+def test_process_backend_reuses_one_pool():
+    with create_executor(2, "process") as first:
+        assert first.submit(sum, [1, 2]).result() == 3
+    with create_executor(2, "process") as second:
+        assert second is first
+        assert second.submit(sum, [3, 4]).result() == 7
+
+def test_parallel_distribute_falls_back_to_serial_for_small_files(rsa_key):
+    stream = DistributeStream(io.BytesIO(b"tiny"), rsa_key, workers=8)
+    assert stream.workers == 1
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_parallel_assimilate_preserves_order(rsa_key, backend, monkeypatch):
+    monkeypatch.setattr(file_retrieval, "PARALLEL_MIN_SIZE", 0)
+    test_data = bytes(range(256)) * 64
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=8)
+
+    shuffled = list(enumerate(shards))
+    random.Random(7).shuffle(shuffled)
+    assert Assimilate(shuffled, mapping, rsa_key, workers=3) == test_data
+    assert b"".join(AssimilateStream(shards, mapping, rsa_key, workers=3, backend=backend)) == test_data
+
+def test_parallel_assimilate_erasure_with_lost_shards(rsa_key, monkeypatch):
+    monkeypatch.setattr(file_retrieval, "PARALLEL_MIN_SIZE", 0)
+    test_data = os.urandom(5000)
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=6, parity_shards=2)
+
+    survivors = [(index, shard) for index, shard in enumerate(shards) if index not in (0, 3)]
+    assert b"".join(AssimilateStream(survivors, mapping, rsa_key, workers=2, backend="thread")) == test_data
+
+def test_assimilate_reports_stage_timings(rsa_key):
+    test_data = os.urandom(3000)
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=4, parity_shards=1)
+
+    timings = {}
+    assert Assimilate(shards[1:], mapping, rsa_key, timings=timings) == test_data
+    assert set(timings) == set(file_retrieval.TIMING_STAGES)
+    assert all(seconds > 0 for seconds in timings.values())
+
+def test_gear_hashes_match_rolling_recurrence():
+    data = random.Random(3).randbytes(500)
+    expected, fp = [], 0
+    for byte in data:
+        fp = ((fp << 1) + int(GEAR[byte])) & 0xFFFFFFFF
+        expected.append(fp)
+    assert gear_hashes(data).tolist() == expected
+
+def test_content_defined_chunks_survive_insertion():
+    data = random.Random(4).randbytes(1 << 20)
+    chunks = split_content_defined(data, 1024, 4096, 16384)
+    edited = split_content_defined(data[:5000] + b"inserted" + data[5000:], 1024, 4096, 16384)
+
+    assert b"".join(chunks) == data
+    assert all(1024 <= len(chunk) <= 16384 for chunk in chunks[:-1])
+    assert sum(chunk in set(chunks) for chunk in edited) >= len(edited) - 3
+
+def test_streamed_chunks_match_whole_buffer():
+    data = random.Random(5).randbytes(300000)
+    streamed = list(iter_content_chunks(io.BytesIO(data), 7000, 1024, 4096, 16384))
+    assert streamed == split_content_defined(data, 1024, 4096, 16384)
+
+def test_distribute_cdc_round_trip_with_lost_shards(rsa_key):
+    test_data = os.urandom(100000)
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, parity_shards=2, chunking="cdc")
+
+    chunk_hashes = get_chunk_hashes(mapping)
+    assert len(shards) == len(chunk_hashes) + 2
+    assert get_shard_count(mapping) == len(shards)
+    assert Assimilate(shards, mapping, rsa_key) == test_data
+    survivors = [(index, shard) for index, shard in enumerate(shards) if index not in (0, 2)]
+    assert Assimilate(survivors, mapping, rsa_key) == test_data
+
+def test_cdc_rejects_num_shards(rsa_key):
+    with pytest.raises(ValueError):
+        DistributeStream(io.BytesIO(b"data"), rsa_key, num_shards=2, chunking="cdc")
+
+def test_cdc_parity_stores_chunks_unpadded(rsa_key):
+    test_data = os.urandom(200000)
+    plain = dict(DistributeStream(io.BytesIO(test_data), rsa_key, chunking="cdc"))
+    stream = DistributeStream(io.BytesIO(test_data), rsa_key, parity_shards=2, chunking="cdc")
+    shards = dict(stream)
+
+    data_shards = stream.shard_mapping[ERASURE_FIELD]["data_shards"]
+    assert data_shards == len(plain)
+    assert sum(len(shards[index]) for index in range(data_shards)) == sum(map(len, plain.values()))
+    # Parity is only as long as the longest chunk of its stripe
+    assert len(shards[data_shards]) <= max(len(shards[index]) for index in range(data_shards))
+    assert sum(map(len, shards.values())) < 1.5 * len(test_data)
+
+    survivors = [(index, shard) for index, shard in shards.items() if index not in (0, 3)]
+    assert Assimilate(survivors, stream.shard_mapping, rsa_key) == test_data
+
+@pytest.mark.parametrize("insert_at, parity_shards", [(120000, 2), (0, 0), (0, 2)])
+def test_delta_upload_sends_only_changed_chunks(rsa_key, insert_at, parity_shards):
+    original = os.urandom(200000)
+    first = DistributeStream(io.BytesIO(original), rsa_key, parity_shards=parity_shards, chunking="cdc")
+    stored = dict(first)
+    # Chunks are stored at about their encoded size, and parity adds at most one chunk per parity shard
+    assert sum(map(len, stored.values())) < 1.2 * len(original) + parity_shards * encoded_size(CDC_MAX_SIZE)
+
+    edited = original[:insert_at] + b"inserted bytes" + original[insert_at:]
+    second = DistributeStream(io.BytesIO(edited), rsa_key, parity_shards=parity_shards, chunking="cdc", previous=first.shard_mapping)
+    sent = dict(second)
+
+    chunk_count = len(get_chunk_hashes(second.shard_mapping))
+    assert len(sent) + len(second.reused) == chunk_count + parity_shards
+    assert len(sent) <= 2 + parity_shards
+    assert sum(len(shard) for index, shard in sent.items() if index < chunk_count) < len(original) / 4
+    assert second.shard_mapping[DATA_KEY_FIELD] == first.shard_mapping[DATA_KEY_FIELD]
+
+    # Reused chunks are served from the previous version's shards, and decode
+    # without parity to cover for them
+    shards = dict(sent)
+    for shard_index, previous_index in second.reused.items():
+        shards[shard_index] = stored[previous_index]
+    data_only = [(index, shards[index]) for index in range(chunk_count)]
+    assert Assimilate(data_only, second.shard_mapping, rsa_key) == edited
+    assert Assimilate([shard for _, shard in data_only], second.shard_mapping, rsa_key) == edited
+    if parity_shards:
+        assert Assimilate([(index, shard) for index, shard in shards.items() if index not in (1, 5)], second.shard_mapping, rsa_key) == edited
+
+def test_delta_upload_places_reused_shards_sealed_under_other_indexes(rsa_key):
+    original = os.urandom(200000)
+    first = DistributeStream(io.BytesIO(original), rsa_key, chunking="cdc")
+    stored = dict(first)
+
+    # Prepending shifts every reused chunk to a higher index than it was sealed with
+    edited = os.urandom(20000) + original
+    second = DistributeStream(io.BytesIO(edited), rsa_key, chunking="cdc", previous=first.shard_mapping)
+    shards = dict(second)
+    assert any(shard_index != previous_index for shard_index, previous_index in second.reused.items())
+    for shard_index, previous_index in second.reused.items():
+        shards[shard_index] = stored[previous_index]
+
+    assert Assimilate(list(shards.items()), second.shard_mapping, rsa_key) == edited
+    bare = list(shards.values())
+    random.Random(5).shuffle(bare)
+    assert Assimilate(bare, second.shard_mapping, rsa_key) == edited
+
+    # A third version reuses shards through the second, and they keep their first index
+    third = DistributeStream(io.BytesIO(os.urandom(30000) + edited), rsa_key, chunking="cdc", previous=second.shard_mapping)
+    latest = dict(third)
+    for shard_index, previous_index in third.reused.items():
+        latest[shard_index] = shards[previous_index]
+    assert Assimilate(list(latest.items()), third.shard_mapping, rsa_key)[30000:] == edited
+
+def test_delta_upload_needs_cdc(rsa_key):
+    first = DistributeStream(io.BytesIO(b"x" * 5000), rsa_key, num_shards=2)
+    list(first)
+    with pytest.raises(ValueError):
+        DistributeStream(io.BytesIO(b"y" * 5000), rsa_key, chunking="cdc", previous=first.shard_mapping)
+
+@pytest.mark.parametrize("options", [{"num_shards": 6, "parity_shards": 2, "layout": "striped"}, {"chunking": "cdc"}])
+def test_range_reads_fetch_only_covering_shards(rsa_key, options):
+    test_data = os.urandom(60000)
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, **options)
+    assert Assimilate(list(enumerate(shards)), mapping, rsa_key) == test_data
+
+    rng = random.Random(7)
+    for start, end in [(0, 1), (0, 60000), (59999, 60000), (5000, 5000)] + [sorted(rng.sample(range(60001), 2)) for _ in range(10)]:
+        covering = shards_for_range(mapping, start, end)
+        assert len(covering) < len(shards) or end - start == 60000
+        assert AssimilateRange([(index, shards[index]) for index in covering], mapping, rsa_key, start, end) == test_data[start:end]
+
+def test_range_read_rebuilds_lost_covering_shard(rsa_key):
+    test_data = os.urandom(20000)
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=5, parity_shards=2, layout="striped")
+    lost = shards_for_range(mapping, 9000, 9100)
+    survivors = [(index, shard) for index, shard in enumerate(shards) if index not in lost]
+
+    assert AssimilateRange(survivors, mapping, rsa_key, 9000, 9100) == test_data[9000:9100]
+    with pytest.raises(ValueError):
+        AssimilateRange(survivors[:2], mapping, rsa_key, 9000, 9100)
+
+def test_packed_layout_has_no_byte_ranges(rsa_key):
+    _, mapping = Distribute(io.BytesIO(b"x" * 5000), rsa_key, num_shards=3, layout="packed")
+    with pytest.raises(ValueError):
+        shards_for_range(mapping, 0, 10)
+
+def test_shard_store_survives_reopen(tmp_path):
+    store = ShardStore(str(tmp_path), segment_size=1000)
+    shards = {("file", index): os.urandom(300) for index in range(10)}
+    for (file_id, index), shard in shards.items():
+        store.put(file_id, index, shard)
+    store.put("file", 3, b"replaced")
+    store.close()
+
+    store = ShardStore(str(tmp_path), segment_size=1000)
+    assert len(list(tmp_path.iterdir())) > 1
+    assert store.get("file", 3) == b"replaced"
+    assert all(store.get(*key) == shard for key, shard in shards.items() if key != ("file", 3))
+    assert store.get("file", 99) is None
+    store.close()
+
+def test_shard_store_compaction_keeps_deletes(tmp_path):
+    store = ShardStore(str(tmp_path), segment_size=1000, compaction_threshold=0.9)
+    for index in range(12):
+        store.put("file", index, bytes([index]) * 300)
+    for index in range(8):
+        assert store.delete("file", index)
+    assert not store.delete("file", 0)
+
+    assert store.compact() > 0
+    store.close()
+    store = ShardStore(str(tmp_path), segment_size=1000)
+    assert sorted(store.keys()) == [("file", index) for index in range(8, 12)]
+    assert store.get("file", 10) == bytes([10]) * 300
+    store.close()
+
+def test_shard_store_compaction_keeps_deletes_of_overwritten_shards(tmp_path):
+    store = ShardStore(str(tmp_path), segment_size=1000, compaction_threshold=0.9)
+    # Segment 0 keeps the first copy next to live filler; segment 1 only holds dead records
+    for index, data in enumerate([b"A" * 300] + [b"f" * 300] * 3):
+        store.put("f" if index == 0 else "filler", index, data)
+    store.put("f", 0, b"B" * 300)
+    for index in range(1, 4):
+        store.put("gone", index, b"g" * 300)
+    for index in range(1, 4):
+        assert store.delete("gone", index)
+    assert store.delete("f", 0)
+    assert store.compact() > 0
+    store.close()
+
+    # A full replay must not bring back the copy in segment 0
+    os.remove(os.path.join(str(tmp_path), "index.snapshot"))
+    store = ShardStore(str(tmp_path), segment_size=1000)
+    assert store.get("f", 0) is None
+    assert sorted(store.keys()) == [("filler", index) for index in range(1, 4)]
+    store.close()
+
+def test_shard_store_truncates_torn_record(tmp_path):
+    store = ShardStore(str(tmp_path))
+    store.put("file", 0, b"complete")
+    store.put("file", 1, b"torn record")
+    store.close()
+    segment = next(tmp_path.iterdir())
+    segment.write_bytes(segment.read_bytes()[:-3])
+
+    store = ShardStore(str(tmp_path))
+    assert store.get("file", 0) == b"complete"
+    assert ("file", 1) not in store
+    store.put("file", 1, b"rewritten")
+    assert store.get("file", 1) == b"rewritten"
+    store.close()
+
+def test_shard_store_imports_legacy_tree(tmp_path):
+    legacy = tmp_path / "shards"
+    (legacy / "abc").mkdir(parents=True)
+    (legacy / "abc" / "shard_0.bin").write_bytes(b"zero")
+    (legacy / "abc" / "shard_12.bin").write_bytes(b"twelve")
+
+    store = ShardStore(str(tmp_path / "store"))
+    assert store.import_legacy_tree(str(legacy)) == 2
+    assert store.get("abc", 12) == b"twelve"
+    assert not (legacy / "abc").exists()
+    store.close()
+
+def test_shard_store_warm_restart_from_snapshot(tmp_path, monkeypatch):
+    store = ShardStore(str(tmp_path), segment_size=1000, snapshot_interval=0)
+    for index in range(6):
+        store.put("a", index, bytes(100), expires_at=1000 + index)
+    store.put("b", 0, bytes(50))
+    store.close()
+
+    # Records written after the snapshot are replayed, the rest comes from the snapshot
+    store = ShardStore(str(tmp_path), segment_size=1000, snapshot_interval=0)
+    store.put("b", 1, bytes(70))
+    store.sync()
+    replayed = []
+    original = ShardStore._load_segment
+    monkeypatch.setattr(ShardStore, "_load_segment", lambda self, segment, offset, is_last: replayed.append(offset) or original(self, segment, offset, is_last))
+    restarted = ShardStore(str(tmp_path), segment_size=1000)
+    assert replayed and all(offset > 0 for offset in replayed)
+
+    assert len(restarted) == 8
+    assert restarted.total_bytes == 6 * 100 + 50 + 70
+    assert restarted.file_stats("a") == (6, 600)
+    assert restarted.file_stats("b") == (2, 120)
+    assert restarted.entry("a", 2).expires_at == 1002
+    assert restarted.get("b", 1) == bytes(70)
+
+def test_shard_store_drops_expired_deals(tmp_path):
+    store = ShardStore(str(tmp_path))
+    store.put("a", 0, b"short", expires_at=100)
+    store.put("a", 1, b"long", expires_at=300)
+    store.put("a", 0, b"renewed", expires_at=500)
+    store.put("b", 0, b"no deal")
+
+    assert store.delete_expired(now=400) == 1
+    assert sorted(store.keys()) == [("a", 0), ("b", 0)]
+    assert store.file_stats("a") == (1, len(b"renewed"))
+    store.close()
+
+def test_shard_cache_evicts_least_recently_used():
+    cache = ShardCache(max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"
+    cache.put("c", b"1234")
+
+    assert "b" not in cache and "a" in cache and "c" in cache
+    cache.put("huge", bytes(11))
+    assert "huge" not in cache
+    assert cache.get("b") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 1, "entries": 2, "bytes": 8}
+
+def test_shard_store_cache_invalidated_on_write(tmp_path):
+    store = ShardStore(str(tmp_path), cache_bytes=1024)
+    store.put("a", 0, b"first")
+    assert store.get("a", 0) == b"first"
+    assert store.get("a", 0) == b"first"
+    assert store.cache.hits == 1
+
+    store.put("a", 0, b"second")
+    assert store.get("a", 0) == b"second"
+    store.delete("a", 0)
+    assert store.get("a", 0) is None
+    store.close()
+
+def test_object_cache_serves_verified_objects(tmp_path):
+    cache = ObjectCache(str(tmp_path), max_bytes=1 << 20)
+    data = os.urandom(5000)
+    file_id = hashlib.sha256(data).hexdigest()
+    assert cache.lookup(file_id) is None
+
+    with cache.writer(file_id) as cached:
+        cached.write(data[:100])
+        cached.write(data[100:])
+    with cache.lookup(file_id) as cached_file:
+        assert cached_file.read() == data
+
+    # An object evicted after lookup stays readable through the open handle
+    cached_file = cache.lookup(file_id)
+    cache.invalidate(file_id)
+    assert cached_file.read() == data
+    cached_file.close()
+
+    # A corrupted copy is dropped instead of served
+    with cache.writer(file_id) as cached:
+        cached.write(data)
+    with open(os.path.join(str(tmp_path), file_id), "r+b") as cached_file:
+        cached_file.write(b"X")
+    assert cache.lookup(file_id) is None
+    assert file_id not in cache
+
+def test_object_cache_rejects_mismatch_and_evicts(tmp_path):
+    cache = ObjectCache(str(tmp_path), max_bytes=250)
+    with cache.writer("0" * 64) as cached:
+        cached.write(b"not the content of that id")
+    assert "0" * 64 not in cache
+
+    objects = [os.urandom(100) for _ in range(3)]
+    file_ids = [hashlib.sha256(data).hexdigest() for data in objects]
+    for index, (file_id, data) in enumerate(zip(file_ids, objects)):
+        with cache.writer(file_id) as cached:
+            cached.write(data)
+        os.utime(os.path.join(str(tmp_path), file_id), (index, index))
+    assert file_ids[0] not in cache and file_ids[2] in cache
+    assert cache.size == 200
+    assert sorted(os.listdir(tmp_path)) == sorted(file_ids[1:])
+
+def test_file_catalog_entries_round_trip():
+    entry = {
+        "filename": "report.pdf",
+        "size": 12345,
+        "shard_mapping": {get_hash(b"shard"): 0, DATA_KEY_FIELD: "ab" * 64, ERASURE_FIELD: {"data_shards": 3, "parity_shards": 2, "size": 900}},
+        "shard_locations": {0: (1, "cd" * 32, 0), 1: (-1, "Mixed Case", 7)},
+        "shard_metadata": {0: {"salts": [os.urandom(16)], "proofs": ["ef" * 32], "timesteps": 1}},
+        "deal_ends": 1700000000.5,
+        "previous_version": None,
+        "versioned": True,
+    }
+    assert unpack_entry(pack_entry(entry)) == entry
+    # Hex strings are stored as raw bytes
+    assert len(pack_entry({"hash": "ab" * 32})) < 64
+
+def test_file_catalog_summaries_skip_the_shard_mapping(tmp_path):
+    mapping = {os.urandom(32).hex(): index for index in range(50)}
+    entry = {"filename": "a.txt", "shard_mapping": mapping, "size": 7, "extension": "txt", "shard_count": 50, "previous_version": None, "nested": [{"x": 1.5}, (b"y", -3)]}
+    assert unpack_fields(pack_entry(entry), ["size", "previous_version", "missing"]) == {"size": 7, "previous_version": None}
+
+    catalog = FileCatalog(str(tmp_path))
+    catalog["file1"] = entry
+    catalog["file2"] = {"filename": "old.bin", "size": 1, "extension": "bin", "shard_mapping": {}, "previous_version": None}
+    summaries = dict(catalog.summaries(SUMMARY_FIELDS))
+    assert summaries["file1"] == {"filename": "a.txt", "size": 7, "extension": "txt", "shard_count": 50, "previous_version": None}
+    assert "shard_count" not in summaries["file2"]
+    catalog.close()
+
+def test_file_catalog_survives_restart(tmp_path):
+    catalog = FileCatalog(str(tmp_path), snapshot_interval=4)
+    for index in range(10):
+        catalog[f"file{index}"] = {"filename": f"name{index}", "size": index}
+    catalog["file2"] = {"filename": "renamed", "size": 2}
+    del catalog["file5"]
+
+    catalog.close()
+
+    # Records after the last snapshot are replayed, and a torn record is dropped
+    with open(tmp_path / LOG_NAME, "ab") as log_file:
+        log_file.write(b"BCT1\x00partial")
+    reopened = FileCatalog(str(tmp_path))
+    assert len(reopened) == 9 and "file5" not in reopened
+    assert reopened["file2"]["filename"] == "renamed"
+    assert dict(reopened.items())["file9"] == {"filename": "name9", "size": 9}
+    with pytest.raises(KeyError):
+        reopened["file5"]
+
+def test_file_catalog_compacts_and_invalidates_old_snapshot(tmp_path):
+    catalog = FileCatalog(str(tmp_path), compaction_threshold=0.5)
+    for index in range(6):
+        catalog[f"file{index}"] = {"size": index}
+    catalog.save_index()
+    for index in range(5):
+        del catalog[f"file{index}"]
+
+    assert catalog.generation >= 1
+    assert catalog.garbage_ratio < 0.5
+    catalog.close()
+    assert FileCatalog(str(tmp_path)).get("file5") == {"size": 5}
+
+def test_file_catalog_compacts_on_overwrites(tmp_path):
+    catalog = FileCatalog(str(tmp_path), compaction_threshold=0.5)
+    for version in range(20):
+        catalog["file"] = {"size": version}
+
+    assert catalog.generation >= 1
+    assert catalog.garbage_ratio < 0.5
+    assert catalog["file"] == {"size": 19}
+    catalog.close()
+
+def test_file_catalog_refuses_a_second_opener(tmp_path):
+    catalog = FileCatalog(str(tmp_path))
+    with pytest.raises(RuntimeError):
+        FileCatalog(str(tmp_path))
+
+    catalog.close()
+    FileCatalog(str(tmp_path)).close()
+
+def test_seed_derived_challenges_match_node_proofs():
+    seed = os.urandom(CHALLENGE_SEED_SIZE)
+    shard = os.urandom(3000)
+    proofs = expected_proofs(shard, seed, 4, 50)
+
+    assert len(proofs) == 50 * PROOF_SIZE
+    assert derive_salt(seed, 4, 7) == derive_salt(seed, 4, 7)
+    assert len({derive_salt(seed, shard_index, timestep) for shard_index in range(5) for timestep in range(50)}) == 250
+    for timestep in (0, 17, 49):
+        salt = derive_salt(seed, 4, timestep)
+        # What a storage node holding the shard answers to the challenge
+        assert verify_proof(proof_at(proofs, timestep), generate_proof(shard, salt, salt))
+    assert not verify_proof(proof_at(proofs, 0), generate_proof(shard[1:], derive_salt(seed, 4, 0), derive_salt(seed, 4, 0)))
+
+@pytest.mark.parametrize("file_size, peer_count", [(10 * 1024, 500), (300000, 3), (0, 4), (50000, 1)])
+def test_upload_plan_drives_distribute(rsa_key, file_size, peer_count):
+    test_data = os.urandom(file_size)
+    plan = plan_upload(file_size, peer_count, min_shard_size=4096, max_shard_size=65536)
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, plan=plan)
+
+    assert len(shards) == plan.total_shards
+    assert plan.shard_size % BLOCK_SIZE == 0 and plan.parity_shards < peer_count
+    assert Assimilate(list(enumerate(shards)), mapping, rsa_key) == test_data
+    # Consecutive shards land on different peers
+    assert {plan.peer_for(index) for index in range(min(peer_count, plan.total_shards))} == set(range(min(peer_count, plan.total_shards)))
+
+def test_upload_plan_bounds_shard_count_and_size():
+    # Many peers do not split a small file into tiny shards
+    small = plan_upload(10 * 1024, 500)
+    assert small.total_shards == 3 and small.shards_per_peer == 1
+    # Few peers do not force a large file into shards that overflow the memory budget
+    large = plan_upload(1 << 30, 3, max_memory=64 << 20, workers=4)
+    assert large.shard_size <= (64 << 20) // (2 + 2 * 8 + large.parity_shards)
+    assert large.shards_per_peer > 1
+    assert large.explain().count("\n") == len(large.reasons)
+    with pytest.raises(ValueError):
+        plan_upload(1 << 20, 2, peer_capacity=1 << 18)
+
+@pytest.mark.parametrize("file_size", [6000, 200000])
+def test_content_defined_stripes_keep_each_shard_on_its_own_peer(rsa_key, file_size):
+    plan = plan_upload(file_size, 5)
+    stream = DistributeStream(io.BytesIO(os.urandom(file_size)), rsa_key, parity_shards=plan.parity_shards, stripe_width=plan.chunk_stripe_width, chunking="cdc")
+    # Placed as the clients do, while the chunk count may still be open
+    peers = {shard_index: plan.for_chunks(stream.data_shards or shard_index + 1).peer_for(shard_index) for shard_index, _ in stream}
+
+    stripes = get_erasure_stripes(stream.shard_mapping)
+    assert len(stripes) > 1 or file_size < 10000
+    for stripe in stripes:
+        assert len({peers[shard_index] for shard_index in stripe}) == len(stripe)
+
+def test_split_data_is_zero_copy():
+    data = bytearray(os.urandom(10000))
+    shards = split_data(data, 3000)
+    assert [len(shard) for shard in shards] == [3000, 3000, 3000, 1000]
+    assert merge_data(shards) == data
+
+    # Shards are views of the input, not copies of it
+    data[0] ^= 0xFF
+    assert shards[0][0] == data[0]
+
+def test_numpy_codec_decode_matches_reedsolo_after_repair():
+    codec = NumpyRSCodec(DEFAULT_ERROR_CORRECTION)
+    corrupted = codec.encode(os.urandom(1000))
+    corrupted[3] ^= 0x55
+    corrupted[300] ^= 0xAA
+    expected = RSCodec(DEFAULT_ERROR_CORRECTION).decode(corrupted)
+    assert codec.decode(memoryview(corrupted))[:2] == expected[:2]
+    assert codec.decode_message(corrupted) == expected[0]
+
+def test_pipeline_copies_are_bounded(rsa_key):
+    # Peak traced allocations of a whole upload and download, in file sizes: what
+    # each returns plus about one more copy of the file in flight
+    test_data = os.urandom(4 << 20)
+    tracemalloc.start()
+    try:
+        shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=4, workers=1)
+        distribute_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        retained = tracemalloc.get_traced_memory()[0]
+        reconstructed_data = Assimilate(shards, mapping, rsa_key, workers=1)
+        assimilate_peak = tracemalloc.get_traced_memory()[1] - retained
+    finally:
+        tracemalloc.stop()
+
+    assert reconstructed_data == test_data
+    assert distribute_peak < 2.6 * len(test_data)
+    assert assimilate_peak < 2.1 * len(test_data)
+
+def _legacy_upload(shards, mapping):
+    """Rewrite an upload as it was stored before shard headers and checksums."""
+    payloads = [bytes(parse_shard(shard)[1]) for shard in shards]
+    legacy_mapping = {key: value for key, value in mapping.items() if key in (DATA_KEY_FIELD, ERASURE_FIELD)}
+    legacy_mapping.update(create_shard_mapping(payloads, "sha256"))
+    return payloads, legacy_mapping
+
+def test_checked_shard_decode_only_corrects_on_checksum_mismatch():
+    data = os.urandom(3000)
+    encoded = encode_shard(data)
+    assert strip_parity(encoded) == data
+    assert decode_checked_shard(encoded, shard_checksum(data)) == (data, "clean")
+    assert decode_checked_shard(encoded, None) == (data, "unchecked")
+
+    damaged = bytearray(encoded)
+    damaged[10] ^= 0xFF
+    assert decode_checked_shard(damaged, shard_checksum(data)) == (data, "corrected")
+    # A checksum that still fails after correction means the shard is lost
+    with pytest.raises(ReedSolomonError):
+        decode_checked_shard(damaged, shard_checksum(data) ^ 1)
+
+def test_assimilate_counts_decode_outcomes(rsa_key):
+    test_data = os.urandom(20000)
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=5, parity_shards=1)
+    assert len(mapping[CHECKSUMS_FIELD]) == 5
+
+    counters = {}
+    assert Assimilate(shards, mapping, rsa_key, counters=counters) == test_data
+    assert counters == {"clean": 4, "corrected": 0, "unchecked": 0}
+
+    # Shards and mappings from before checksums still take the full decode
+    legacy_shards, legacy_mapping = _legacy_upload(shards, mapping)
+    counters = {}
+    assert Assimilate(legacy_shards, legacy_mapping, rsa_key, counters=counters) == test_data
+    assert counters["unchecked"] == 4
+
+    # A shard that fails its checksum is treated as lost and rebuilt from parity
+    wrong = dict(mapping, **{CHECKSUMS_FIELD: [mapping[CHECKSUMS_FIELD][0] ^ 1] + mapping[CHECKSUMS_FIELD][1:]})
+    assert Assimilate(shards, wrong, rsa_key) == test_data
+
+def test_shards_carry_a_self_describing_header(rsa_key):
+    test_data = os.urandom(20000)
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=4)
+    for shard_index, shard in enumerate(shards):
+        header = read_header(shard)
+        assert header.shard_index == shard_index
+        assert header.payload_length == len(shard) - HEADER_SIZE
+        assert header.checksum == mapping[CHECKSUMS_FIELD][shard_index]
+        assert (header.block_size, header.parity_symbols) == (BLOCK_SIZE, DEFAULT_ERROR_CORRECTION)
+
+    # Headers place shards without hashing them, so a mapping of only the data key will do
+    unhashed = {DATA_KEY_FIELD: mapping[DATA_KEY_FIELD], CHECKSUMS_FIELD: mapping[CHECKSUMS_FIELD], **{str(i): i for i in range(4)}}
+    assert Assimilate(shards[::-1], unhashed, rsa_key) == test_data
+
+    # Legacy shards without a header are still placed by hash
+    legacy_shards, legacy_mapping = _legacy_upload(shards, mapping)
+    assert read_header(legacy_shards[0]) is None
+    assert Assimilate(legacy_shards[::-1], legacy_mapping, rsa_key) == test_data
+
+    # A damaged or truncated header is rejected without touching the payload
+    damaged = bytearray(shards[0])
+    damaged[5] ^= 0xFF
+    assert read_header(bytes(damaged)) is None
+    with pytest.raises(ValueError):
+        read_header(shards[0][:-1])
+
+def test_hash_ids_name_their_algorithm():
+    data = os.urandom(5000)
+    legacy_id = hash_file(io.BytesIO(data), "sha256")
+    assert legacy_id == hashlib.sha256(data).hexdigest()
+    assert id_algo(legacy_id) == "sha256"
+    blake_id = hash_file(io.BytesIO(data), "blake2b")
+    assert blake_id == format_id(hashlib.blake2b(data, digest_size=32).hexdigest(), "blake2b")
+    assert id_algo(blake_id) == "blake2b"
+
+    # SHA-256 shard keys are the original MD5 of SHA-256
+    assert shard_key(data, "sha256") == hashlib.md5(hashlib.sha256(data).digest()).hexdigest()
+    assert len(shard_key(data, "blake2b")) == 32
+
+def test_blake2b_uploads_round_trip(rsa_key, monkeypatch, tmp_path):
+    monkeypatch.setattr(file_upload, "HASH_ALGO", "blake2b")
+    test_data = os.urandom(30000)
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=3)
+    assert mapping[HASH_FIELD] == "blake2b"
+    assert get_hash(shards[0], "blake2b") in mapping
+    assert Assimilate(shards[::-1], mapping, rsa_key) == test_data
+
+    # Headerless shards are placed by the algorithm the mapping names
+    payloads = [bytes(parse_shard(shard)[1]) for shard in shards]
+    legacy_mapping = {DATA_KEY_FIELD: mapping[DATA_KEY_FIELD], HASH_FIELD: "blake2b", **create_shard_mapping(payloads, "blake2b")}
+    assert Assimilate(payloads[::-1], legacy_mapping, rsa_key) == test_data
+
+    # The object cache verifies each file ID with the algorithm it names
+    cache = ObjectCache(str(tmp_path))
+    file_id = hash_file(io.BytesIO(test_data), "blake2b")
+    with cache.writer(file_id) as cached:
+        cached.write(test_data)
+    with cache.lookup(file_id) as cached_file:
+        assert cached_file.read() == test_data
+
+def test_proofs_use_the_requested_algorithm():
+    data = os.urandom(4096)
+    seed = os.urandom(CHALLENGE_SEED_SIZE)
+    proofs = expected_proofs(data, seed, 0, 3, "blake2b")
+    salt = derive_salt(seed, 0, 2)
+    assert proof_at(proofs, 2, "blake2b") == generate_proof(data, salt, salt, "blake2b")
+    assert generate_proof(data, salt, salt, "blake2b") != generate_proof(data, salt, salt, "sha256")
+    with pytest.raises(ValueError):
+        generate_proof(data, salt, salt, "md4")
+
+def test_expected_proofs_hash_shards_in_blocks():
+    # Every timestep is hashed in one pass over the shard, across block boundaries
+    data = bytearray(os.urandom(PROOF_BLOCK_SIZE * 5 // 2))
+    seed = os.urandom(CHALLENGE_SEED_SIZE)
+    proofs = expected_proofs(data, seed, 3, 4)
+    for timestep in range(4):
+        salt = derive_salt(seed, 3, timestep)
+        assert proof_at(proofs, timestep) == generate_proof(data, salt, salt)
+    assert expected_proofs(data, seed, 3, 0) == b""
+
+def test_compressed_upload_round_trips_and_seeks(rsa_key):
+    lines = [f"{i:08d} GET /api/items/{i % 97} 200 {i * 7 % 1000}ms\n".encode() for i in range(20000)]
+    test_data = b"".join(lines)
+    plain_shards, _ = Distribute(io.BytesIO(test_data), rsa_key, num_shards=6, parity_shards=2, layout="striped")
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=6, parity_shards=2, layout="striped", compression="zlib")
+    assert mapping[COMPRESSION_FIELD]["size"] == len(test_data)
+    assert len(shards) == 6
+    assert sum(map(len, shards)) < sum(map(len, plain_shards)) / 3
+    assert b"".join(AssimilateStream(shards[::-1], mapping, rsa_key)) == test_data
+
+    # Ranges decode only the frames covering them, across frame boundaries too
+    frame_size = mapping[COMPRESSION_FIELD]["frame_size"]
+    for start, end in [(0, 1), (frame_size - 10, frame_size + 10), (len(test_data) - 5, len(test_data)), (1000, 1000)]:
+        covering = shards_for_range(mapping, start, end)
+        assert AssimilateRange([(index, shards[index]) for index in covering], mapping, rsa_key, start, end) == test_data[start:end]
+
+def test_incompressible_frames_are_stored_as_is(rsa_key):
+    test_data = os.urandom(300000)
+    assert sample_entropy(test_data) > 7.5
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=3, compression="zlib")
+    compression = mapping[COMPRESSION_FIELD]
+    assert compression["stored_size"] == len(test_data) + len(compression["frames"]) * FRAME_HEADER.size
+    assert Assimilate(shards, mapping, rsa_key) == test_data
+
+    # Content-defined uploads stay uncompressed so chunks keep matching across versions
+    _, cdc_mapping = Distribute(io.BytesIO(test_data), rsa_key, chunking="cdc", compression="zlib")
+    assert COMPRESSION_FIELD not in cdc_mapping
+
+def test_compressed_upload_is_planned_from_its_stored_size(rsa_key, monkeypatch):
+    # Random nibbles compress to about half, which crosses the serial/parallel threshold
+    monkeypatch.setattr(file_upload, "PARALLEL_MIN_SIZE", 400000)
+    monkeypatch.setattr(planner, "PARALLEL_MIN_SIZE", 400000)
+    test_data = bytes(random.Random(7).getrandbits(4) for _ in range(600000))
+    with CompressingReader(io.BytesIO(test_data), "zlib") as source:
+        source.spool()
+        assert source.stored_size < 400000
+        plan = plan_upload(source.stored_size, 3, min_shard_size=4096, max_memory=1 << 20, workers=4)
+        stream = DistributeStream(source, rsa_key, plan=plan, max_memory=1 << 20, workers=4, backend="thread")
+        shards = dict(stream)
+        # A reader the caller spooled is the caller's to close
+        assert not source.closed
+    assert source.closed
+    assert len(shards) == plan.total_shards
+    assert b"".join(AssimilateStream(shards.items(), stream.shard_mapping, rsa_key)) == test_data
+
+    # A plan made for another size no longer holds, and nothing is sent
+    with pytest.raises(ValueError):
+        DistributeStream(io.BytesIO(test_data), rsa_key, plan=plan, compression="none")
+
+    # A spool the stream made itself is closed once the stream has been read
+    own = DistributeStream(io.BytesIO(test_data), rsa_key, num_shards=4, compression="zlib")
+    assert own.compressor.seekable() and not own.compressor.closed
+    list(own)
+    assert own.compressor.closed
+
+def test_cdc_upload_beyond_max_shards_is_striped(rsa_key):
+    # More content-defined chunks than erasure coefficients used to fail partway through
+    test_data = random.Random(3).randbytes(2600000)
+    stream = DistributeStream(io.BytesIO(test_data), rsa_key, parity_shards=2, chunking="cdc")
+    assert stream.data_shards + 2 > MAX_SHARDS
+    shards = dict(stream)
+    mapping = stream.shard_mapping
+    stripes = get_erasure_stripes(mapping)
+    assert len(stripes) > 1 and all(len(stripe) <= MAX_SHARDS for stripe in stripes)
+    assert len(shards) == mapping[ERASURE_FIELD]["data_shards"] + 2 * len(stripes)
+
+    # Every stripe survives the loss of two of its shards
+    lost = {stripe[position] for stripe in stripes for position in (0, 5)}
+    assert b"".join(AssimilateStream([(index, shard) for index, shard in shards.items() if index not in lost], mapping, rsa_key)) == test_data
+
+def test_erasure_stripes_rebuild_independently(rsa_key):
+    test_data = os.urandom(40000)
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, num_shards=9, parity_shards=1, layout="striped", stripe_width=3)
+    assert get_erasure_stripes(mapping) == [[0, 1, 2, 8], [3, 4, 5, 9], [6, 7, 10]]
+    assert Assimilate([shard for index, shard in enumerate(shards) if index not in (1, 9, 7)], mapping, rsa_key) == test_data
+    with pytest.raises(ValueError):
+        Assimilate([shard for index, shard in enumerate(shards) if index not in (3, 4)], mapping, rsa_key)
+
+    # A range read rebuilds a lost covering shard from its own stripe only
+    start = data_extents(mapping)[4][0] + 100
+    end = start + 1000
+    assert shards_for_range(mapping, start, end) == [4]
+    assert AssimilateRange([(index, shards[index]) for index in (3, 5, 9)], mapping, rsa_key, start, end) == test_data[start:end]
+
+def test_planned_erasure_retrieval_holds_one_stripe(rsa_key):
+    test_data = os.urandom(300000)
+    plan = plan_upload(len(test_data), 4, min_shard_size=4096, max_memory=65536, workers=1)
+    assert plan.stripes > 1 and plan.stripe_width * plan.shard_size <= 65536
+    shards, mapping = Distribute(io.BytesIO(test_data), rsa_key, plan=plan)
+    assert len(shards) == plan.total_shards
+    stripes = get_erasure_stripes(mapping)
+    assert all(len({plan.peer_for(index) for index in stripe[:4]}) == min(4, len(stripe)) for stripe in stripes)
+
+    # The first data shard of every stripe is lost; the first stripe is rebuilt
+    # and yielded before any shard of the next one is pulled
+    pulled = []
+    def arrivals():
+        for stripe in stripes:
+            for index in stripe[1:]:
+                pulled.append(index)
+                yield index, shards[index]
+    stream = AssimilateStream(arrivals(), mapping, rsa_key, workers=1)
+    first_chunk = next(stream)
+    assert set(pulled) <= set(stripes[0])
+    assert first_chunk + b"".join(stream) == test_data
+
 if __name__ == "__main__":
     pytest.main(["-v", "test_file_layer.py"])
\ No newline at end of file
@@ -1,8 +1,12 @@
 import pytest
 import time
+import io
 import json
+import socket
 import threading
+import network_layer.network as network
 from network_layer.network import Network
+from network_layer.framing import FRAME_HEADER, FRAME_MAGIC, HELLO, LEGACY_HEADER_LEN, MESSAGE, REPLY, pack_legacy, read_message, write_frame
 
 
 @pytest.fixture(scope="session")
@@ -136,3 +140,74 @@ def test_invalid_connection():
     with pytest.raises(Exception):
         # Try to connect to invalid port
         node.create_connection("localhost", 9999)
+
+
+def test_frames_and_legacy_messages_share_a_connection():
+    """Test that binary frames carry raw payloads and legacy JSON still reads"""
+    sender, receiver = socket.socketpair()
+    payload = bytes(range(256)) * 1000
+    thread = threading.Thread(target=lambda: (write_frame(sender, MESSAGE, 7, {"title": "#STORE_SHARD"}, payload), sender.sendall(pack_legacy({"title": "#TEST", "message": "Test message"}))))
+    thread.start()
+    with receiver.makefile("rb") as reader:
+        frame = read_message(reader)
+        assert (frame.request_id, frame.metadata, frame.payload) == (7, {"title": "#STORE_SHARD"}, payload)
+        legacy = read_message(reader)
+        assert legacy.version == 0 and legacy.metadata["message"] == "Test message"
+    thread.join()
+    sender.close()
+    receiver.close()
+
+
+def test_negotiation_falls_back_to_json_for_old_nodes(monkeypatch):
+    """Test that a peer which never answers the frame offer gets legacy JSON"""
+    monkeypatch.setattr(network, "FRAME_HANDSHAKE_TIMEOUT", 0.1)
+    node = Network("localhost")
+    conn, old_node = socket.socketpair()
+    assert node.negotiate(conn) == 0
+    assert node.frame_version(conn) == 0
+    with pytest.raises(ValueError):
+        node.send(conn, node.short_json_msg("#STORE_SHARD"), payload=b"shard")
+    conn.close()
+    old_node.close()
+
+
+def test_replies_are_routed_to_their_requests():
+    """Test that pipelined requests get their own replies when answered out of order"""
+    node = Network("localhost")
+    conn, peer = socket.socketpair()
+
+    def serve():
+        with peer.makefile("rb") as reader:
+            read_message(reader)  # The frame offer
+            write_frame(peer, HELLO, 0, {"version": 1})
+            requests = [read_message(reader) for _ in range(5)]
+            for frame in reversed(requests):
+                write_frame(peer, REPLY, frame.request_id, {"message": frame.metadata["message"]}, frame.payload * 3)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    assert node.negotiate(conn) == 1
+    futures = [node.request_async(conn, node.short_json_msg("#REQUEST_SHARD", index), payload=bytes([index]) * 1000) for index in range(5)]
+    for index, future in enumerate(futures):
+        reply, payload = future.result(timeout=5)
+        assert reply["message"] == index and payload == bytes([index]) * 3000
+    thread.join()
+
+    # Requests still waiting when the connection drops fail instead of hanging
+    pending = node.request_async(conn, node.short_json_msg("#REQUEST_SHARD", 5))
+    peer.close()
+    with pytest.raises(ConnectionError):
+        pending.result(timeout=5)
+    conn.close()
+
+
+def test_oversized_frames_are_refused_before_reading():
+    """Test that lengths forged in a header cannot force a huge allocation"""
+    forged = FRAME_HEADER.pack(FRAME_MAGIC, 1, MESSAGE, 0, 2, 1 << 40) + b"{}"
+    with pytest.raises(ValueError):
+        read_message(io.BytesIO(forged))
+    with pytest.raises(ValueError):
+        read_message(io.BytesIO(f"{1 << 40:^{LEGACY_HEADER_LEN}}".encode()))
+    with pytest.raises(ValueError):
+        read_message(io.BytesIO(pack_legacy({"id": 1})), max_size=4)
+    assert read_message(io.BytesIO(pack_legacy({"id": 1}))).metadata == {"id": 1}
@@ -1,15 +1,29 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 from Crypto.PublicKey import RSA
 import os
 import threading
-import hashlib
-from file_layer import Distribute, Assimilate
+from file_layer import DistributeStream, AssimilateRange, AssimilateStream
+from file_layer.metadata import get_erasure_stripes, get_shard_count, CHUNKS_FIELD, ERASURE_FIELD
+from file_layer.object_cache import ObjectCache
+from file_layer.hashing import hash_file
+from file_layer.file_catalog import FileCatalog, SUMMARY_FIELDS
+from file_layer.planner import UploadPlan, plan_upload
+from file_layer.compression import CompressingReader, resolve_codec
+from file_layer.config import COMPRESSION
+from file_layer.file_retrieval import data_extents, shards_for_range
 from network_layer import Network, Message
-from typing import Optional, Dict, Any, List
+from network_layer.config import REQUEST_TIMEOUT
+from typing import Optional, Dict, Any, BinaryIO, List, Iterator, Tuple, Union
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from itertools import islice
+from collections import deque
+from contextlib import ExitStack
 import socket
+import time
 
 # Constants and Global Variables
 GENESIS_PORT = 5050
+FETCH_PIPELINE_DEPTH = 8  # Shard requests kept in flight while shards are fetched
 app = Flask(__name__)
 
 # Initialize Flask application
@@ -21,91 +35,203 @@ class P2PFileStorage:
         self.network = Network(ip)
         self.port = port
         self.genesis_ip = genesis_ip
-        self.file_table: Dict[str, Dict[str, Any]] = {}
+        self.file_table = FileCatalog()
         self.network.start(port)
         self.msg_gen = Message(sender_ip=ip, sender_port=port)
+        self.object_cache = ObjectCache()
         if genesis_ip:
             self.network.join_network()
 
-    def _generate_file_id(self, file_content: bytes) -> str:
-        file_hash = hashlib.sha256(file_content).hexdigest()
-        return file_hash
+    def _generate_file_id(self, file_obj: Any) -> str:
+        return hash_file(file_obj)
 
-    def distribute_file(self, file_path: str, private_key: bytes) -> Optional[str]:
+    def distribute_file(self, file_path: str, private_key: bytes, versioned: bool = False, previous_version: Optional[str] = None) -> Optional[str]:
         filename = os.path.basename(file_path)
         extension = os.path.splitext(filename)[1]
         file_size = os.path.getsize(file_path)
         peers = self.network.get_connections()
-        num_shards = len(peers)
-        if num_shards < 1:
+        if len(peers) < 1:
             return None
+        # Versioned uploads reference the chunks the previous version already stored
+        previous = None
+        if previous_version:
+            previous = self.file_table.get(previous_version)
+            if not previous or CHUNKS_FIELD not in previous["shard_mapping"]:
+                return None
 
-        with open(file_path, 'rb') as file_obj:
-            file_content = file_obj.read()
-            file_id = self._generate_file_id(file_content)
-            encrypted_shards, shard_mapping = Distribute(
-                file_obj, private_key, num_shards=num_shards)
+        shard_locations: Dict[int, Tuple[int, str, int]] = {}
+        with open(file_path, 'rb') as file_obj, ExitStack() as cleanup:
+            file_id = self._generate_file_id(file_obj)
+            file_obj.seek(0)
+            source = file_obj
+            planned_size = file_size
+            codec = resolve_codec(COMPRESSION)
+            if codec is not None and not (versioned or previous_version):
+                # The spool's temporary file is closed once the upload is done
+                source = cleanup.enter_context(CompressingReader(file_obj, codec)).spool()
+                planned_size = source.stored_size
+            plan = plan_upload(planned_size, len(peers))
+            if versioned or previous_version:
+                shard_stream = DistributeStream(file_obj, private_key, parity_shards=plan.parity_shards, stripe_width=plan.chunk_stripe_width, chunking="cdc", previous=previous and previous["shard_mapping"])
+            else:
+                shard_stream = DistributeStream(source, private_key, chunking="fixed", plan=plan)
+            for shard_index, shard in shard_stream:
+                peer_indx = self._peer_for(plan, shard_stream, shard_index)
+                self._send_shard(peers[peer_indx], shard, shard_index, file_id)
+                shard_locations[shard_index] = (peer_indx, file_id, shard_index)
+            shard_mapping = shard_stream.shard_mapping
 
-        peer_mapping = {peer_indx: -1 for peer_indx in range(len(peers))}
-        for shard_index, shard in enumerate(encrypted_shards):
-            peer = peers[shard_index % len(peers)]
-            self._send_shard(peer, shard, shard_index, file_id)
-            peer_mapping[shard_index % len(peers)] = shard_index
+        for shard_index, previous_index in shard_stream.reused.items():
+            shard_locations[shard_index] = previous["shard_locations"][previous_index]
 
         self.file_table[file_id] = {
             "filename": filename,
             "size": file_size,
             "extension": extension,
             "shard_mapping": shard_mapping,
-            "peer_mapping": peer_mapping,
+            "shard_count": get_shard_count(shard_mapping),
+            "shard_locations": dict(sorted(shard_locations.items())),
+            "previous_version": previous_version,
+            "plan": plan.explain(),
         }
         return file_id
 
-    def retrieve_file(self, file_id: str, private_key: bytes) -> Optional[str]:
+    @staticmethod
+    def _peer_for(plan: UploadPlan, shard_stream: DistributeStream, shard_index: int) -> int:
+        """Peer for a shard of shard_stream; content-defined uploads are placed by their own chunk count and stripes."""
+        if shard_stream.chunking != "cdc":
+            return plan.peer_for(shard_index)
+        # Every shard before the first parity shard is a data shard, so the count can still be open
+        return plan.for_chunks(shard_stream.data_shards or shard_index + 1).peer_for(shard_index)
+
+    def retrieve_file(self, file_id: str, private_key: bytes) -> Optional[Union[str, BinaryIO]]:
         file_info = self.file_table.get(file_id)
         if not file_info:
             return None
 
         filename = file_info["filename"]
         shard_mapping = file_info["shard_mapping"]
-        peer_mapping = file_info["peer_mapping"]
+        shard_locations = file_info["shard_locations"]
+
+        # Objects served before are sent straight from the verified local cache, through
+        # a handle that stays readable if the object is evicted meanwhile
+        cached_file = self.object_cache.lookup(file_id)
+        if cached_file:
+            return cached_file
+
         peers = self.network.get_connections()
-        shards = []
-        for peer_indx, shard_index in peer_mapping.items():
-            shard = self._request_shard(peers[peer_indx], file_id, shard_index)
-            if shard:
-                shards.append(shard)
-
-        original_data = Assimilate(
-            shards, shard_mapping, private_key)
+        if ERASURE_FIELD in shard_mapping:
+            # Shards are requested stripe by stripe, so each stripe is rebuilt and written before the next is held
+            in_stripe_order = [shard_index for stripe in get_erasure_stripes(shard_mapping) for shard_index in stripe]
+            shards = self._fetch_shards_as_completed(peers, {shard_index: shard_locations[shard_index] for shard_index in in_stripe_order})
+        else:
+            shards = self._fetch_shards_in_order(peers, shard_locations)
+
         output_path = f"retrieved_{filename}"
-        with open(output_path, 'wb') as out_file:
-            out_file.write(original_data)
+        try:
+            with open(output_path, 'wb') as out_file, self.object_cache.writer(file_id) as cached:
+                for chunk in AssimilateStream(shards, shard_mapping, private_key):
+                    out_file.write(chunk)
+                    cached.write(chunk)
+        finally:
+            shards.close()
         return output_path
 
+    def read_range(self, file_id: str, private_key: bytes, start: int, end: int) -> Optional[bytes]:
+        file_info = self.file_table.get(file_id)
+        if not file_info:
+            return None
+
+        shard_mapping = file_info["shard_mapping"]
+        shard_locations = file_info["shard_locations"]
+        needed = set(shards_for_range(shard_mapping, start, end))
+        peers = self.network.get_connections()
+        shards = list(self._fetch_shards_in_order(peers, {shard_index: location for shard_index, location in shard_locations.items() if shard_index in needed}))
+        if len(shards) < len(needed) and ERASURE_FIELD in shard_mapping:
+            fetched = {shard_index for shard_index, _ in shards}
+            stripes = [stripe for stripe in get_erasure_stripes(shard_mapping) if any(shard_index in needed and shard_index not in fetched for shard_index in stripe)]
+            others = {shard_index: shard_locations[shard_index] for stripe in stripes for shard_index in stripe if shard_index not in needed}
+            shards += self._fetch_shards_as_completed(peers, others)
+        return AssimilateRange(shards, shard_mapping, private_key, start, end)
+
+    def _fetch_shards_in_order(self, peers: List[socket.socket], shard_locations: Dict[int, Tuple[int, str, int]]) -> Iterator[Tuple[int, bytes]]:
+        # Keep a few requests in flight while shards are consumed in order
+        in_flight: deque = deque()
+        try:
+            for shard_index, (peer_indx, stored_id, stored_index) in shard_locations.items():
+                in_flight.append((shard_index, self._request_shard(peers[peer_indx], stored_id, stored_index)))
+                if len(in_flight) >= FETCH_PIPELINE_DEPTH:
+                    yield from self._received_shard(*in_flight.popleft())
+            while in_flight:
+                yield from self._received_shard(*in_flight.popleft())
+        finally:
+            for _, request in in_flight:
+                request.cancel()
+
+    def _fetch_shards_as_completed(self, peers: List[socket.socket], shard_locations: Dict[int, Tuple[int, str, int]]) -> Iterator[Tuple[int, bytes]]:
+        # Requests go out in order, FETCH_PIPELINE_DEPTH at a time, each dropped REQUEST_TIMEOUT seconds after it was sent
+        locations = iter(shard_locations.items())
+        in_flight: Dict[Future, Tuple[int, float]] = {}
+        try:
+            while True:
+                for shard_index, (peer_indx, stored_id, stored_index) in islice(locations, FETCH_PIPELINE_DEPTH - len(in_flight)):
+                    in_flight[self._request_shard(peers[peer_indx], stored_id, stored_index)] = (shard_index, time.monotonic() + REQUEST_TIMEOUT)
+                if not in_flight:
+                    return
+                first_deadline = min(deadline for _, deadline in in_flight.values())
+                done, _ = wait(in_flight, timeout=max(0.0, first_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from self._received_shard(in_flight.pop(future)[0], future)
+                for future, (_, deadline) in list(in_flight.items()):
+                    if deadline <= time.monotonic():
+                        del in_flight[future]
+                        future.cancel()
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    @staticmethod
+    def _received_shard(shard_index: int, request: Future) -> Iterator[Tuple[int, bytes]]:
+        try:
+            response, payload = request.result(REQUEST_TIMEOUT)
+        except (OSError, ValueError):
+            return
+        shard_data = response.get("message", {}).get("shard_data") if response else None
+        shard = payload or (bytes.fromhex(shard_data) if shard_data else None)
+        if shard:
+            yield shard_index, shard
+
     def list_files(self) -> Dict[str, Dict[str, Any]]:
-        return self.file_table
+        """Summaries of the stored files; the shard mappings are only decoded for entries from before shard_count."""
+        files = {}
+        for file_id, summary in self.file_table.summaries(SUMMARY_FIELDS):
+            if "shard_count" not in summary:
+                summary["shard_count"] = get_shard_count(self.file_table[file_id]["shard_mapping"])
+            files[file_id] = summary
+        return files
 
     def _send_shard(self, peer: str, shard: bytes, shard_index: int, file_id: str) -> None:
         message = {
             "file_id": file_id,
-            "shard_index": shard_index,
-            "shard_data": shard.hex()
+            "shard_index": shard_index
         }
+        payload = shard if self.network.frame_version(peer) else None
+        if payload is None:
+            message["shard_data"] = shard.hex()
         self.network.send(peer, self.msg_gen.msg(
-            message, "#STORE_SHARD"), hasResponse=1)
+            message, "#STORE_SHARD"), hasResponse=1, payload=payload)
 
-    def _request_shard(self, peer: socket.socket, file_id: str, shard_index: int) -> Optional[bytes]:
+    def _request_shard(self, peer: socket.socket, file_id: str, shard_index: int) -> Future:
         message = {
             "file_id": file_id,
             "shard_index": shard_index
         }
-        response = self.network.send(peer, self.msg_gen.msg(
-            message, "#REQUEST_SHARD"), hasResponse=1)
-        if response:
-            shard_data = json.loads(response).get("message", {}).get("shard_data")
-            return bytes.fromhex(shard_data) if shard_data else None
-        return None
+        try:
+            return self.network.request_async(peer, self.msg_gen.msg(message, "#REQUEST_SHARD"))
+        except OSError as error:
+            failed: Future = Future()
+            failed.set_exception(error)
+            return failed
 
     def list_peers(self) -> List[tuple[str, int]]:
         return self.network.get_peers()
@@ -130,15 +256,31 @@ def upload_file():
     file = request.files['file']
     private_key_str = request.form.get("private_key")
     private_key = RSA.import_key(private_key_str)
-    file_id = cli_instance.distribute_file(file_path=file.filename, private_key=private_key)
+    previous_version = request.form.get("previous_version") or None
+    versioned = request.form.get("versioned") == "true" or previous_version is not None
+    file_id = cli_instance.distribute_file(file_path=file.filename, private_key=private_key, versioned=versioned, previous_version=previous_version)
     return jsonify({"file_id": file_id}), 200 if file_id else 500
 
 @app.route('/download/<file_id>', methods=['GET'])
 def download_file(file_id):
     private_key_str = request.args.get("private_key")
     private_key = RSA.import_key(private_key_str)
-    file_path = cli_instance.retrieve_file(file_id=file_id, private_key=private_key)
-    return send_file(file_path, as_attachment=True) if file_path else ("File not found", 404)
+
+    # Range requests (video seeks, partial reads) only fetch the shards that cover the range;
+    # packed uploads cannot be read by range and are sent whole
+    file_info = cli_instance.file_table.get(file_id)
+    if request.range and file_info and data_extents(file_info["shard_mapping"]) is not None:
+        byte_range = request.range.range_for_length(file_info["size"])
+        if byte_range is None:
+            return "Requested range not satisfiable", 416
+        start, end = byte_range
+        data = cli_instance.read_range(file_id=file_id, private_key=private_key, start=start, end=end)
+        response = Response(data, 206, mimetype="application/octet-stream")
+        response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{file_info['size']}"
+        return response
+
+    retrieved = cli_instance.retrieve_file(file_id=file_id, private_key=private_key)
+    return send_file(retrieved, as_attachment=True, download_name=file_info["filename"]) if retrieved else ("File not found", 404)
 
 @app.route('/list', methods=['GET'])
 def list_files():